@@ -1,23 +1,28 @@
-from logging_setup import setup_logging
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import PlainTextResponse
-import os, logging
-from retrieval import connect, search_messages, find_last_call_anchor, get_window
+import logging
+import db, peers
+from retrieval import find_last_call_anchor, get_window
 from format_helpers import synthesize_answer, summarize_window
 
 router = APIRouter()
-logger = setup_logging('telegram_briefs')
-DB_PATH = os.getenv("DB_PATH", "briefs.db")
+logger = logging.getLogger(__name__)
+
+# Plain def routes: FastAPI runs them in its threadpool, so the pool acquire,
+# SQLite reads and numpy search below don't block the event loop.
 
 @router.post("/question")
-async def question(request: Request,
-                   text: str = Form(default=""),
-                   user_name: str = Form(default=""),
-                   user_id: str = Form(default="")):
+def question(request: Request,
+             text: str = Form(default=""),
+             channel_id: str = Form(default=""),
+             user_name: str = Form(default=""),
+             user_id: str = Form(default="")):
     try:
         logger.info("/question user=%s(%s) text=%r", user_name, user_id, text)
-        conn = connect(DB_PATH)
-        hits = search_messages(conn, text, limit=200)
+        import embeddings   # numpy: not on the cold-start path
+        with db.connection() as conn:
+            peer_id = peers.resolve(conn, channel_id)
+            hits = embeddings.search(conn, peer_id, text, limit=200)
         answer = synthesize_answer(text, hits)
         return PlainTextResponse(answer)
     except Exception:
@@ -25,15 +30,17 @@ async def question(request: Request,
         return PlainTextResponse("Sorry, something went wrong.", status_code=500)
 
 @router.post("/callprep")
-async def callprep(request: Request,
-                   text: str = Form(default=""),
-                   user_name: str = Form(default=""),
-                   user_id: str = Form(default="")):
+def callprep(request: Request,
+             text: str = Form(default=""),
+             channel_id: str = Form(default=""),
+             user_name: str = Form(default=""),
+             user_id: str = Form(default="")):
     try:
         logger.info("/callprep user=%s(%s) text=%r", user_name, user_id, text)
-        conn = connect(DB_PATH)
-        start = find_last_call_anchor(conn, fallback_hours=48)
-        rows = get_window(conn, start)
+        with db.connection() as conn:
+            peer_id = peers.resolve(conn, channel_id)
+            start = find_last_call_anchor(conn, peer_id, fallback_hours=48)
+            rows = get_window(conn, peer_id, start)
         summary = summarize_window(rows)
         return PlainTextResponse(summary)
     except Exception:
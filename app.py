@@ -1,35 +1,95 @@
+"""
+The Slack slash-command API: create_app() loads .env, checks the required
+settings and builds the ASGI app. The module-level `app`, what the Procfile
+serves (`uvicorn app:app`), is created by the first access to it.
 
-import os, hmac, hashlib, time, sqlite3, threading
+Cold start matters (the platform scales to zero and Slack wants an ack within
+3s), so importing this module reads no files and builds no clients: the
+OpenAI client and the Slack sender are made on first use (get_ai(),
+get_slack()), and openai / numpy, most of a cold import, are loaded in a
+background thread once the app has started. check_import_time.py keeps it
+that way.
+"""
+import os, hmac, hashlib, time, asyncio
 from urllib.parse import parse_qs
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import PlainTextResponse, JSONResponse
 from dotenv import load_dotenv
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-from openai import OpenAI
 import logging
+import api_extra
+import calls
+import db
+import facts
+import hot_window
+import llm
+import metrics
+import packer
+import peers
+import pipeline
+import retrieval
+import sessions
+import slack_sender
+import summary_cache
+import timestamps
+from executor import DUPLICATE, QUEUED, JobExecutor, current_job
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# settings: read by configure() once .env is loaded
+OPENAI_KEY = ""
+SLACK_SIGNING_SECRET = ""
+SLACK_BOT_TOKEN = ""
+SKIP_VERIFY = False
+SLACK_API_URL = "https://slack.com/api/"
 
-load_dotenv()
-DB = "briefs.db"
-OPENAI_KEY = os.getenv("OPENAI_API_KEY")
-SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET", "")
-SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN", "")
-SKIP_VERIFY = os.getenv("SLACK_SKIP_VERIFY","0") == "1"
-assert OPENAI_KEY, "Missing OPENAI_API_KEY in .env"
-assert SLACK_BOT_TOKEN, "Missing SLACK_BOT_TOKEN in .env"
-
-ai = OpenAI(api_key=OPENAI_KEY)
-slack = WebClient(token=SLACK_BOT_TOKEN)
+ai = None      # get_ai()
+slack = None   # get_slack()
+executor = JobExecutor()   # sized by configure()
+latest_summaries = summary_cache.LatestSummaries()
 tz = ZoneInfo("Australia/Brisbane")
-PEER_ID = 7740422022
 
-app = FastAPI()
+def configure():
+    """Load .env and read the settings; raises RuntimeError if a required one is missing."""
+    global OPENAI_KEY, SLACK_SIGNING_SECRET, SLACK_BOT_TOKEN, SKIP_VERIFY, SLACK_API_URL
+    load_dotenv()
+    OPENAI_KEY = os.getenv("OPENAI_API_KEY", "")
+    SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET", "")
+    SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN", "")
+    SKIP_VERIFY = os.getenv("SLACK_SKIP_VERIFY", "0") == "1"
+    SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+    executor.concurrency = int(os.getenv("LLM_CONCURRENCY", "4"))
+    executor.max_queue = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+    executor.max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    missing = [k for k, v in (("OPENAI_API_KEY", OPENAI_KEY), ("SLACK_BOT_TOKEN", SLACK_BOT_TOKEN)) if not v]
+    if missing:
+        raise RuntimeError(f"Missing {', '.join(missing)} in .env")
+
+def get_ai():
+    """The process's AsyncOpenAI client, built on first use (openai is ~0.3s of import)."""
+    global ai
+    if ai is None:
+        from openai import AsyncOpenAI
+        ai = AsyncOpenAI(api_key=OPENAI_KEY)
+    return ai
+
+def get_slack() -> slack_sender.SlackSender:
+    global slack
+    if slack is None:
+        slack = slack_sender.SlackSender(SLACK_BOT_TOKEN, base_url=SLACK_API_URL)
+    return slack
+
+def preload():
+    """Import what the first job needs and load the hot windows, so it doesn't pay for them; runs in a thread after startup."""
+    try:
+        import openai, embeddings   # noqa: F401
+        with db.connection() as con:
+            ids = [p.peer_id for p in peers.list_peers(con)]
+        hot_window.windows.warm(ids)
+    except Exception:
+        logger.exception("preload failed")
 
 def verify_slack(req: Request, body: bytes) -> bool:
     ts = req.headers.get("X-Slack-Request-Timestamp", "")
@@ -46,51 +106,70 @@ def verify_slack(req: Request, body: bytes) -> bool:
     calc = f"v0={mac}"
     return hmac.compare_digest(calc, sig)
 
-def db_connect():
-    return sqlite3.connect(DB)
-
 def get_today_date_label():
     now_local = datetime.now(tz)
     return f"{int(now_local.strftime('%d'))}/{int(now_local.strftime('%m'))}/{now_local.strftime('%y')}"
 
 def get_latest_summary_for_channel(channel_id: str):
-    con = db_connect()
-    row = con.execute(
-        "SELECT ts, text, date_label FROM summaries WHERE channel_id=? ORDER BY posted_utc DESC LIMIT 1",
-        (channel_id,)
-    ).fetchone()
-    con.close()
-    if row:
-        return {"ts": row[0], "text": row[1], "date_label": row[2]}
-    return None
-
-def post_in_thread(channel_id: str, thread_ts: str, text: str):
-    try:
-        slack.chat_postMessage(channel=channel_id, text=text, thread_ts=thread_ts)
-    except SlackApiError as e:
-        print("Slack thread post failed:", e.response.get("error"))
-
-def fetch_messages_since(iso_utc: str):
-    con = db_connect()
-    rows = con.execute("""
-        SELECT ts_utc, from_me, text
-        FROM messages
-        WHERE ts_utc >= ?
-          AND peer_id = ?
-        ORDER BY ts_utc ASC
-    """, (iso_utc, PEER_ID)).fetchall()
-    con.close()
-    return rows
+    # in-process; reloaded by latest_summaries' poller when a summary is posted
+    return latest_summaries.get(channel_id)
+
+async def post_in_thread(channel_id: str, thread_ts: str, text: str):
+    # raises once SlackSender's own retries are spent; the job executor then retries the job
+    await get_slack().post(channel_id, text, thread_ts)
+
+def fetch_messages_since(peer_id: int, iso_utc: str, with_ids: bool = False):
+    # (ts_utc, from_me, text) rows, oldest first; with_ids prepends messages.id
+    rows = hot_window.windows.since(peer_id, iso_utc, "row" if with_ids else "msg")
+    if rows is not None:
+        return rows
+    with db.connection() as con, metrics.sql("app.fetch_messages_since"):
+        return con.execute(f"""
+            SELECT {"id, " if with_ids else ""}ts_utc, from_me, text
+            FROM messages
+            WHERE peer_id = ? AND ts_epoch >= ?
+            ORDER BY ts_epoch ASC
+        """, (peer_id, timestamps.epoch(iso_utc))).fetchall()
 
 def clean_text(t: str) -> str:
     return " ".join(((t or "").replace("\n"," ").replace("\r"," ")).split())
 
-def ai_answer(question: str, msgs: list, facts: list) -> str:
+async def ai_answer(question: str, msgs: list, fact_texts: list, on_text=None, turns=None, hits=None) -> str:
+    with metrics.span("ai_answer", msgs=len(msgs), facts=len(fact_texts), turns=len(turns or ())):
+        return await _ai_answer(question, msgs, fact_texts, on_text, turns, hits)
+
+async def _ai_answer(question: str, msgs: list, fact_texts: list, on_text=None, turns=None, hits=None) -> str:
+    # msgs are (id, ts_utc, from_me, text); turns, on a follow-up, the thread's earlier (question, answer)s
+    # and hits the rows retrieved for this question among the session's
     lines = []
-    for ts, me, txt in msgs[-250:]:
+    for _, ts, me, txt in msgs:
         who = "SHE" if me == 1 else "HE"
         lines.append(f"{ts} — {who}: {clean_text(txt)}")
-    fact_lines = [f"- {f}" for f in facts[-100:]]
+    # messages that mention the question's terms first, then the newest, up to the token budget;
+    # a follow-up has the earlier answers to go on, so it gets a smaller share, its own hits first
+    relevance = packer.term_relevance(retrieval.expand_query(question))
+    if hits:
+        terms, hit_bodies = relevance, {r[3] for r in hits}
+        relevance = lambda body: terms(body) + (100.0 if body in hit_bodies else 0.0)
+    msg_pack = packer.pack(lines, packer.budget("followup" if turns else "messages"),
+                           bodies=[txt or "" for _, _, _, txt in msgs], relevance=relevance)
+    # fact_texts come most relevant first; keep that order and rank when over budget
+    rank = {f: len(fact_texts) - i for i, f in enumerate(fact_texts)}
+    fact_pack = packer.pack([f"- {f}" for f in fact_texts], packer.budget("facts"), bodies=fact_texts,
+                            relevance=rank.get, drop_filler=False)
+    lines, fact_lines = msg_pack.lines, fact_pack.lines
+    logger.info("question context: msgs %d/%d tok (%d dropped) facts %d/%d tok (%d dropped)",
+                msg_pack.tokens, msg_pack.budget, msg_pack.dropped,
+                fact_pack.tokens, fact_pack.budget, fact_pack.dropped)
+    earlier = ""
+    if turns:
+        qa = [f"Q: {clean_text(q)}\nA: {clean_text(a)}" for q, a in turns]
+        # newest turns win when over budget
+        turn_pack = packer.pack(qa, packer.budget("turns"), drop_filler=False)
+        earlier = f"""Earlier in this thread:
+{chr(10).join(turn_pack.lines)}
+
+"""
     sys_prompt = "Answer concisely (≤ 80 words) based ONLY on the context below. If not in context, say you don't have that info. Plain English. No emojis."
     user_prompt = f"""Context — recent messages:
 {chr(10).join(lines)}
@@ -98,126 +177,243 @@ def ai_answer(question: str, msgs: list, facts: list) -> str:
 Context — stored facts:
 {chr(10).join(fact_lines) if fact_lines else "(none)"}
 
-Question: {question}
+{earlier}Question: {question}
 Give a short answer in one or two sentences."""
-    resp = ai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role":"system","content":sys_prompt},{"role":"user","content":user_prompt}],
-        temperature=0.2,
-    )
-    return resp.choices[0].message.content.strip()
-
-def ai_call_prep(since_iso: str) -> str:
-    msgs = fetch_messages_since(since_iso)
-    dlabel = get_today_date_label()
-    if not msgs:
-        return f"Date: {dlabel}\n\n- No new messages since last call.\n\nAny privates/ calls?\n- None mentioned."
-    CALL_KEYS = ("call","private","cb","chaturbate","stream","record","book","booked","confirm","confirmed",
-                 "resched","reschedule","cancel","canceled","time","am","pm","o'clock","tomorrow","today",
-                 "makeup","no makeup","natural","surprise")
-    lines, call_lines = [], []
-    for ts, me, txt in msgs:
-        who = "SHE" if me==1 else "HE"
-        s = f"{ts} — {who}: {clean_text(txt)}"
-        lines.append(s)
-        low = s.lower()
-        if any(k in low for k in CALL_KEYS):
-            call_lines.append(s)
-    chat_snippet = "\n".join(lines[-400:])
-    call_snippet = "\n".join(call_lines[-200:]) if call_lines else "(none)"
-    style = open("summary_style.txt","r",encoding="utf-8").read().replace("{date_au}", dlabel)
-    out = ai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role":"system","content":style},
-            {"role":"user","content":f"Here are messages since the last call (UTC):\n\n{chat_snippet}\n\nCall-related lines only (filtered):\n{call_snippet}\n\nWrite the report now, following the layout and rules exactly."}
-        ],
-        temperature=0.2,
-    ).choices[0].message.content.strip()
-    if len(out.split()) > 250:
-        out = ai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role":"system","content":"Shorten to ≤250 words. Keep EXACT same format and meaning."},
-                      {"role":"user","content":out}],
-            temperature=0.0
-        ).choices[0].message.content.strip()
-    return out
-
-app = FastAPI()
-
-@app.get("/health")
+    return await llm.acomplete(get_ai(), sys_prompt, user_prompt, temperature=0.2, on_text=on_text)
+
+async def ai_call_prep(peer_id: int, since_iso: str, on_text=None) -> str:
+    # same stages as the daily summary, sharing this process's OpenAI client and LLM cache
+    callprep_pipeline = pipeline.Pipeline(get_ai(), kind="callprep", on_text=on_text)
+    with metrics.span("ai_call_prep", peer=peer_id):
+        res = await callprep_pipeline.run(peer_id, since_iso, get_today_date_label())
+    return res.text
+
 def health():
-    return {"ok": True}
-
-def handle_update(channel_id: str, thread_ts: str, user_id: str, text: str):
-    con = db_connect()
-    con.execute(
-        "INSERT INTO facts(created_utc, author_slack_id, text, source, confidence) VALUES (?,?,?,?,?)",
-        (datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"), user_id, text, "manual", "high")
-    )
-    con.commit(); con.close()
-    post_in_thread(channel_id, thread_ts, f"✔ Added fact: {text}")
-
-def handle_question(channel_id: str, thread_ts: str, question: str):
-    ninety_days_ago = (datetime.now(timezone.utc) - timedelta(days=90)).strftime("%Y-%m-%dT%H:%M:%SZ")
-    msgs = fetch_messages_since(ninety_days_ago)
-    con = db_connect()
-    facts = [r[0] for r in con.execute("SELECT text FROM facts ORDER BY id ASC").fetchall()]
-    con.close()
-    answer = ai_answer(question, msgs, facts)
-    post_in_thread(channel_id, thread_ts, f"*Q:* {question}\n*A:* {answer}")
-
-def handle_callprep(channel_id: str, thread_ts: str):
-    con = db_connect()
-    row = con.execute("SELECT occurred_utc FROM calls ORDER BY occurred_utc DESC LIMIT 1").fetchone()
-    con.close()
-    since_iso = row[0] if row else (datetime.now(timezone.utc) - timedelta(days=14)).strftime("%Y-%m-%dT%H:%M:%SZ")
-    prep = ai_call_prep(since_iso)
-    post_in_thread(channel_id, thread_ts, f"*Call prep (since last call)*\n{prep}")
-
-def handle_markcall(channel_id: str, thread_ts: str, note: str):
-    con = db_connect()
-    now_utc = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-    con.execute("INSERT INTO calls(occurred_utc, source, notes) VALUES (?,?,?)", (now_utc, "manual", note.strip()))
-    con.commit(); con.close()
+    pool = db.get_pool().healthcheck()
+    return {"ok": pool["ok"], "db": pool, "llm_cache": llm.cache.stats(),
+            "summary_cache": latest_summaries.stats(), "hot_window": hot_window.windows.stats(),
+            "sessions": sessions.threads.stats(),
+            "ack_ms": {f"p{int(q * 100)}": round(1000 * metrics.ACK_SECONDS.quantile(q), 2) for q in (.5, .99)}}
+
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def start_jobs():
+    executor.start()
+    await asyncio.to_thread(latest_summaries.refresh)   # loaded before the first command
+    latest_summaries.start()
+    hot_window.windows.start()
+    # not awaited: the first ack shouldn't wait for openai/numpy
+    asyncio.get_running_loop().run_in_executor(None, preload)
+
+async def shutdown():
+    await executor.drain()
+    await latest_summaries.stop()
+    hot_window.windows.stop()
+    if slack is not None:
+        await slack.aclose()
+    if ai is not None:
+        await ai.close()
+    await asyncio.to_thread(llm.cache.close)   # writes the pending last_used bumps
+    db.close_pool()
+
+# Lower runs first: cheap writes ahead of LLM work, /callprep (biggest prompt) last.
+PRIORITY = {"/update": 0, "/markcall": 0, "/question": 1, "/callprep": 2}
+
+def save_fact(peer_id: int, user_id: str, text: str) -> facts.AddResult:
+    with db.connection() as con:
+        return facts.add(con, peer_id, text, author=user_id)
+
+def load_question_context(peer_id: int, since_iso: str, question: str, qvec=None):
+    with db.connection() as con, metrics.span("question_context", peer=peer_id):
+        import embeddings
+        # the messages most similar to the question and their neighbours; the whole window until indexed
+        msgs = embeddings.question_context(con, peer_id, question, since_iso, qvec=qvec)
+        if msgs is None:
+            msgs = fetch_messages_since(peer_id, since_iso, with_ids=True)
+        fact_texts = facts.relevant(con, peer_id, question)
+    return msgs, fact_texts
+
+def start_session(channel_id: str, thread_ts: str, peer_id: int, since_iso: str, question: str):
+    # a thread's first question: full retrieval, kept for its follow-ups
+    import embeddings
+    with db.connection() as con:
+        last_id = sessions.newest_id(con)
+        qvec = embeddings.embed_query(con, peer_id, question)
+    msgs, fact_texts = load_question_context(peer_id, since_iso, question, qvec)
+    msgs = list(msgs)   # decoded once; the session keeps the newest SESSION_ROWS of them
+    s = sessions.threads.start(channel_id, thread_ts, peer_id, msgs, last_id,
+                               anchor=qvec)
+    return s, msgs, fact_texts
+
+def load_followup_context(s: sessions.Session, question: str, since_iso: str):
+    # every /question lands in the daily thread, so one unlike the session's earlier questions
+    # retrieves its own top-k into it. The earlier turns carry what was already answered: only
+    # the rows this question's terms or hits pick out, and those no turn has seen, are sent
+    with db.connection() as con, metrics.span("followup_context", peer=s.peer_id):
+        import embeddings
+        s.catch_up(con)
+        hits = None
+        qvec = embeddings.embed_query(con, s.peer_id, question)
+        if qvec is not None and s.similarity(qvec) < sessions.SESSION_RELATED:
+            hits = embeddings.question_context(con, s.peer_id, question, since_iso, qvec=qvec)
+            s.add(hits, anchor=qvec)
+        terms = [t for t in retrieval.expand_query(question) if t.lower() not in retrieval.STOP_WORDS]
+        relevance, hit_ids = packer.term_relevance(terms), {r[0] for r in hits or ()}
+        msgs = s.followup_rows(lambda r: r[0] in hit_ids or relevance(r[3]) > 0)
+        return msgs, facts.relevant(con, s.peer_id, question), hits
+
+def last_call_utc(peer_id: int):
+    with db.connection() as con, metrics.sql("calls.last_call"):
+        return calls.last_call(con, peer_id)
+
+def save_call(peer_id: int, occurred_utc: str, note: str):
+    with db.connection() as con:
+        # a retried /markcall carries the same occurred_utc (the job's submit time): one row
+        if con.execute("SELECT 1 FROM calls WHERE peer_id=? AND occurred_utc=? AND source='manual'",
+                       (peer_id, occurred_utc)).fetchone():
+            return
+        calls.mark(con, peer_id, occurred_utc, note)
+
+# Jobs are retried, so each handler keeps what it already did in its job (see executor.Job):
+# the reply text once its write is done, the ts of the placeholder it posted.
+
+async def handle_update(peer_id: int, channel_id: str, thread_ts: str, user_id: str, text: str):
+    job = current_job()
+    msg = job.get("reply")
+    if msg is None:
+        res = await asyncio.to_thread(save_fact, peer_id, user_id, text)
+        if res.status == "duplicate":
+            msg = f"Already known: {res.fact.text}"
+        elif res.status == "superseded":
+            msg = f"✔ Updated fact: {text} (replaces: {'; '.join(f.text for f in res.replaced)})"
+        else:
+            msg = f"✔ Added fact: {text}"
+        job.put("reply", msg)
+    await post_in_thread(channel_id, thread_ts, msg)
+
+def live_reply(job, channel_id: str, thread_ts: str, **kw) -> slack_sender.LiveMessage:
+    # an earlier attempt's placeholder is reused; only the last attempt apologises
+    return slack_sender.LiveMessage(get_slack(), channel_id, thread_ts, ts=job.get("reply_ts"), final=job.final, **kw)
+
+# /question and /callprep post a placeholder at once and edit the answer in as it streams
+async def handle_question(peer_id: int, channel_id: str, thread_ts: str, question: str):
+    job = current_job()
+    async with live_reply(job, channel_id, thread_ts, prefix=f"*Q:* {question}\n*A:* ", command="/question") as live:
+        job.put("reply_ts", live.ts)
+        ninety_days_ago = (datetime.now(timezone.utc) - timedelta(days=90)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        s, hits = sessions.threads.get(channel_id, thread_ts, peer_id), None
+        if s is None:
+            s, msgs, fact_texts = await asyncio.to_thread(start_session, channel_id, thread_ts, peer_id,
+                                                          ninety_days_ago, question)
+        else:
+            msgs, fact_texts, hits = await asyncio.to_thread(load_followup_context, s, question, ninety_days_ago)
+        answer = await ai_answer(question, msgs, fact_texts, on_text=live.append, turns=list(s.turns), hits=hits)
+        await live.finish(answer)
+        s.add_turn(question, answer)
+
+async def handle_callprep(peer_id: int, channel_id: str, thread_ts: str):
+    job = current_job()
+    async with live_reply(job, channel_id, thread_ts, prefix="*Call prep (since last call)*\n",
+                          placeholder="Preparing…", command="/callprep") as live:
+        job.put("reply_ts", live.ts)
+        last = await asyncio.to_thread(last_call_utc, peer_id)
+        since_iso = last or (datetime.now(timezone.utc) - timedelta(days=14)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        # a draft over MAX_WORDS is shrunk before this returns, so the final edit is the short one
+        prep = await ai_call_prep(peer_id, since_iso, on_text=live.append)
+        await live.finish(prep)
+
+async def handle_markcall(peer_id: int, channel_id: str, thread_ts: str, note: str):
+    job = current_job()
+    if not job.get("saved"):
+        # the call is when the command came in, not when this attempt runs
+        occurred_utc = datetime.fromtimestamp(job.created, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        await asyncio.to_thread(save_call, peer_id, occurred_utc, note.strip())
+        job.put("saved", True)
     msg = "✔ Marked last call as now (UTC)."
     if note.strip():
         msg += f" Note: {note.strip()}"
-    post_in_thread(channel_id, thread_ts, msg)
+    await post_in_thread(channel_id, thread_ts, msg)
+
+for _command, _fn in (("/update", handle_update), ("/question", handle_question),
+                      ("/callprep", handle_callprep), ("/markcall", handle_markcall)):
+    executor.register(_command, _fn)
+
+def enqueue(command: str, *args, ack: str, key: str = None, retry: str = "", reason: str = ""):
+    res = executor.submit(PRIORITY[command], command, *args, key=key, redelivery=bool(retry))
+    if res == DUPLICATE:
+        logger.info("%s: Slack retry %s (%s) of a queued command; dropped", command, retry, reason or "-")
+    if res in (QUEUED, DUPLICATE):
+        return PlainTextResponse(ack, status_code=200)
+    return JSONResponse({"response_type":"ephemeral","text":"Busy with other requests right now. Try again in a minute."})
+
+KNOWN_COMMANDS = {"/update", "/question", "/callprep", "/call-prep", "/markcall"}
+# what makes a delivery the same command; trigger_id is in it when Slack sends one, not relied on
+COMMAND_IDENTITY = ("team_id", "channel_id", "user_id", "command", "text", "trigger_id")
 
-@app.post("/slack/command")
 async def slack_command(request: Request):
-    body = await request.body()
-    if not SKIP_VERIFY and not verify_slack(request, body):
-        return Response(status_code=403)
-    data = parse_qs(body.decode())
-    command = (data.get("command", [""])[0] or "").strip()
-    text = (data.get("text", [""])[0] or "").strip()
-    user_id = (data.get("user_id", [""])[0] or "").strip()
-    channel_id = (data.get("channel_id", [""])[0] or "").strip()
-    latest = get_latest_summary_for_channel(channel_id)
-    if not latest:
-        return JSONResponse({"response_type":"ephemeral","text":"I couldn't find today's summary thread here yet. Post the daily summary first."})
-    thread_ts = latest["ts"]
-
-    if command == "/update":
-        threading.Thread(target=handle_update, args=(channel_id, thread_ts, user_id, text), daemon=True).start()
-        return PlainTextResponse("Saving… will reply in thread.", status_code=200)
-    if command == "/question":
-        threading.Thread(target=handle_question, args=(channel_id, thread_ts, text), daemon=True).start()
-        return PlainTextResponse("Working… will reply in thread.", status_code=200)
-    if command in ("/callprep", "/call-prep"):
-        threading.Thread(target=handle_callprep, args=(channel_id, thread_ts), daemon=True).start()
-        return PlainTextResponse("Preparing… will reply in thread.", status_code=200)
-    if command == "/markcall":
-        threading.Thread(target=handle_markcall, args=(channel_id, thread_ts, text), daemon=True).start()
-        return PlainTextResponse("Marked… will reply in thread.", status_code=200)
-    return PlainTextResponse(f"Unknown command: {command}", status_code=200)
-
-# --- injected by setup ---
-import api_extra
-try:
+    t0 = time.perf_counter()
+    command = ""
+    try:
+        body = await request.body()
+        if not SKIP_VERIFY and not verify_slack(request, body):
+            return Response(status_code=403)
+        data = parse_qs(body.decode())
+        command = (data.get("command", [""])[0] or "").strip()
+        text = (data.get("text", [""])[0] or "").strip()
+        user_id = (data.get("user_id", [""])[0] or "").strip()
+        channel_id = (data.get("channel_id", [""])[0] or "").strip()
+        latest = get_latest_summary_for_channel(channel_id)
+        if not latest and await asyncio.to_thread(latest_summaries.refresh):
+            # posted since the last poll
+            latest = get_latest_summary_for_channel(channel_id)
+        if not latest:
+            return JSONResponse({"response_type":"ephemeral","text":"I couldn't find today's summary thread here yet. Post the daily summary first."})
+        thread_ts = latest["ts"]
+        peer_id = latest["peer_id"]
+        # Slack resends a command it thinks timed out, flagged by the retry headers; a resend
+        # runs only if the first delivery never made it into the queue (see executor.submit)
+        key = hashlib.sha256("\x1f".join(data.get(f, [""])[0] for f in COMMAND_IDENTITY).encode()).hexdigest()
+        dedup = {"key": key, "retry": request.headers.get("X-Slack-Retry-Num", ""),
+                 "reason": request.headers.get("X-Slack-Retry-Reason", "")}
+
+        if command == "/update":
+            return enqueue(command, peer_id, channel_id, thread_ts, user_id, text, ack="Saving… will reply in thread.", **dedup)
+        if command == "/question":
+            return enqueue(command, peer_id, channel_id, thread_ts, text, ack="Working… will reply in thread.", **dedup)
+        if command in ("/callprep", "/call-prep"):
+            return enqueue("/callprep", peer_id, channel_id, thread_ts, ack="Preparing… will reply in thread.", **dedup)
+        if command == "/markcall":
+            return enqueue(command, peer_id, channel_id, thread_ts, text, ack="Marked… will reply in thread.", **dedup)
+        return PlainTextResponse(f"Unknown command: {command}", status_code=200)
+    finally:
+        metrics.ACK_SECONDS.observe(time.perf_counter() - t0,
+                                    command=command if command in KNOWN_COMMANDS else "other")
+
+def create_app() -> FastAPI:
+    """
+    The ASGI app: settings (configure()), routes, middleware and lifecycle
+    hooks. Cheap by design; clients are built on first use. One per process:
+    jobs, the summary cache and the clients are module-level.
+    """
+    configure()
+    app = FastAPI()
+    app.add_middleware(metrics.RequestTimer)
+    app.add_api_route("/health", health, methods=["GET"])
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"])
+    app.add_api_route("/slack/command", slack_command, methods=["POST"])
     app.include_router(api_extra.router)
-except Exception:
-    pass
-# --- end injection ---
+    app.add_event_handler("startup", start_jobs)
+    app.add_event_handler("shutdown", shutdown)
+    metrics.JOB_QUEUE_DEPTH.set_function(lambda: executor.queue_stats()[0])
+    metrics.JOB_OLDEST_SECONDS.set_function(lambda: executor.queue_stats()[1])
+    metrics.JOBS_RUNNING.set_function(lambda: executor.running)
+    return app
+
+def __getattr__(name: str):
+    # `app` is built on first access (uvicorn app:app does that), not at import
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,250 @@
+"""
+Resumable, concurrent backfill of a peer's Telegram history.
+
+1. Gap scan: walk the stored msg_ids for the peer (window function over
+   uq_peer_msg) and subtract the ranges already verified in backfill_ranges.
+   What is left are the msg_id ranges that may still hide missing messages,
+   including holes in the middle of the history, not just below MIN(msg_id).
+2. Nearby gaps are coalesced into spans, and SPAN_WORKERS spans are fetched
+   concurrently, newest first, PAGE messages per request, with one shared
+   adaptive pacer that backs off on FloodWaitError and speeds up again after
+   successes.
+3. Rows are buffered and written with INSERT OR IGNORE/executemany in
+   transactions of WRITE_BATCH rows; a range is recorded in backfill_ranges
+   only after its rows are committed, so a killed job resumes where it stopped.
+
+The Telegram side is one coroutine, fetch(peer_id, lo, hi, limit) -> rows for
+msg_ids in [lo, hi], newest first, so the engine runs against a fake too.
+"""
+from __future__ import annotations
+import asyncio, logging, time
+from typing import Awaitable, Callable, List, Sequence, Tuple
+
+from ingest import MessageStore, Row
+
+logger = logging.getLogger(__name__)
+
+PAGE = 100            # Telegram's max per history request
+WRITE_BATCH = 5000
+SPAN_WORKERS = 3
+# gaps separated by fewer stored messages than this are fetched as one span
+COALESCE_STORED = PAGE
+MIN_DELAY, MAX_DELAY = 0.0, 30.0
+
+Fetch = Callable[[int, int, int, int], Awaitable[Sequence[Row]]]
+
+def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out: List[Tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if out and lo <= out[-1][1] + 1:
+            out[-1] = (out[-1][0], max(out[-1][1], hi))
+        else:
+            out.append((lo, hi))
+    return out
+
+def verified_ranges(con, peer_id: int) -> List[Tuple[int, int]]:
+    return [tuple(r) for r in con.execute(
+        "SELECT lo, hi FROM backfill_ranges WHERE peer_id=? ORDER BY lo", (peer_id,)).fetchall()]
+
+def mark_verified(con, peer_id: int, lo: int, hi: int):
+    """Record [lo, hi] as complete, merging with overlapping/adjacent ranges."""
+    with con:
+        rows = con.execute(
+            "SELECT lo, hi FROM backfill_ranges WHERE peer_id=? AND hi >= ? AND lo <= ?",
+            (peer_id, lo - 1, hi + 1)).fetchall()
+        for r in rows:
+            lo, hi = min(lo, r[0]), max(hi, r[1])
+        con.execute("DELETE FROM backfill_ranges WHERE peer_id=? AND hi >= ? AND lo <= ?",
+                    (peer_id, lo - 1, hi + 1))
+        con.execute("INSERT INTO backfill_ranges(peer_id, lo, hi) VALUES (?,?,?)", (peer_id, lo, hi))
+
+def _subtract(gaps: List[Tuple[int, int, int]], done: List[Tuple[int, int]]):
+    """gaps (sorted, disjoint) minus done (sorted, merged); keeps each gap's third field."""
+    out, j = [], 0
+    for lo, hi, tag in gaps:
+        while j < len(done) and done[j][1] < lo:
+            j += 1
+        k, cur = j, lo
+        while k < len(done) and done[k][0] <= hi:
+            if done[k][0] > cur:
+                out.append((cur, done[k][0] - 1, tag))
+            cur = max(cur, done[k][1] + 1)
+            k += 1
+        if cur <= hi:
+            out.append((cur, hi, tag))
+    return out
+
+def gap_scan(con, peer_id: int, top: int) -> List[Tuple[int, int, int]]:
+    """
+    Unverified msg_id ranges in [1, top] as (lo, hi, stored_before), where
+    stored_before is how many stored messages precede the range.
+    """
+    rows = con.execute("""
+        SELECT msg_id, nxt, rn FROM (
+          SELECT msg_id,
+                 LEAD(msg_id) OVER (ORDER BY msg_id) AS nxt,
+                 ROW_NUMBER() OVER (ORDER BY msg_id) AS rn
+          FROM messages WHERE peer_id=?
+        ) WHERE nxt IS NULL OR nxt - msg_id > 1 OR rn = 1
+    """, (peer_id,)).fetchall()
+    gaps = []
+    if not rows:
+        gaps.append((1, top, 0))
+    for msg_id, nxt, rn in rows:
+        if rn == 1 and msg_id > 1:
+            gaps.append((1, min(msg_id - 1, top), 0))
+        hi = (nxt - 1) if nxt is not None else top
+        if hi > msg_id:
+            gaps.append((msg_id + 1, min(hi, top), rn))
+    return _subtract([g for g in gaps if g[0] <= g[1]], verified_ranges(con, peer_id))
+
+def coalesce(gaps: List[Tuple[int, int, int]]) -> List[Tuple[int, int]]:
+    """Merge gaps whose stored messages in between fit in about one page."""
+    spans: List[List[int]] = []
+    for lo, hi, rank in gaps:
+        if spans and rank - spans[-1][2] < COALESCE_STORED:
+            spans[-1][1] = hi
+            spans[-1][2] = rank
+        else:
+            spans.append([lo, hi, rank])
+    return [(lo, hi) for lo, hi, _ in spans]
+
+def split(spans: List[Tuple[int, int]], workers: int) -> List[Tuple[int, int]]:
+    """Cut the widest spans in half until every worker has one."""
+    spans = list(spans)
+    while spans and len(spans) < workers:
+        lo, hi = max(spans, key=lambda s: s[1] - s[0])
+        if hi - lo < 2 * PAGE:
+            break
+        spans.remove((lo, hi))
+        mid = (lo + hi) // 2
+        spans += [(lo, mid), (mid + 1, hi)]
+    return spans
+
+class Pacer:
+    """Shared delay between requests: doubles on flood waits, decays on success."""
+
+    def __init__(self):
+        self.delay = MIN_DELAY
+        self.flood_waits = 0
+        self._lock = asyncio.Lock()
+        self._resume_at = 0.0
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            pause = max(self._resume_at - now, self.delay)
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+    def ok(self):
+        self.delay = max(MIN_DELAY, self.delay * 0.8 if self.delay > 0.05 else 0.0)
+
+    def flood(self, seconds: float):
+        self.flood_waits += 1
+        self._resume_at = time.monotonic() + seconds
+        self.delay = min(MAX_DELAY, max(0.25, self.delay * 2))
+        logger.warning("flood wait %.0fs; pacing at %.2fs/request", seconds, self.delay)
+
+def _flood_seconds(exc: BaseException):
+    """Seconds to wait if exc is a Telethon FloodWaitError, else None."""
+    if type(exc).__name__ in ("FloodWaitError", "FloodPremiumWaitError"):
+        return float(getattr(exc, "seconds", 5) or 5)
+    return None
+
+class BackfillEngine:
+    def __init__(self, store: MessageStore, fetch: Fetch, peer_id: int,
+                 workers: int = SPAN_WORKERS, write_batch: int = WRITE_BATCH):
+        self.store = store
+        self.fetch = fetch
+        self.peer_id = peer_id
+        self.workers = workers
+        self.write_batch = write_batch
+        self.pacer = Pacer()
+        self.fetched = 0
+        self.saved = 0
+        self.requests = 0
+        self._buf: List[Row] = []
+        self._ranges: List[Tuple[int, int]] = []
+        self._write_lock = asyncio.Lock()
+        self._t0 = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Messages fetched per second since start."""
+        return self.fetched / max(time.monotonic() - self._t0, 1e-9)
+
+    async def _flush(self):
+        async with self._write_lock:
+            if not self._buf and not self._ranges:
+                return
+            rows, ranges = self._buf, self._ranges
+            self._buf, self._ranges = [], []
+
+            def write():
+                n = self.store.apply(inserts=rows)
+                for lo, hi in _merge(ranges):
+                    mark_verified(self.store.con, self.peer_id, lo, hi)
+                return n
+            self.saved += await asyncio.to_thread(write)
+        logger.info("progress: fetched=%d saved=%d requests=%d %.0f msg/s delay=%.2fs",
+                    self.fetched, self.saved, self.requests, self.rate, self.pacer.delay)
+
+    async def _page(self, lo: int, hi: int) -> Sequence[Row]:
+        while True:
+            await self.pacer.wait()
+            try:
+                self.requests += 1
+                rows = await self.fetch(self.peer_id, lo, hi, PAGE)
+                self.pacer.ok()
+                return rows
+            except Exception as e:
+                seconds = _flood_seconds(e)
+                if seconds is None:
+                    raise
+                self.pacer.flood(seconds)
+
+    async def _span(self, lo: int, hi: int):
+        while hi >= lo:
+            rows = await self._page(lo, hi)
+            self.fetched += len(rows)
+            bottom = lo if len(rows) < PAGE else min(r[1] for r in rows)
+            self._buf.extend(rows)
+            self._ranges.append((bottom, hi))
+            if len(self._buf) >= self.write_batch:
+                await self._flush()
+            hi = bottom - 1
+
+    async def run(self, top: int) -> dict:
+        self._t0 = time.monotonic()
+        gaps = await asyncio.to_thread(gap_scan, self.store.con, self.peer_id, top)
+        spans = sorted(split(coalesce(gaps), self.workers), key=lambda s: -s[1])
+        logger.info("gap scan: %d gap(s) -> %d span(s) below msg_id %d", len(gaps), len(spans), top)
+        queue: "asyncio.Queue[Tuple[int, int]]" = asyncio.Queue()
+        for s in spans:
+            queue.put_nowait(s)
+
+        async def worker():
+            while True:
+                try:
+                    lo, hi = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self._span(lo, hi)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, self.workers))))
+        finally:
+            await self._flush()
+        return {"gaps": len(gaps), "spans": len(spans), "fetched": self.fetched, "saved": self.saved,
+                "requests": self.requests, "flood_waits": self.pacer.flood_waits,
+                "seconds": time.monotonic() - self._t0, "msg_per_s": self.rate}
+
+def telethon_fetch(client, entity) -> Fetch:
+    from ingest import message_row
+
+    async def fetch(peer_id: int, lo: int, hi: int, limit: int) -> Sequence[Row]:
+        # min_id/max_id are exclusive bounds
+        msgs = await client.get_messages(entity, limit=limit, min_id=lo - 1, max_id=hi + 1)
+        return [message_row(peer_id, m) for m in msgs]
+    return fetch
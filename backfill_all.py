@@ -1,77 +1,53 @@
-import os, sqlite3, time
-from telethon.sync import TelegramClient
+import os, sys, asyncio, logging
+from telethon import TelegramClient
 from dotenv import load_dotenv
 
+import db, db_migrate, peers
+from backfill import BackfillEngine, telethon_fetch
+from ingest import MessageStore
+
 load_dotenv()
 api_id   = int(os.getenv("API_ID"))
 api_hash = os.getenv("API_HASH")
 phone    = os.getenv("PHONE_NUMBER")
-peer_id  = int(os.getenv("PEER_ID"))
+peer_id  = int(sys.argv[1]) if len(sys.argv) > 1 else peers.default_peer_id()  # argv[1] overrides the default peer
 session  = os.getenv("SESSION_NAME","telegram_briefs")
 
-# DB
-db = sqlite3.connect("briefs.db")
-db.execute("PRAGMA journal_mode=WAL;")
-db.execute("""
-CREATE TABLE IF NOT EXISTS messages(
-  id       INTEGER PRIMARY KEY AUTOINCREMENT,
-  peer_id  INTEGER NOT NULL,
-  msg_id   INTEGER NOT NULL,
-  ts_utc   TEXT    NOT NULL,
-  from_me  INTEGER NOT NULL,
-  text     TEXT
-);
-""")
-db.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_peer_msg ON messages(peer_id,msg_id);")
-
-with TelegramClient(session, api_id, api_hash) as client:
-  client.start(phone=phone)
-
-  # find dialog by peer_id (safe)
-  target = None
-  for d in client.iter_dialogs():
-    if getattr(d.entity, "id", None) == peer_id:
-      target = d.entity
-      break
-  if not target:
-    raise SystemExit("Open the DM once in Telegram, then run again.")
-
-  # start from oldest we DON'T have yet
-  # offset_id means "fetch messages with id < offset_id" (older pages)
-  row = db.execute("SELECT MIN(msg_id) FROM messages WHERE peer_id=?", (peer_id,)).fetchone()
-  offset_id = row[0] if row and row[0] else 0
-
-  total_before = db.execute("SELECT COUNT(*) FROM messages WHERE peer_id=?", (peer_id,)).fetchone()[0]
-  saved = 0
-  batches = 0
-  while True:
-    batch = list(client.iter_messages(target, limit=500, offset_id=offset_id))
-    if not batch:
-      break
-    # insert this batch
-    for m in batch:
-      text = m.message if m.message else "[media]"
-      try:
-        db.execute(
-          "INSERT INTO messages(peer_id,msg_id,ts_utc,from_me,text) VALUES (?,?,?,?,?)",
-          (peer_id, m.id, m.date.strftime("%Y-%m-%dT%H:%M:%SZ"), 1 if m.out else 0, text)
-        )
-        saved += 1
-      except sqlite3.IntegrityError:
-        pass
-    db.commit()
-    batches += 1
-    oldest = min(x.id for x in batch)
-    offset_id = oldest  # next loop fetches older-than-this
-    if batches % 10 == 0:
-      print(f"...progress: {saved} saved so far; oldest msg_id now {offset_id}")
-    time.sleep(0.5)  # gentle pacing
-
-  total_after = db.execute("SELECT COUNT(*) FROM messages WHERE peer_id=?", (peer_id,)).fetchone()[0]
-  oldest_ts = db.execute("SELECT ts_utc FROM messages WHERE peer_id=? ORDER BY msg_id ASC LIMIT 1", (peer_id,)).fetchone()
-  newest_ts = db.execute("SELECT ts_utc FROM messages WHERE peer_id=? ORDER BY msg_id DESC LIMIT 1", (peer_id,)).fetchone()
-  db.close()
-
-print(f"Backfill complete. Added {saved} messages. Total now: {total_after} (was {total_before}).")
-print(f"Oldest message UTC: {oldest_ts[0] if oldest_ts else 'n/a'}")
-print(f"Newest message UTC: {newest_ts[0] if newest_ts else 'n/a'}")
+async def main():
+  db_con = db.open_connection()
+  db_migrate.migrate(db_con)
+  store = MessageStore(db_con)
+  total_before = store.count(peer_id)
+
+  async with TelegramClient(session, api_id, api_hash) as client:
+    await client.start(phone=phone)
+
+    # find dialog by peer_id (safe)
+    target = None
+    async for d in client.iter_dialogs():
+      if getattr(d.entity, "id", None) == peer_id:
+        target = d.entity
+        break
+    if not target:
+      raise SystemExit("Open the DM once in Telegram, then run again.")
+
+    # backfill every unverified msg_id range up to the newest message;
+    # progress is checkpointed in backfill_ranges so a rerun resumes
+    newest = await client.get_messages(target, limit=1)
+    top = newest[0].id if newest else 0
+    engine = BackfillEngine(store, telethon_fetch(client, target), peer_id)
+    stats = await engine.run(top)
+
+  total_after = store.count(peer_id)
+  oldest_ts = db_con.execute("SELECT ts_utc FROM messages WHERE peer_id=? ORDER BY msg_id ASC LIMIT 1", (peer_id,)).fetchone()
+  newest_ts = db_con.execute("SELECT ts_utc FROM messages WHERE peer_id=? ORDER BY msg_id DESC LIMIT 1", (peer_id,)).fetchone()
+  db_con.close()
+
+  print(f"Backfill complete. Added {stats['saved']} messages. Total now: {total_after} (was {total_before}).")
+  print(f"Fetched {stats['fetched']} in {stats['requests']} requests over {stats['spans']} span(s), "
+        f"{stats['seconds']:.1f}s ({stats['msg_per_s']:.0f} msg/s, {stats['flood_waits']} flood wait(s)).")
+  print(f"Oldest message UTC: {oldest_ts[0] if oldest_ts else 'n/a'}")
+  print(f"Newest message UTC: {newest_ts[0] if newest_ts else 'n/a'}")
+
+logging.basicConfig(level=logging.INFO)
+asyncio.run(main())
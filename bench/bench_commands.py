@@ -0,0 +1,117 @@
+"""
+Load test: fire N slash commands at once at /slack/command and wait for the
+job executor to drain, with OpenAI and Slack served by local stubs.
+
+Reports ack latency, enqueue->done latency percentiles, time to the first
+streamed answer text in Slack and peak memory.
+
+    python -m bench.bench_commands --commands 500 --llm-latency 0.2 --token-delay 0.02
+"""
+import argparse, asyncio, logging, os, resource, sqlite3, statistics, sys, tempfile, time, tracemalloc
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from bench.bench_endpoints import PEER_ID, seed_db
+from bench.stubs import OpenAIStub, SlackStub
+
+MIX = (("/question", "when is the next call?"), ("/callprep", ""), ("/update", "prefers 8pm"),
+       ("/markcall", "quick one"))
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def run(args):
+    import httpx
+    import app as app_module
+    logging.disable(logging.INFO)
+    app = app_module.app
+    executor = app_module.executor
+    await app.router.startup()
+
+    transport = httpx.ASGITransport(app=app)
+    acks = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def fire(i):
+            command, text = MIX[i % len(MIX)]
+            body = urlencode({"command": command, "text": text, "user_id": "U1", "channel_id": "C1"})
+            t0 = time.perf_counter()
+            r = await client.post("/slack/command", content=body,
+                                  headers={"Content-Type": "application/x-www-form-urlencoded"})
+            acks.append(time.perf_counter() - t0)
+            return r
+        t0 = time.perf_counter()
+        await asyncio.gather(*(fire(i) for i in range(args.commands)))
+        while executor.depth or executor.running:
+            await asyncio.sleep(0.01)
+        wall = time.perf_counter() - t0
+
+        # a summary posted by another process reaches the ack path without a restart
+        con = sqlite3.connect(os.environ["DB_PATH"])
+        con.execute("INSERT INTO summaries(posted_utc, channel_id, ts, date_label, text, peer_id) VALUES (?,?,?,?,?,?)",
+                    (datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "C1", "2.000", "2/1/25", "s", PEER_ID))
+        con.commit(); con.close()
+        t1 = time.perf_counter()
+        while app_module.get_latest_summary_for_channel("C1")["ts"] != "2.000":
+            await asyncio.sleep(0.01)
+        picked_up = time.perf_counter() - t1
+        exposition = (await client.get("/metrics")).text
+    await app.router.shutdown()
+
+    done = list(executor.latencies)
+    print(f"commands={args.commands} concurrency={executor.concurrency} queue={executor.max_queue} "
+          f"llm_latency={args.llm_latency}s")
+    print(f"stats: {executor.stats()}  wall={wall:.2f}s")
+    print("ack ms:      p50={:.1f} p95={:.1f} p99={:.1f}".format(
+        *(1000 * pct(acks, p) for p in (50, 95, 99))))
+    hist = app_module.metrics.ACK_SECONDS
+    print("ack ms (server histogram, n={}): p50={:.2f} p99={:.2f}".format(
+        hist.count(), *(1000 * hist.quantile(q) for q in (.5, .99))))
+    print(f"summary cache: {app_module.latest_summaries.stats()}, new summary picked up in {picked_up * 1000:.0f} ms")
+    stages = app_module.metrics.STAGE_SECONDS
+    for stage in stages.label_values("stage"):
+        print(f"  stage {stage:<24} n={stages.count(stage=stage):<5} p50={1000 * stages.quantile(.5, stage=stage):7.1f}ms "
+              f"p99={1000 * stages.quantile(.99, stage=stage):7.1f}ms")
+    print(f"/metrics: {len(exposition.splitlines())} lines")
+    first = app_module.metrics.FIRST_TEXT_SECONDS
+    for command in first.label_values("command"):
+        print(f"first text {command:<10} n={first.count(command=command):<5} "
+              f"p50={1000 * first.quantile(.5, command=command):7.1f}ms p99={1000 * first.quantile(.99, command=command):7.1f}ms")
+    if done:
+        print("job ms:      p50={:.0f} p95={:.0f} p99={:.0f} max={:.0f} mean={:.0f}".format(
+            *(1000 * pct(done, p) for p in (50, 95, 99)), 1000 * max(done), 1000 * statistics.mean(done)))
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--commands", type=int, default=500)
+    p.add_argument("--llm-latency", type=float, default=0.2)
+    p.add_argument("--slack-latency", type=float, default=0.02)
+    p.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed words")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--rows", type=int, default=5000)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "bench.db")
+    os.environ["DB_PATH"] = path   # before anything imports db (db_migrate does, via facts)
+    seed_db(path, args.rows)
+    con = sqlite3.connect(path)
+    con.execute("INSERT INTO summaries(posted_utc, channel_id, ts, date_label, text, peer_id) VALUES (?,?,?,?,?,?)",
+                (datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "C1", "1.000", "1/1/25", "s", PEER_ID))
+    con.commit(); con.close()
+
+    with OpenAIStub(latency=args.llm_latency, token_delay=args.token_delay) as oai, SlackStub(latency=args.slack_latency) as sl:
+        os.environ.update({
+            "DB_PATH": path, "OPENAI_API_KEY": "sk-bench", "SLACK_BOT_TOKEN": "xoxb-bench",
+            "SLACK_SKIP_VERIFY": "1", "OPENAI_BASE_URL": oai.url, "SLACK_API_URL": sl.url,
+            "LLM_CONCURRENCY": str(args.concurrency), "JOB_QUEUE_SIZE": str(args.commands),
+        })
+        tracemalloc.start()
+        asyncio.run(run(args))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"openai calls={oai.calls} slack calls={sl.calls}")
+    print(f"peak python heap={peak / 2**20:.1f} MiB  max RSS={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+if __name__ == "__main__":
+    sys.exit(main())
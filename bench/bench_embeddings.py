@@ -0,0 +1,55 @@
+"""
+Microbenchmark: embedding throughput and top-k search latency of the
+on-disk vector index, against the FTS5 keyword search on the same corpus.
+
+    python -m bench.bench_embeddings              # 100k messages
+    python -m bench.bench_embeddings -n 1000000
+
+Messages go through ingest.MessageStore, so the numbers include the insert
+hook; search runs against the memory-mapped store.
+"""
+import argparse, os, statistics, tempfile, time
+
+import db, db_migrate, embeddings, ingest, retrieval
+from bench.bench_keywords import corpus
+
+QUERIES = ("when is the next private?", "did she reschedule", "makeup for the stream",
+           "what time tomorrow", "cancelled sorry", "good morning")
+
+def lat(fn, reps: int = 20):
+    out = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(out), max(out)
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("-n", type=int, default=100_000)
+    p.add_argument("--batch", type=int, default=20_000, help="rows per ingest batch")
+    args = p.parse_args()
+    texts = corpus(args.n)
+    with tempfile.TemporaryDirectory() as d:
+        con = db.open_connection(os.path.join(d, "emb.db"))
+        db_migrate.migrate(con)
+        store = ingest.MessageStore(con)
+        t0 = time.perf_counter()
+        for i in range(0, args.n, args.batch):
+            store.insert((1, j + 1, f"2026-01-01T00:00:{j % 60:02d}Z", j % 2, texts[j])
+                         for j in range(i, min(i + args.batch, args.n)))
+        took = time.perf_counter() - t0
+        st = embeddings.store_for(con, 1)
+        print(f"{args.n} messages ingested + embedded in {took:.1f}s ({args.n / took:,.0f} msg/s), "
+              f"index {os.path.getsize(st.vec_path) / 2**20:.0f} MiB")
+
+        print(f"{'query':<28} {'vector p50':>10} {'fused p50':>10} {'fts p50':>9}  (ms)")
+        for q in QUERIES:
+            v, _ = lat(lambda: embeddings.vector_search(con, 1, q))
+            f, _ = lat(lambda: embeddings.search(con, 1, q))
+            k, _ = lat(lambda: retrieval.search_messages(con, 1, q, limit=embeddings.TOP_K))
+            print(f"{q:<28} {v:10.1f} {f:10.1f} {k:9.1f}")
+        con.close()
+
+if __name__ == "__main__":
+    main()
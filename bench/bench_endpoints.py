@@ -0,0 +1,96 @@
+"""
+Requests/second for /health, /question and /callprep against a seeded temp DB,
+with the OpenAI and Slack clients stubbed out (nothing leaves the process).
+
+    python -m bench.bench_endpoints               # pooled connections (db.py)
+    python -m bench.bench_endpoints --baseline    # fresh sqlite3.connect per call, as before db.py
+"""
+import argparse, asyncio, logging, os, sqlite3, sys, tempfile, time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+PEER_ID = 7740422022
+WORDS = ("call tomorrow", "video at 8pm", "budget is fine", "ok", "deadline friday",
+         "no makeup please", "private booked", "thanks", "cancel that", "running late")
+
+def seed_db(path: str, n: int):
+    import calls, db_migrate, keywords
+    con = sqlite3.connect(path)
+    db_migrate.migrate(con)
+    now = datetime.now(timezone.utc)
+    con.execute("INSERT OR IGNORE INTO peers(peer_id, slack_channel_id) VALUES (?,?)", (PEER_ID, "C1"))
+    con.executemany(
+        "INSERT INTO messages(peer_id,msg_id,ts_utc,from_me,text) VALUES (?,?,?,?,?)",
+        [(PEER_ID, i, (now - timedelta(minutes=5 * (n - i))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+          i % 2, f"{WORDS[i % len(WORDS)]} #{i}") for i in range(n)])
+    # what the ingest hooks would have done for these rows
+    keywords.retag_all(con)
+    calls.redetect_all(con)
+    con.commit(); con.close()
+
+class _Stub:
+    """Answers any attribute chain / call with itself; enough for ai.* and slack.*."""
+    def __getattr__(self, name): return self
+    def __call__(self, *a, **k): return self
+
+def _per_call_connections():
+    import db
+    @contextmanager
+    def connection():
+        con = sqlite3.connect(db.DB_PATH)
+        con.row_factory = sqlite3.Row
+        try:
+            yield con
+        finally:
+            con.close()
+    db.connection = connection
+
+async def _hammer(client, method, path, n, concurrency, **kw):
+    sem = asyncio.Semaphore(concurrency)
+    async def one():
+        async with sem:
+            r = await client.request(method, path, **kw)
+            assert r.status_code == 200, (path, r.status_code, r.text)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    return n / (time.perf_counter() - t0)
+
+async def run(args):
+    import httpx
+    import app as app_module
+    logging.disable(logging.INFO)  # per-request log lines would dominate the timing
+    app_module.ai = _Stub()
+    app_module.slack = _Stub()
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        form = {"text": "call", "user_name": "bench", "user_id": "U1"}
+        for name, method, path, kw in (
+            ("/health", "GET", "/health", {}),
+            ("/question", "POST", "/question", {"data": form}),
+            ("/callprep", "POST", "/callprep", {"data": form}),
+        ):
+            await _hammer(client, method, path, 20, args.concurrency, **kw)  # warm-up
+            rps = await _hammer(client, method, path, args.requests, args.concurrency, **kw)
+            print(f"{name:<10} {rps:8.1f} req/s")
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--baseline", action="store_true", help="open a new connection per helper call")
+    p.add_argument("--rows", type=int, default=20000)
+    p.add_argument("--requests", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=16)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-bench")
+    seed_db(os.environ["DB_PATH"], args.rows)
+    if args.baseline:
+        _per_call_connections()
+    print(f"{'baseline (connect per call)' if args.baseline else 'pooled'}: "
+          f"{args.rows} rows, {args.requests} requests, concurrency {args.concurrency}")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Microbenchmark: hot_window.HotWindows against the SQL window reads it
+replaces, on a copy of a bench corpus (bench/corpus.py).
+
+    python -m bench.bench_hot_window              # 100k corpus, main peer
+    python -m bench.bench_hot_window --size 1m
+
+Reports the window's load time and bytes per message (vs a fetchall() of
+tuples and of dicts, measured with tracemalloc), read times for the 90-day
+and 7-day windows and the last 40 rows (SQL fetch + iterate vs slice +
+iterate), and what a refresh costs after another connection inserts rows.
+"""
+import argparse, os, shutil, sqlite3, statistics, subprocess, sys, time, tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from bench import corpus
+
+def best_ms(fn, repeat: int) -> float:
+    fn()
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(out)
+
+def allocated(fn) -> int:
+    tracemalloc.start()
+    keep = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return size
+
+def main():
+    p = argparse.ArgumentParser(description="Hot window vs SQL window reads")
+    p.add_argument("--size", default="100k")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--repeat", type=int, default=20)
+    args = p.parse_args()
+
+    size = corpus.parse_size(args.size)
+    cached = corpus.cached_path(size, args.seed)
+    if not os.path.exists(cached):
+        subprocess.run([sys.executable, "-m", "bench.corpus", str(size), "--seed", str(args.seed)], check=True)
+    from bench.run import working_copy
+    path = working_copy(cached)
+    os.environ["DB_PATH"] = path   # before anything imports db
+    import db_migrate, hot_window, timestamps
+    con = sqlite3.connect(path)
+    db_migrate.migrate(con)   # message_edits, if the cached corpus predates it
+
+    peer = corpus.MAIN_PEER
+    since90 = (datetime.now(timezone.utc) - timedelta(days=90)).strftime(hot_window.TS_FMT)
+    since7 = (datetime.now(timezone.utc) - timedelta(days=7)).strftime(hot_window.TS_FMT)
+    sql = "SELECT ts_utc, from_me, text FROM messages WHERE peer_id=? AND ts_epoch >= ? ORDER BY ts_epoch ASC"
+
+    def fetch(since):
+        return con.execute(sql, (peer, timestamps.epoch(since))).fetchall()
+
+    def fetch_dicts():
+        cur = con.execute("SELECT id, peer_id, msg_id, ts_utc, from_me, text FROM messages "
+                          "WHERE peer_id=? AND ts_epoch >= ? ORDER BY ts_epoch ASC", (peer, timestamps.epoch(since90)))
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, r)) for r in cur]
+
+    windows = hot_window.HotWindows(path)
+    windows.start()
+    t0 = time.perf_counter()
+    win = windows.window(peer)
+    load_ms = (time.perf_counter() - t0) * 1000
+    rows = list(windows.since(peer, since90))
+    assert rows == fetch(since90), "window differs from SQL"
+
+    n = win.n
+    print(f"corpus {corpus.label(size)}: peer {peer}, {n} messages in the last {windows.days} days, loaded in {load_ms:.1f}ms")
+    print(f"{'memory':<34} {'bytes/msg':>10}")
+    print(f"{'hot window (columns)':<34} {win.nbytes() / n:10.1f}")
+    print(f"{'hot window, text excluded':<34} {(win.nbytes() - len(win.buf)) / n:10.1f}")
+    print(f"{'fetchall() tuples':<34} {allocated(lambda: fetch(since90)) / n:10.1f}")
+    print(f"{'fetchall() as dicts':<34} {allocated(fetch_dicts) / n:10.1f}")
+
+    def drain(it):
+        for _ in it:
+            pass
+
+    print(f"\n{'read':<34} {'sql ms':>10} {'window ms':>10}")
+    for name, sql_fn, win_fn in (
+            ("90d, iterate", lambda: drain(fetch(since90)), lambda: drain(windows.since(peer, since90))),
+            ("7d, iterate", lambda: drain(fetch(since7)), lambda: drain(windows.since(peer, since7))),
+            ("7d as dicts, iterate", None, lambda: drain(windows.since(peer, since7, shape="dict"))),
+            ("90d, last 40 rows", lambda: drain(fetch(since90)[-40:]), lambda: drain(windows.since(peer, since90)[-40:]))):
+        a = f"{best_ms(sql_fn, args.repeat):10.2f}" if sql_fn else f"{'':>10}"
+        print(f"{name:<34} {a} {best_ms(win_fn, args.repeat):10.2f}")
+
+    # another connection writes; the next read sees it
+    writer = sqlite3.connect(path)
+    now = datetime.now(timezone.utc).strftime(hot_window.TS_FMT)
+    top = writer.execute("SELECT MAX(msg_id) FROM messages WHERE peer_id=?", (peer,)).fetchone()[0]
+    print(f"\n{'refresh':<34} {'ms':>10}")
+    print(f"{'nothing changed':<34} {best_ms(windows.refresh, args.repeat):10.3f}")
+    for k in (1, 100):
+        writer.executemany("INSERT INTO messages(peer_id, msg_id, ts_utc, from_me, text) VALUES (?,?,?,?,?)",
+                           [(peer, top + i + 1, now, i % 2, f"bench row {i}") for i in range(k)])
+        writer.commit()
+        top += k
+        t0 = time.perf_counter()
+        windows.refresh()
+        print(f"{f'{k} new row(s)':<34} {(time.perf_counter() - t0) * 1000:10.3f}")
+    writer.execute("UPDATE messages SET text = text || '!' WHERE peer_id=? AND msg_id=?", (peer, top))
+    writer.commit()
+    t0 = time.perf_counter()
+    windows.refresh()
+    print(f"{'1 edit (reloads the peer)':<34} {(time.perf_counter() - t0) * 1000:10.3f}")
+    assert list(windows.since(peer, since90)) == fetch(since90), "window differs from SQL after refresh"
+
+    windows.stop()
+    writer.close()
+    con.close()
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Microbenchmark: the durable job queue (executor.py) on a throwaway db.
+
+    python -m bench.bench_jobs                      # 2000 jobs, 4 workers
+    python -m bench.bench_jobs --jobs 10000 --history 100000
+
+Reports submit() latency on an idle queue and while the workers are
+claiming and finishing jobs, the cost of a deduplicated resubmit (a Slack
+retry), and claim + run + finish throughput with no-op handlers. A history
+of finished jobs is inserted first, since the table carries a day's worth.
+
+Write contention: submit() again while another thread holds a write
+transaction open on briefs.db (the ingest daemon's flush, a backfill),
+and while another connection keeps inserting into jobs.db (a second API
+process). Exits 1 if the p99 of submit() is over --budget-ms in any of
+the idle, busy or briefs.db-locked cases (the Slack ack has 3s for
+everything), or if the second writer made it refuse a job.
+"""
+import argparse, asyncio, logging, os, shutil, sqlite3, sys, tempfile, threading, time
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def row(name, ms):
+    print(f"{name:<34} {pct(ms, 50):8.3f} {pct(ms, 99):8.3f} {max(ms):8.3f}")
+
+async def run(args):
+    import db, executor
+    logging.disable(logging.WARNING)
+    done = asyncio.Event()
+    ran = []
+
+    async def noop(i):
+        ran.append(i)
+        if len(ran) == args.jobs:
+            done.set()
+
+    ex = executor.JobExecutor(concurrency=args.workers, max_queue=args.jobs * 4)
+    ex.register("/bench", noop)
+    ex.start()
+    now = time.time()
+    ex._con.execute("BEGIN")
+    ex._con.executemany("INSERT INTO jobs(name, args, priority, state, attempts, dedup_key, created, run_after, finished) "
+                        "VALUES ('/bench', '[]', 1, 'done', 1, ?, ?, ?, ?)",
+                        [(f"h{i}", now - 3600, now - 3600, now - 3600) for i in range(args.history)])
+    ex._con.execute("COMMIT")
+    for w in ex._workers:   # the first half is timed with no workers running
+        w.cancel()
+    await asyncio.gather(*ex._workers, return_exceptions=True)
+    ex._workers = []
+
+    def submit(i, out, redelivery=False):
+        t0 = time.perf_counter()
+        res = ex.submit(1, "/bench", i, key=f"k{i}", redelivery=redelivery)
+        out.append((time.perf_counter() - t0) * 1000)
+        return res
+
+    idle, busy, dup = [], [], []
+    n = args.jobs // 2
+    for i in range(n):
+        assert submit(i, idle) == executor.QUEUED
+    for i in range(min(n, 500)):
+        assert submit(i, dup, redelivery=True) == executor.DUPLICATE
+
+    # the other half goes in while the workers drain the first
+    ex._workers = [asyncio.create_task(ex._worker(i)) for i in range(args.workers)]
+    t0 = time.perf_counter()
+    for i in range(n, args.jobs):
+        assert submit(i, busy) == executor.QUEUED
+        await asyncio.sleep(0)
+    await asyncio.wait_for(done.wait(), 120)
+    wall = time.perf_counter() - t0
+
+    def hold_briefs(stop):
+        # an ingest flush: one write transaction on briefs.db, held until told
+        con = sqlite3.connect(db.DB_PATH, isolation_level=None)
+        con.execute("CREATE TABLE IF NOT EXISTS bench_ingest(x)")
+        con.execute("BEGIN IMMEDIATE")
+        con.execute("INSERT INTO bench_ingest VALUES (1)")
+        locked.set()
+        stop.wait()
+        con.execute("COMMIT")
+        con.close()
+
+    def write_jobs(stop):
+        # another API process under load: its own connection, a jobs.db write every millisecond
+        con = sqlite3.connect(ex.path, isolation_level=None, timeout=5)
+        while not stop.wait(0.001):
+            con.execute("INSERT INTO jobs(name, args, priority, state, created, run_after, finished) "
+                        "VALUES ('/other', '[]', 1, 'done', ?, ?, ?)", (time.time(),) * 3)
+        con.close()
+
+    async def contended(target, out):
+        stop = threading.Event()
+        th = threading.Thread(target=target, args=(stop,))
+        th.start()
+        await asyncio.to_thread(locked.wait)
+        rejected = ex.rejected
+        for i in range(next_id[0], next_id[0] + args.contended):
+            assert submit(i, out) in (executor.QUEUED, executor.FULL)
+            await asyncio.sleep(0.001)
+        next_id[0] += args.contended
+        stop.set()
+        await asyncio.to_thread(th.join)
+        return ex.rejected - rejected
+
+    locked, next_id = threading.Event(), [args.jobs]
+    briefs_locked, jobs_written = [], []
+    briefs_refused = await contended(hold_briefs, briefs_locked)
+    locked.set()   # the jobs.db writer needs no setup
+    jobs_refused = await contended(write_jobs, jobs_written)
+    await ex.drain()
+
+    print(f"{args.jobs} jobs, {args.history} finished jobs in the table, {args.workers} workers")
+    print(f"{'submit':<34} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    row("submit(), idle queue", idle)
+    row("submit(), workers running", busy)
+    row("duplicate redelivery (Slack retry)", dup)
+    row("submit(), briefs.db write-locked", briefs_locked)
+    row("submit(), second jobs.db writer", jobs_written)
+    print(f"\nran {args.jobs} no-op jobs in {wall:.2f}s, {args.jobs / wall:.0f} jobs/s "
+          f"(claim + finish, two SQLite writes each)")
+
+    p99 = pct(idle + busy + briefs_locked, 99)
+    ok = p99 < args.budget_ms and not briefs_refused and not jobs_refused
+    print(f"\n{'ok  ' if ok else 'FAIL'} submit p99 {p99:.3f}ms (budget {args.budget_ms}ms); "
+          f"refused under contention: {briefs_refused} (briefs.db), {jobs_refused} (jobs.db, "
+          f"{executor.BUSY_TIMEOUT_MS}ms busy timeout)")
+    return 0 if ok else 1
+
+def main():
+    p = argparse.ArgumentParser(description="Job queue enqueue latency and throughput")
+    p.add_argument("--jobs", type=int, default=2000)
+    p.add_argument("--history", type=int, default=20000)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--contended", type=int, default=500, help="submits timed in each contention case")
+    p.add_argument("--budget-ms", type=float, default=1.0)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_PATH"] = os.path.join(tmp, "briefs.db")   # before anything imports db; jobs.db goes next to it
+    try:
+        return asyncio.run(run(args))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
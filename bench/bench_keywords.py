@@ -0,0 +1,104 @@
+"""
+Microbenchmark: the old CALL_KEYS substring loop vs keywords.matcher over
+synthetic chat messages.
+
+    python -m bench.bench_keywords            # 1M messages
+    python -m bench.bench_keywords -n 200000
+    python -m bench.bench_keywords --sql      # + call lines of a 1-day window, scan vs message_tags
+
+Reports msgs/s for each, and how many messages the two disagree on (the old
+loop's extra hits are substring false positives like "am" in "game").
+"""
+import argparse, os, random, sqlite3, tempfile, time
+from datetime import datetime, timedelta, timezone
+
+import db_migrate, keywords
+from keywords import matcher
+
+OLD_CALL_KEYS = ("call","private","cb","chaturbate","stream","record","book","booked","confirm","confirmed",
+                 "resched","reschedule","cancel","canceled","time","am","pm","o'clock","tomorrow","today",
+                 "makeup","no makeup","natural","surprise")
+
+FILLER = ("ok", "haha", "love you", "what are you doing", "that game was wild", "so much spam lately",
+          "sample pics", "example", "I am tired", "scab on my knee", "lol", "good morning babe",
+          "dinner was amazing", "I'm at the gym", "sending now", "thanks", "miss you", "what a nightmare")
+SIGNAL = ("call at 8pm?", "can we do a private tomorrow", "booked for 9am", "confirmed!", "need to reschedule",
+          "cancelled sorry", "no makeup this time", "stream tonight", "recording now", "surprise me")
+
+def corpus(n: int, signal_ratio: float = 0.15):
+    rnd = random.Random(7)
+    out = []
+    for i in range(n):
+        if rnd.random() < signal_ratio:
+            out.append(f"{rnd.choice(SIGNAL)} {rnd.choice(FILLER)}")
+        else:
+            out.append(f"{rnd.choice(FILLER)} {rnd.choice(FILLER)}")
+    return out
+
+def old_loop(texts):
+    return [any(k in t.lower() for k in OLD_CALL_KEYS) for t in texts]
+
+def new_any(texts):
+    m = matcher.any
+    return [m(t) for t in texts]
+
+def new_mask(texts):
+    m = matcher.mask
+    return [m(t) for t in texts]
+
+def timed(fn, texts):
+    t0 = time.perf_counter()
+    out = fn(texts)
+    return out, time.perf_counter() - t0
+
+def sql_window(texts):
+    """Call lines of the last day out of len(texts) messages spread over 30 days."""
+    with tempfile.TemporaryDirectory() as d:
+        con = sqlite3.connect(os.path.join(d, "kw.db"))
+        db_migrate.migrate(con)
+        now = datetime.now(timezone.utc)
+        step = timedelta(days=30) / len(texts)
+        con.executemany("INSERT INTO messages(peer_id,msg_id,ts_utc,from_me,text) VALUES (?,?,?,?,?)",
+                        [(1, i, (now - step * (len(texts) - i)).strftime("%Y-%m-%dT%H:%M:%SZ"), i % 2, t)
+                         for i, t in enumerate(texts)])
+        t0 = time.perf_counter()
+        keywords.retag_all(con)
+        con.commit()
+        print(f"tag {len(texts)} rows: {time.perf_counter() - t0:.2f}s")
+        since = (now - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        t0 = time.perf_counter()
+        rows = con.execute("SELECT ts_utc, from_me, text FROM messages WHERE peer_id=? AND ts_epoch >= ? ORDER BY ts_epoch",
+                           (1, int((now - timedelta(days=1)).timestamp()))).fetchall()
+        old = [r for r in rows if any(k in r[2].lower() for k in OLD_CALL_KEYS)][-200:]
+        t_scan = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        new = keywords.call_lines(con, 1, since, 200)
+        t_idx = time.perf_counter() - t0
+        print(f"1-day window ({len(rows)} msgs): scan+loop {t_scan * 1000:.1f}ms ({len(old)} lines), "
+              f"message_tags {t_idx * 1000:.1f}ms ({len(new)} lines)")
+        con.close()
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("-n", type=int, default=1_000_000)
+    p.add_argument("--sql", action="store_true")
+    args = p.parse_args()
+    texts = corpus(args.n)
+    print(f"{args.n} messages")
+    old, t_old = timed(old_loop, texts)
+    new, t_new = timed(new_any, texts)
+    _, t_mask = timed(new_mask, texts)
+    for name, t in (("old any(k in low)", t_old), ("matcher.any", t_new), ("matcher.mask (all)", t_mask)):
+        print(f"{name:<20} {t:6.2f}s  {args.n / t / 1e6:5.2f} M msg/s")
+    print(f"speedup any: {t_old / t_new:.1f}x")
+    only_old = [t for t, a, b in zip(texts, old, new) if a and not b]
+    only_new = sum(1 for a, b in zip(old, new) if b and not a)
+    print(f"hits: old={sum(old)} new={sum(new)}  old-only={len(only_old)} new-only={only_new}")
+    for t in sorted(set(only_old))[:5]:
+        print(f"  old-only e.g. {t!r}")
+    if args.sql:
+        sql_window(texts)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark: a thread's first /question against its follow-ups (sessions.py),
+end to end through app.handle_question, OpenAI and Slack stubbed.
+
+    python -m bench.bench_sessions                       # 20 threads, 3 follow-ups each
+    python -m bench.bench_sessions --rows 50000 --llm-latency 0.3
+    python -m bench.bench_sessions --no-index            # the 90-day window instead of top-k
+
+The peer is indexed (hashing embeddings) unless --no-index. Each thread
+asks about privates, again about privates (related: the session's rows
+are reused, no retrieval), then about the budget (unrelated: it retrieves
+its own top-k into the session) and again about the budget (related to
+that). Without an index every question works from the 90-day window.
+A follow-up sends only the rows its terms or hits pick out and those no
+earlier turn has seen, next to the earlier turns. New messages are
+written between questions so follow-ups have a delta to catch up on.
+
+Reports job latency and the prompt tokens the stub billed for each kind.
+Exits 1 unless related follow-ups are faster and cheaper than first
+questions, follow-ups as a whole are cheaper, and every question's prompt
+carried the messages it is about.
+"""
+import argparse, asyncio, itertools, logging, os, shutil, sqlite3, statistics, sys, tempfile, time
+from datetime import datetime, timezone
+
+from bench.bench_endpoints import PEER_ID, seed_db
+from bench.stubs import OpenAIStub, SlackStub
+
+# (question, kind, what its prompt needs)
+FIRST = ("when is the next private booked?", "first", "private booked")
+FOLLOWUPS = (("when is the next private?", "related", "private booked"),
+             ("what did he say about the budget?", "unrelated", "budget is fine"),
+             ("did he mention the budget again?", "related", "budget is fine"))
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def row(name, ms, tokens):
+    if ms:
+        print(f"{name:<22} {len(ms):5d} {pct(ms, 50):9.1f} {pct(ms, 95):9.1f} {statistics.mean(tokens):12.0f}")
+
+async def run(args, oai):
+    import app as app_module, llm, metrics, sessions
+    logging.disable(logging.INFO)
+    await app_module.app.router.startup()
+
+    def prompt_tokens():
+        return metrics.LLM_TOKENS.value(model=llm.DEFAULT_MODEL, kind="prompt")
+
+    msg_ids = itertools.count(10**9)
+
+    def write_messages(n):
+        con = sqlite3.connect(os.environ["DB_PATH"])
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        con.executemany("INSERT INTO messages(peer_id,msg_id,ts_utc,from_me,text) VALUES (?,?,?,?,?)",
+                        [(PEER_ID, next(msg_ids), now, i % 2, f"new message {i} about the call") for i in range(n)])
+        con.commit(); con.close()
+
+    out = {"first": ([], []), "related": ([], []), "unrelated": ([], [])}
+    missing = 0
+    for t in range(args.threads):
+        thread_ts = f"{t + 1}.0"
+        for question, kind, needs in (FIRST,) + FOLLOWUPS[:args.followups]:
+            await asyncio.to_thread(write_messages, args.new)
+            before = prompt_tokens()
+            t0 = time.perf_counter()
+            await app_module.handle_question(PEER_ID, "C1", thread_ts, question)
+            out[kind][0].append((time.perf_counter() - t0) * 1000)
+            out[kind][1].append(prompt_tokens() - before)
+            if needs not in oai.last_request["messages"][-1]["content"]:
+                missing += 1
+    stats = sessions.threads.stats()
+    await app_module.app.router.shutdown()
+
+    print(f"{args.rows} messages{'' if args.index else ' (no index)'}, {args.threads} threads x "
+          f"(1 + {args.followups}), {args.new} new messages before each question, llm_latency={args.llm_latency}s")
+    print(f"{'':<22} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'prompt tok':>12}")
+    row("first question", *out["first"])
+    row("follow-up, related", *out["related"])
+    row("follow-up, unrelated", *out["unrelated"])
+    print(f"sessions: {stats}")
+
+    first, related = out["first"], out["related"]
+    tokens = statistics.mean(first[1])
+    followup_tokens = statistics.mean(related[1] + out["unrelated"][1])
+    ok = (pct(related[0], 50) < pct(first[0], 50) and statistics.mean(related[1]) < tokens
+          and followup_tokens < tokens and not missing)
+    print(f"\n{'ok  ' if ok else 'FAIL'} related follow-up p50 {pct(related[0], 50) / pct(first[0], 50):.0%} of the "
+          f"first question's, prompt tokens {statistics.mean(related[1]) / tokens:.0%} "
+          f"(all follow-ups {followup_tokens / tokens:.0%}); "
+          f"prompts missing what the question is about: {missing}/{sum(len(ms) for ms, _ in out.values())}")
+    return 0 if ok else 1
+
+def main():
+    p = argparse.ArgumentParser(description="First /question vs follow-ups in the same thread")
+    p.add_argument("--rows", type=int, default=20000)
+    p.add_argument("--threads", type=int, default=20)
+    p.add_argument("--followups", type=int, default=3, choices=range(1, len(FOLLOWUPS) + 1))
+    p.add_argument("--new", type=int, default=5, help="messages written before each question")
+    p.add_argument("--llm-latency", type=float, default=0.0)
+    p.add_argument("--no-index", dest="index", action="store_false", help="no embedding index for the peer")
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "bench.db")
+    os.environ["DB_PATH"] = path   # before anything imports db
+    try:
+        seed_db(path, args.rows)
+        con = sqlite3.connect(path)
+        con.execute("INSERT INTO summaries(posted_utc, channel_id, ts, date_label, text, peer_id) VALUES (?,?,?,?,?,?)",
+                    (datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "C1", "1.000", "1/1/25", "s", PEER_ID))
+        con.commit(); con.close()
+        if args.index:
+            import db, embeddings
+            con = db.open_connection(path)
+            embeddings.sync(con, PEER_ID)
+            con.close()
+        with OpenAIStub(latency=args.llm_latency) as oai, SlackStub() as sl:
+            os.environ.update({
+                "OPENAI_API_KEY": "sk-bench", "SLACK_BOT_TOKEN": "xoxb-bench", "SLACK_SKIP_VERIFY": "1",
+                "OPENAI_BASE_URL": oai.url, "SLACK_API_URL": sl.url, "LLM_CACHE": "0",
+                "LLM_RPM": "0",   # 500 rpm would pace the back-to-back questions, not measure them
+            })
+            return asyncio.run(run(args, oai))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Deterministic synthetic corpus for benchmarks: peers, messages, facts,
+calls and summaries at 10k / 100k / 1M messages.
+
+    python -m bench.corpus 100k                 # -> bench/.cache/corpus-v1-100k-s7-<yyyymmdd>.db
+    python -m bench.corpus 1m --seed 3 --out /tmp/big.db
+
+Messages go through ingest.MessageStore, so tags, detected calls and the
+vector index are built by the same hooks as in production. Texts, order and
+spacing depend only on (size, seed); the timeline ends at the top of the
+current UTC hour so the "today" and "last 90 days" windows the app uses
+are populated. build() reuses a file it already made today for the same
+size and seed (bench/.cache, with its .vectors index next to it).
+"""
+import argparse, os, random, shutil, time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+MAIN_PEER = 7740422022
+# the main chat gets most of the traffic, like production
+PEERS = ((MAIN_PEER, "main", "C1", 0.7), (1001, "second", "C2", 0.15),
+         (1002, "third", "C3", 0.1), (1003, "quiet", "C4", 0.05))
+BATCH = 20_000
+VERSION = 1   # bump when the generated content changes
+
+# Zipf-weighted vocabulary; the signal phrases hit the keywords categories
+WORDS = ("ok yes no lol haha babe love you what are doing today tonight tomorrow morning night good bad "
+         "tired home work gym dinner lunch food coffee sleep later soon now still just really so very "
+         "miss hope think know want need like send sending sent pics photo video new old game movie "
+         "show music song car drive trip week weekend friday monday sunday sorry thanks please wait "
+         "nightmare amazing funny crazy wild busy free late early rain sun beach party friend mum dad "
+         "dog cat phone battery wifi spam sample example knee scab shopping dress shoes hair nails").split()
+SIGNAL = ("call at 8pm?", "can we do a private tomorrow", "booked for 9am", "confirmed!",
+          "need to reschedule", "cancelled sorry", "no makeup this time", "stream tonight",
+          "recording now", "video call later?", "budget is 300", "deadline friday", "paid the deposit",
+          "running late, 10 mins", "move it to sunday")
+FACTS = ("Prefers calls after 8pm", "Rate: {n}", "Timezone: Brisbane", "Birthday: {d} March",
+         "No makeup on weekdays", "Dog is called {w}", "Budget = {n}", "Works {w} shifts",
+         "fyi: likes surprises", "Favourite show: {w}")
+
+def parse_size(s: str) -> int:
+    s = str(s).lower()
+    if s in SIZES:
+        return SIZES[s]
+    mult = {"k": 1000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s.rstrip("km")) * mult)
+
+def label(n: int) -> str:
+    return next((k for k, v in SIZES.items() if v == n), str(n))
+
+def _texts(rnd: random.Random, n: int, signal_ratio: float = 0.12) -> List[str]:
+    cum = []
+    total = 0.0
+    for rank in range(1, len(WORDS) + 1):
+        total += 1.0 / rank
+        cum.append(total)
+    out = []
+    for _ in range(n):
+        words = rnd.choices(WORDS, cum_weights=cum, k=rnd.randint(2, 12))
+        if rnd.random() < signal_ratio:
+            words.insert(rnd.randint(0, len(words)), rnd.choice(SIGNAL))
+        out.append(" ".join(words))
+    return out
+
+def _iso(t: datetime) -> str:
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def generate(path: str, size: int, seed: int = 7, end: Optional[datetime] = None) -> Dict[str, int]:
+    """Write a fresh corpus to path (which must not exist). Returns row counts."""
+    import calls, db, db_migrate, facts, ingest, peers
+    rnd = random.Random(seed)
+    end = end or datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    span = timedelta(days=max(30, size // 2000))
+    start = end - span
+    con = db.open_connection(path)
+    db_migrate.migrate(con)
+    store = ingest.MessageStore(con)
+    for i, (peer_id, name, channel, _) in enumerate(PEERS):
+        peers.upsert(con, peer_id, name=name, slack_channel_id=channel, slack_channel_name=f"briefs-{name}")
+
+    # messages: each peer's share spread over the span, bursty (exponential gaps), ids in time order
+    for peer_id, _, _, share in PEERS:
+        n = max(1, int(size * share))
+        gaps = [rnd.expovariate(1.0) for _ in range(n)]
+        scale = span.total_seconds() / sum(gaps)
+        texts = _texts(rnd, n)
+        t = start.timestamp()
+        rows = []
+        for i in range(n):
+            t += gaps[i] * scale
+            rows.append((peer_id, i + 1, _iso(datetime.fromtimestamp(min(t, end.timestamp()), timezone.utc)),
+                         rnd.random() < 0.5, texts[i]))
+            if len(rows) >= BATCH:
+                store.insert(rows)
+                rows = []
+        if rows:
+            store.insert(rows)
+
+    # facts: ~1 per 50 messages with repeats and same-key updates, deduped the way /update would
+    fact_rows = []
+    for i in range(max(20, size // 50)):
+        peer_id = rnd.choices([p[0] for p in PEERS], weights=[p[3] for p in PEERS])[0]
+        text = rnd.choice(FACTS).format(n=rnd.randint(1, 40) * 25, d=rnd.randint(1, 28), w=rnd.choice(WORDS))
+        created = start + span * (i / max(20, size // 50))
+        fact_rows.append((_iso(created), "U0BENCH", text, peer_id))
+    con.executemany("INSERT INTO facts(created_utc, author_slack_id, text, peer_id) VALUES (?,?,?,?)", fact_rows)
+    facts.backfill(con)
+
+    # calls marked by hand, a few a month per peer (detected ones came from the ingest hooks)
+    days = span.days
+    for peer_id, _, _, share in PEERS:
+        for _ in range(max(1, int(days * share / 3))):
+            at = start + timedelta(seconds=rnd.uniform(0, span.total_seconds()))
+            con.execute("INSERT INTO calls(occurred_utc, source, notes, peer_id) VALUES (?,?,?,?)",
+                        (_iso(at), "manual", "bench", peer_id))
+
+    # one posted daily summary per peer per day
+    con.executemany(
+        "INSERT INTO summaries(posted_utc, channel_id, ts, date_label, text, peer_id) VALUES (?,?,?,?,?,?)",
+        [(_iso(start + timedelta(days=d, hours=8)), channel, f"{int((start + timedelta(days=d)).timestamp())}.000100",
+          f"{(start + timedelta(days=d)).day}/{(start + timedelta(days=d)).month}/{(start + timedelta(days=d)):%y}",
+          f"Date: summary {d}\n\n- {rnd.choice(SIGNAL)}", peer_id)
+         for d in range(days) for peer_id, _, channel, _ in PEERS])
+    con.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('bench_corpus', ?)",
+                (f"v{VERSION} size={size} seed={seed} end={_iso(end)}",))
+    con.commit()
+    con.execute("ANALYZE")
+    counts = {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+              for t in ("messages", "facts", "calls", "summaries")}
+    con.close()
+    return counts
+
+def cached_path(size: int, seed: int = 7) -> str:
+    day = datetime.now(timezone.utc).strftime("%Y%m%d")
+    return os.path.join(CACHE_DIR, f"corpus-v{VERSION}-{label(size)}-s{seed}-{day}.db")
+
+def build(size: int, seed: int = 7, out: Optional[str] = None) -> str:
+    """
+    Path of a corpus for (size, seed), generated unless already cached for
+    today. Generating imports db, which fixes db.DB_PATH: a process that goes
+    on to use the app should run `python -m bench.corpus` instead.
+    """
+    out = out or cached_path(size, seed)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    if os.path.exists(out):
+        return out
+    stem = os.path.splitext(out)[0]
+    tmp = stem + ".tmp.db"
+    for leftover in (tmp, tmp + "-wal", tmp + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    shutil.rmtree(stem + ".tmp.vectors", ignore_errors=True)
+    t0 = time.perf_counter()
+    counts = generate(tmp, size, seed)
+    # the vector index (embeddings.store_for: <db stem>.vectors) moves with the db
+    if os.path.isdir(stem + ".tmp.vectors"):
+        shutil.rmtree(stem + ".vectors", ignore_errors=True)
+        os.replace(stem + ".tmp.vectors", stem + ".vectors")
+    os.replace(tmp, out)
+    print(f"corpus {label(size)} seed={seed}: {counts} in {time.perf_counter() - t0:.1f}s -> {out}")
+    return out
+
+def main():
+    p = argparse.ArgumentParser(description="Generate a synthetic benchmark corpus")
+    p.add_argument("size", nargs="?", default="10k", help="10k | 100k | 1m | any count like 250k")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--out", help="db path (default: cached under bench/.cache)")
+    args = p.parse_args()
+    build(parse_size(args.size), args.seed, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Offline benchmark runner: every benchmark in bench/suite.py against a
+synthetic corpus (bench/corpus.py), with OpenAI and Slack served by the
+local stubs (bench/stubs.py), compared with bench/baselines.json.
+
+    python -m bench.run                       # 10k corpus, compare with baselines
+    python -m bench.run --size 100k -k sql.   # only names containing "sql."
+    python -m bench.run --size 100k --save    # record these numbers as the baselines
+    python -m bench.run --llm-latency 0.3     # slower stubs, for end-to-end job timings
+
+Each benchmark runs once to warm up, then until --repeat samples or
+--max-time seconds (at least 3 samples). Median and p95 are reported; a
+median more than --tolerance above its baseline (and at least 1ms slower)
+is a regression, and the exit status is 1. Runs use a copy of the cached
+corpus, since jobs and scripts write to it. Baselines are per corpus size
+and per machine in spirit: record them on the box that checks them.
+"""
+import argparse, asyncio, contextlib, io, json, logging, os, platform, shutil, statistics, subprocess, sys, tempfile, time
+from datetime import datetime, timezone
+
+from bench import corpus
+from bench.stubs import OpenAIStub, SlackStub
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+ABS_FLOOR_MS = 1.0   # differences below this are noise, whatever the ratio
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def _time(fn, env, repeat: int, max_time: float):
+    from bench.suite import is_async
+    call = (lambda: fn(env)) if is_async(fn) else (lambda: asyncio.to_thread(fn, env))
+    out = []
+    with contextlib.redirect_stdout(io.StringIO()):   # scripts print their progress
+        await call()                                   # warm-up
+        deadline = time.perf_counter() + max_time
+        while len(out) < repeat and (len(out) < 3 or time.perf_counter() < deadline):
+            t0 = time.perf_counter()
+            await call()
+            out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+async def run(args, names):
+    import httpx
+    import app as app_module
+    from bench.suite import BENCHMARKS, Env
+    await app_module.app.router.startup()
+    await asyncio.to_thread(app_module.preload)   # joins startup's background preload: no import in the timings
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            env = Env(app_module, client, args.oai, args.slack)
+            for name in names:
+                samples = await _time(BENCHMARKS[name], env, args.repeat, args.max_time)
+                results[name] = {"median_ms": round(statistics.median(samples), 3),
+                                 "p95_ms": round(pct(samples, 95), 3), "n": len(samples)}
+                report(name, results[name], args.baseline.get(name), args.tolerance)
+    finally:
+        await app_module.app.router.shutdown()
+    return results
+
+def regressed(res: dict, base: dict, tolerance: float) -> bool:
+    return (res["median_ms"] > base["median_ms"] * (1 + tolerance)
+            and res["median_ms"] - base["median_ms"] >= ABS_FLOOR_MS)
+
+def report(name: str, res: dict, base, tolerance: float):
+    line = f"{name:<36} {res['median_ms']:10.2f} {res['p95_ms']:10.2f} {res['n']:>4}"
+    if base:
+        delta = (res["median_ms"] - base["median_ms"]) / base["median_ms"] * 100 if base["median_ms"] else 0.0
+        flag = "  REGRESSION" if regressed(res, base, tolerance) else ""
+        line += f" {base['median_ms']:10.2f} {delta:+7.0f}%{flag}"
+    print(line, flush=True)
+
+def load_baselines() -> dict:
+    try:
+        with open(BASELINES) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_baselines(size_label: str, results: dict, args):
+    data = load_baselines()
+    entry = data.setdefault(size_label, {})
+    entry.setdefault("benchmarks", {}).update(results)
+    entry["recorded"] = {"utc": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                         "python": platform.python_version(), "machine": platform.machine(),
+                         "cpus": os.cpu_count(), "llm_latency": args.llm_latency,
+                         "slack_latency": args.slack_latency}
+    with open(BASELINES, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"saved {len(results)} baselines for {size_label} -> {BASELINES}")
+
+def working_copy(path: str) -> str:
+    """A throwaway copy of the cached corpus, so jobs and scripts never change the next run's data."""
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    dst = os.path.join(tmp, os.path.basename(path))
+    shutil.copyfile(path, dst)
+    # the vector index is only read by the suite: share it
+    os.symlink(os.path.splitext(path)[0] + ".vectors", os.path.splitext(dst)[0] + ".vectors")
+    return dst
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Run the offline benchmark suite")
+    p.add_argument("--size", default="10k", help="corpus size: 10k | 100k | 1m")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("-k", dest="filter", default="", help="only benchmarks whose name contains this")
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--max-time", type=float, default=5.0, help="seconds per benchmark after 3 samples")
+    p.add_argument("--llm-latency", type=float, default=0.0)
+    p.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed words")
+    p.add_argument("--slack-latency", type=float, default=0.0)
+    p.add_argument("--tolerance", type=float, default=0.3, help="allowed median slowdown vs baseline (0.3 = 30%%)")
+    p.add_argument("--save", action="store_true", help="write the results to bench/baselines.json")
+    p.add_argument("--list", action="store_true")
+    args = p.parse_args()
+
+    size = corpus.parse_size(args.size)
+    size_label = corpus.label(size)
+    cached = corpus.cached_path(size, args.seed)
+    if not os.path.exists(cached):
+        # in a child process: generating imports db before DB_PATH points at the corpus
+        subprocess.run([sys.executable, "-m", "bench.corpus", str(size), "--seed", str(args.seed)], check=True)
+    path = working_copy(cached)
+    # everything below reads its configuration at import time
+    os.environ.update({
+        "DB_PATH": path, "OPENAI_API_KEY": "sk-bench", "SLACK_BOT_TOKEN": "xoxb-bench",
+        "SLACK_SKIP_VERIFY": "1", "LLM_CACHE": "0", "LLM_RPM": "0", "SLOW_TRACE_S": "1e9",
+    })
+    # a corpus cached earlier may predate the newest migrations (which import db: after DB_PATH)
+    import db, db_migrate
+    with contextlib.closing(db.open_connection(path)) as con:
+        db_migrate.migrate(con)
+    from bench.suite import BENCHMARKS
+    names = [n for n in BENCHMARKS if args.filter in n]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    logging.disable(logging.WARNING)
+    args.baseline = load_baselines().get(size_label, {}).get("benchmarks", {})
+
+    with OpenAIStub(latency=args.llm_latency, token_delay=args.token_delay) as oai, SlackStub(latency=args.slack_latency) as sl:
+        os.environ.update({"OPENAI_BASE_URL": oai.url, "SLACK_API_URL": sl.url})
+        args.oai, args.slack = oai, sl
+        print(f"corpus {size_label} ({path}), llm_latency={args.llm_latency}s slack_latency={args.slack_latency}s")
+        print(f"{'benchmark':<36} {'median ms':>10} {'p95 ms':>10} {'n':>4} {'baseline':>10} {'delta':>8}")
+        results = asyncio.run(run(args, names))
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    if args.save:
+        save_baselines(size_label, results, args)
+        return 0
+    bad = [n for n, r in results.items() if n in args.baseline and regressed(r, args.baseline[n], args.tolerance)]
+    if bad:
+        print(f"\n{len(bad)} regression(s): {', '.join(bad)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
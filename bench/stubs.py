@@ -0,0 +1,132 @@
+"""
+Local stand-ins for the OpenAI chat completions API and the Slack Web API.
+
+Both run a ThreadingHTTPServer on 127.0.0.1 in a daemon thread and sleep for
+`latency` seconds per request, so the app can be exercised end to end offline.
+Streamed completions (stream=true) come back as server-sent events, one word
+per event, `token_delay` seconds apart:
+
+    with OpenAIStub(latency=0.2) as oai, SlackStub() as sl:
+        os.environ["OPENAI_BASE_URL"] = oai.url     # .../v1
+        os.environ["SLACK_API_URL"] = sl.url        # .../api/
+"""
+import json, socket, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _Server:
+    path_prefix = ""
+
+    def __init__(self, latency: float = 0.0, token_delay: float = 0.0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.calls = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # headers and body go out as two writes; without this the client's delayed ACK adds ~40ms
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                with stub._lock:
+                    stub.calls += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, payload = stub.handle(self.path, self.headers, raw)
+                if isinstance(payload, list):
+                    return self.send_events(status, payload)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def send_events(self, status, events):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, ev in enumerate(events + ["[DONE]"]):
+                    if i and stub.token_delay:
+                        time.sleep(stub.token_delay)
+                    data = f"data: {ev if isinstance(ev, str) else json.dumps(ev)}\n\n".encode()
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *a):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}{self.path_prefix}"
+
+    def handle(self, path, headers, raw):
+        raise NotImplementedError
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class OpenAIStub(_Server):
+    path_prefix = "/v1"
+
+    def __init__(self, latency: float = 0.0, reply: str = "- Stub summary line.", token_delay: float = 0.0):
+        super().__init__(latency, token_delay)
+        self.reply = reply
+        self.last_request: dict = {}
+
+    def handle(self, path, headers, raw):
+        req = self.last_request = json.loads(raw or b"{}")
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in req.get("messages", []))
+        completion_tokens = len(self.reply.split())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if req.get("stream"):
+            head = {"id": f"chatcmpl-stub-{self.calls}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": req.get("model", "stub")}
+            words = self.reply.split(" ")
+            events = [dict(head, choices=[{"index": 0, "finish_reason": None,
+                                           "delta": {"content": w if not i else " " + w}}])
+                      for i, w in enumerate(words)]
+            events.append(dict(head, choices=[{"index": 0, "finish_reason": "stop", "delta": {}}]))
+            if (req.get("stream_options") or {}).get("include_usage"):
+                events.append(dict(head, choices=[], usage=usage))
+            return 200, events
+        return 200, {
+            "id": f"chatcmpl-stub-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.reply}}],
+            "usage": usage,
+        }
+
+class SlackStub(_Server):
+    path_prefix = "/api/"
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.posted = []
+
+    def handle(self, path, headers, raw):
+        method = path.rsplit("/", 1)[-1].split("?")[0]
+        if method in ("chat.postMessage", "chat.update"):
+            self.posted.append(method)
+            return 200, {"ok": True, "channel": "C1", "ts": f"{time.time():.6f}"}
+        return 200, {"ok": True}
@@ -0,0 +1,164 @@
+"""
+The benchmarks bench/run.py times, asv style: one function per benchmark,
+registered with @bench(name), taking the Env built once per run.
+
+Names are grouped by prefix:
+    sql.*       hot read paths called directly on a pooled connection
+    endpoint.*  HTTP round trips through the ASGI app (no network)
+    job.*       slash-command jobs end to end, OpenAI and Slack stubbed
+    script.*    the daily scripts' main(), OpenAI and Slack stubbed
+
+LLM_CACHE is off so every job and script run reaches the OpenAI stub; the
+rollup cache stays on, so script timings are the steady state after the
+warm-up run. Jobs and scripts write (summaries, calls) to the corpus db.
+"""
+import asyncio, itertools
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Union
+from urllib.parse import urlencode
+
+from bench.corpus import MAIN_PEER
+
+BENCHMARKS: Dict[str, Callable[["Env"], Union[None, Awaitable[None]]]] = {}
+
+def bench(name: str):
+    def deco(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return deco
+
+def _ago(**kw) -> str:
+    return (datetime.now(timezone.utc) - timedelta(**kw)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class Env:
+    """Stubs, the imported app and an HTTP client on it; see run.py for the environment it needs."""
+
+    def __init__(self, app_module, client, oai, slack):
+        self.app = app_module
+        self.client = client
+        self.oai = oai
+        self.slack = slack
+        self.peer_id = MAIN_PEER
+        self.channel_id = "C1"
+
+    def con(self):
+        import db
+        return db.connection()
+
+# --- sql.* ---
+
+@bench("sql.search_messages.fts")
+def _(env):
+    import retrieval
+    with env.con() as con:
+        retrieval.search_messages(con, env.peer_id, "reschedule tomorrow")
+
+@bench("sql.search_messages.like")
+def _(env):
+    import retrieval
+    with env.con() as con:
+        retrieval.search_messages(con, env.peer_id, "ok")   # too short for the trigram index
+
+@bench("sql.get_window.7d")
+def _(env):
+    import retrieval
+    with env.con() as con:
+        for _ in retrieval.get_window(con, env.peer_id, datetime.now(timezone.utc) - timedelta(days=7)):
+            pass   # hot window rows decode when read: count that
+
+@bench("sql.fetch_messages_since.90d")
+def _(env):
+    for _ in env.app.fetch_messages_since(env.peer_id, _ago(days=90)):
+        pass
+
+@bench("sql.facts.relevant")
+def _(env):
+    import facts
+    with env.con() as con:
+        facts.relevant(con, env.peer_id, "what is her rate?")
+
+@bench("sql.calls.last_call")
+def _(env):
+    env.app.last_call_utc(env.peer_id)
+
+@bench("sql.keywords.call_lines.14d")
+def _(env):
+    import pipeline
+    pipeline._call_rows(env.peer_id, _ago(days=14))
+
+@bench("sql.summary_cache.load_latest")
+def _(env):
+    import summary_cache
+    with env.con() as con:
+        summary_cache.load_latest(con)
+
+@bench("sql.embeddings.search")
+def _(env):
+    import embeddings
+    with env.con() as con:
+        embeddings.search(con, env.peer_id, "when is the next private?")
+
+@bench("sql.question_context.90d")
+def _(env):
+    env.app.load_question_context(env.peer_id, _ago(days=90), "when is the next private?")
+
+# --- endpoint.* ---
+
+async def _ok(resp):
+    assert resp.status_code == 200, (resp.request.url, resp.status_code, resp.text[:200])
+
+@bench("endpoint.health")
+async def _(env):
+    await _ok(await env.client.get("/health"))
+
+@bench("endpoint.slack_command.ack")
+async def _(env):
+    # an unknown command: the full ack path (parse, summary lookup) without queueing a job
+    body = urlencode({"command": "/bench", "text": "", "user_id": "U1", "channel_id": env.channel_id})
+    await _ok(await env.client.post("/slack/command", content=body,
+                                    headers={"Content-Type": "application/x-www-form-urlencoded"}))
+
+@bench("endpoint.question")
+async def _(env):
+    await _ok(await env.client.post("/question", data={"text": "call tomorrow", "channel_id": env.channel_id}))
+
+@bench("endpoint.callprep")
+async def _(env):
+    await _ok(await env.client.post("/callprep", data={"text": "", "channel_id": env.channel_id}))
+
+# --- job.* ---
+
+_threads = itertools.count(1)
+
+@bench("job.question")
+async def _(env):
+    # a new thread each run, so it is always a first question (retrieval, no session)
+    await env.app.handle_question(env.peer_id, env.channel_id, f"{next(_threads)}.0", "when is the next private?")
+
+@bench("job.question.followup")
+async def _(env):
+    # one thread throughout: after the warm-up run, a follow-up on a session with earlier turns
+    await env.app.handle_question(env.peer_id, env.channel_id, "0.1", "and is that one at the usual place?")
+
+@bench("job.callprep")
+async def _(env):
+    await env.app.handle_callprep(env.peer_id, env.channel_id, "1.0")
+
+@bench("job.update")
+async def _(env):
+    await env.app.handle_update(env.peer_id, env.channel_id, "1.0", "U1", "Prefers calls after 8pm")
+
+# --- script.* ---
+
+@bench("script.daily_runner")
+async def _(env):
+    import daily_runner
+    assert await daily_runner.main() == 0
+
+@bench("script.post_daily_summary_slack")
+async def _(env):
+    import post_daily_summary_slack
+    await post_daily_summary_slack.main(env.peer_id)
+
+def is_async(fn) -> bool:
+    return asyncio.iscoroutinefunction(fn)
@@ -0,0 +1,77 @@
+"""
+Call anchors: when the last call with a peer happened.
+
+calls rows come from /markcall (source='manual') and from ingest: every
+message tagged in the keywords "meeting" category (call, private, video;
+not the cb/stream/record mentions the wider "call" category also holds)
+is recorded once as source='detected' with its message_id. Triggers on
+calls keep call_anchor (peer_id -> latest call) current, and deleting a
+message drops its detected call, so both /callprep endpoints read one row
+instead of scanning messages. occurred_utc is always written in
+timestamps.TS_FMT, so the triggers' text comparisons order by time.
+
+    calls.last_call(con, peer_id)   -> "2025-10-20T09:15:00Z" | None
+"""
+from __future__ import annotations
+import sqlite3
+from typing import Optional, Sequence, Tuple
+
+import keywords, timestamps
+
+DETECT_MASK = keywords.BITS["meeting"]
+
+# message_tags.ts_utc is in whatever format the message was written in; its ts_epoch is not
+OCCURRED_SQL = "strftime('%Y-%m-%dT%H:%M:%SZ', {}, 'unixepoch')"
+
+_DETECT_SQL = f"""
+    INSERT OR IGNORE INTO calls(occurred_utc, source, notes, peer_id, message_id)
+    SELECT {OCCURRED_SQL.format("t.ts_epoch")}, 'detected', '', t.peer_id, t.message_id
+    FROM message_tags t
+    WHERE t.message_id > ? AND (t.mask & ?) != 0
+"""
+
+def detect_inserted(con: sqlite3.Connection, after_id: int):
+    """ingest insert hook (after keywords.tag_inserted): record call messages with id > after_id."""
+    con.execute(_DETECT_SQL, (after_id, DETECT_MASK))
+
+def detect_edited(con: sqlite3.Connection, keys: Sequence[Tuple[int, int]]):
+    """ingest edit hook (after keywords.tag_edited): an edit can add or remove a call mention."""
+    for peer_id, msg_id in keys:
+        row = con.execute("SELECT id FROM messages WHERE peer_id=? AND msg_id=?", (peer_id, msg_id)).fetchone()
+        if not row:
+            continue
+        con.execute("DELETE FROM calls WHERE message_id=?", (row[0],))
+        con.execute(f"""
+            INSERT OR IGNORE INTO calls(occurred_utc, source, notes, peer_id, message_id)
+            SELECT {OCCURRED_SQL.format("ts_epoch")}, 'detected', '', peer_id, message_id FROM message_tags
+            WHERE message_id = ? AND (mask & ?) != 0
+        """, (row[0], DETECT_MASK))
+
+def redetect_all(con: sqlite3.Connection) -> int:
+    """Rebuild the detected calls from message_tags (migration, or after CATEGORIES changed)."""
+    con.execute("DELETE FROM calls WHERE source='detected'")
+    return con.execute(_DETECT_SQL, (0, DETECT_MASK)).rowcount
+
+def rebuild_anchors(con: sqlite3.Connection):
+    con.execute("DELETE FROM call_anchor")
+    con.execute("""
+        INSERT INTO call_anchor(peer_id, occurred_utc, call_id, source)
+        SELECT c.peer_id, c.occurred_utc, c.id, c.source FROM calls c
+        WHERE c.peer_id IS NOT NULL AND c.id = (
+          SELECT id FROM calls WHERE peer_id = c.peer_id ORDER BY occurred_utc DESC, id DESC LIMIT 1)
+    """)
+
+def mark(con: sqlite3.Connection, peer_id: int, occurred_utc: str, note: str = "") -> int:
+    """/markcall: a call that happened at occurred_utc (any format timestamps.epoch reads)."""
+    ts = timestamps.epoch(occurred_utc)
+    if ts is None:
+        raise ValueError(f"unparseable occurred_utc: {occurred_utc!r}")
+    cur = con.execute("INSERT INTO calls(occurred_utc, source, notes, peer_id) VALUES (?,?,?,?)",
+                      (timestamps.iso(ts), "manual", note, peer_id))
+    con.commit()
+    return cur.lastrowid
+
+def last_call(con: sqlite3.Connection, peer_id: int) -> Optional[str]:
+    """UTC time of the peer's latest call, marked or detected (None if there is none)."""
+    row = con.execute("SELECT occurred_utc FROM call_anchor WHERE peer_id=?", (peer_id,)).fetchone()
+    return row[0] if row else None
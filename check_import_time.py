@@ -0,0 +1,62 @@
+"""
+Cold-import budget check for the web app.
+
+Runs `python -X importtime -c "import app"` in fresh interpreters, takes the
+fastest cumulative time for `app`, and exits non-zero if it is over budget
+or if any module that should load lazily (clients, numpy) was imported. The
+import runs with no OpenAI/Slack keys set: settings are read, and checked,
+when the app is built, not at import.
+The platform scales to zero, so this import is paid by the first request.
+
+    python check_import_time.py                  # default budget, 5 runs
+    python check_import_time.py --budget-ms 600  # or IMPORT_BUDGET_MS=600
+"""
+import argparse, os, re, subprocess, sys, tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "750"))
+# built on first use (app.get_ai / get_slack) or preloaded after startup
+LAZY = ("openai", "numpy", "slack_sdk", "aiohttp", "embeddings")
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def import_profile(module: str = "app"):
+    """[(self_us, cumulative_us, depth, name)] for one cold import of module."""
+    with tempfile.TemporaryDirectory() as d:
+        env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "SLACK_BOT_TOKEN")}
+        env["DB_PATH"] = os.path.join(d, "import.db")
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             cwd=HERE, env=env, capture_output=True, text=True, check=True).stderr
+    return [(int(m[1]), int(m[2]), len(m[3]) // 2, m[4]) for m in LINE.finditer(out)]
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Fail if `import app` is over its cold-start budget")
+    p.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    p.add_argument("--runs", type=int, default=5, help="fresh interpreters; the fastest counts")
+    p.add_argument("--top", type=int, default=10, help="slowest direct imports to print")
+    args = p.parse_args()
+
+    best = None
+    for _ in range(args.runs):
+        prof = import_profile()
+        total = next(cum for _, cum, depth, name in prof if name == "app" and depth == 0)
+        if best is None or total < best[0]:
+            best = (total, prof)
+    total_ms, prof = best[0] / 1000, best[1]
+
+    print(f"{'module':<28} {'cumulative ms':>14}")
+    direct = sorted((cum, name) for _, cum, depth, name in prof if depth == 1)
+    for cum, name in reversed(direct[-args.top:]):
+        print(f"{name:<28} {cum / 1000:14.1f}")
+
+    failed = 0
+    eager = sorted({name.split(".")[0] for *_, name in prof} & set(LAZY))
+    if eager:
+        print(f"\nFAIL imported eagerly: {', '.join(eager)}")
+        failed += 1
+    ok = total_ms <= args.budget_ms
+    print(f"\n{'ok  ' if ok else 'FAIL'} import app: {total_ms:.0f}ms (budget {args.budget_ms:.0f}ms, best of {args.runs})")
+    failed += not ok
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Behaviour check for ingest_daemon.IngestDaemon, driven by a fake event source
+on a throwaway DB (no Telegram, no network).
+
+Covers the gap catch-up and its high-water mark, live inserts, edits and
+deletes, events for unwatched peers, a flush forced by batch size and one by
+FLUSH_INTERVAL, and deletes that carry no chat (private chats): they remove
+the msg_id from the watched users and basic groups, never from a channel.
+
+    python check_ingest_daemon.py        # prints each case, exit 1 on failure
+"""
+import asyncio, os, sys, tempfile
+
+USER = 7740422022            # private chat
+GROUP = -4012345678          # basic group: same msg_id sequence as private chats
+CHANNEL = -1001234567890     # supergroup: its own msg_id sequence
+STRANGER = 5550000001        # not watched
+
+def row(peer_id, msg_id, text, minute=0):
+    return (peer_id, msg_id, f"2025-03-01T10:{minute:02d}:00Z", msg_id % 2, text)
+
+class FakeSource:
+    """history: peer_id -> rows for catch_up; script: Events, or float pauses (seconds), for events()."""
+
+    def __init__(self, history=None, script=()):
+        self.history = history or {}
+        self.script = list(script)
+        self.asked = {}   # peer_id -> after_msg_id catch_up was called with
+
+    async def catch_up(self, peer_id, after_msg_id):
+        from ingest_daemon import Event
+        self.asked[peer_id] = after_msg_id
+        for r in self.history.get(peer_id, ()):
+            if r[1] > after_msg_id:
+                yield Event("new", peer_id, row=r)
+
+    async def events(self):
+        for step in self.script:
+            if isinstance(step, (int, float)):
+                await asyncio.sleep(step)
+            elif callable(step):
+                step()
+            else:
+                yield step
+
+def texts(con, peer_id):
+    return dict(con.execute("SELECT msg_id, text FROM messages WHERE peer_id=? ORDER BY msg_id", (peer_id,)).fetchall())
+
+def run_checks(con) -> int:
+    from ingest import MessageStore
+    from ingest_daemon import Event, IngestDaemon
+    store = MessageStore(con)
+    watched = [USER, GROUP, CHANNEL]
+    results = []
+
+    def case(name, ok, detail=""):
+        results.append(ok)
+        print(f"{'ok  ' if ok else 'FAIL'} {name}" + (f"   ({detail})" if detail and not ok else ""))
+
+    # --- catch-up: everything above the high-water mark, then nothing twice ---
+    history = {USER: [row(USER, i, f"hello {i}", i) for i in range(1, 6)],
+               CHANNEL: [row(CHANNEL, i, f"post {i}", i) for i in range(1, 4)]}
+    src = FakeSource(history)
+    d = IngestDaemon(src, store, watched, batch_size=2)
+    asyncio.run(d.run(once=True))
+    case("catch_up inserts the gap", d.ingested == 8 and store.count(USER) == 5 and store.count(CHANNEL) == 3,
+         f"ingested={d.ingested}")
+    case("catch_up advances high water", store.high_water(USER) == 5 and store.high_water(CHANNEL) == 3)
+    src = FakeSource(history)
+    d = IngestDaemon(src, store, watched)
+    asyncio.run(d.run(once=True))
+    case("second catch_up starts above high water", src.asked == {USER: 5, GROUP: 0, CHANNEL: 3} and d.ingested == 0,
+         f"asked={src.asked} ingested={d.ingested}")
+
+    # --- live events: insert, edit, delete, unwatched peer ---
+    script = [
+        Event("new", USER, row=row(USER, 6, "see you at 8pm", 6)),
+        Event("new", GROUP, row=row(GROUP, 7, "group hello", 7)),
+        Event("new", STRANGER, row=row(STRANGER, 1, "not ours", 1)),
+        Event("edit", USER, row=row(USER, 2, "hello 2 (edited)", 2)),
+        Event("delete", USER, msg_ids=[3]),
+        Event("delete", CHANNEL, msg_ids=[1]),
+    ]
+    d = IngestDaemon(FakeSource(script=script), store, watched, batch_size=100, flush_interval=10)
+    asyncio.run(d.run())
+    user = texts(con, USER)
+    case("live insert", user.get(6) == "see you at 8pm" and texts(con, GROUP) == {7: "group hello"}, f"{user}")
+    case("unwatched peer ignored", store.count(STRANGER) == 0)
+    case("edit rewrites text", user.get(2) == "hello 2 (edited)", f"{user.get(2)!r}")
+    case("delete with a chat", 3 not in user and 1 not in texts(con, CHANNEL), f"{sorted(user)}")
+    tagged = con.execute("SELECT count(*) FROM message_tags t JOIN messages m ON m.id = t.message_id "
+                         "WHERE m.peer_id=? AND m.msg_id=6", (USER,)).fetchone()[0]
+    case("insert hooks ran in the flush", tagged == 1, f"message_tags rows={tagged}")
+
+    # --- delete without a chat: users and basic groups only ---
+    d = IngestDaemon(FakeSource(script=[Event("delete", None, msg_ids=[2, 7])]), store, watched)
+    asyncio.run(d.run())
+    case("chatless delete removes the user's msg_id", 2 not in texts(con, USER), f"{sorted(texts(con, USER))}")
+    case("chatless delete removes the basic group's msg_id", 7 not in texts(con, GROUP), f"{texts(con, GROUP)}")
+    case("chatless delete leaves the channel's msg_id", 2 in texts(con, CHANNEL), f"{sorted(texts(con, CHANNEL))}")
+
+    # --- flush triggers: batch size, then the interval while the stream is idle ---
+    seen = {}
+    script = [Event("new", USER, row=row(USER, 10 + i, f"burst {i}", 10)) for i in range(3)]
+    script += [0.0, lambda: seen.update(after_batch=store.count(USER)),
+               Event("new", USER, row=row(USER, 20, "lone message", 20)), 0.3,
+               lambda: seen.update(after_idle=store.count(USER))]
+    before = store.count(USER)
+    d = IngestDaemon(FakeSource(script=script), store, watched, batch_size=3, flush_interval=0.1)
+    asyncio.run(d.run())
+    case("batch_size forces a flush", seen.get("after_batch") == before + 3, f"{seen} before={before}")
+    case("flush_interval flushes an idle stream", seen.get("after_idle") == before + 4, f"{seen} before={before}")
+    case("high water follows live inserts", store.high_water(USER) == 20, f"{store.high_water(USER)}")
+    return results.count(False)
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as d:
+        os.environ["DB_PATH"] = os.path.join(d, "ingest.db")   # before anything imports db
+        import db, db_migrate
+        con = db.open_connection()   # what ingest_daemon.main uses; flushes write from a worker thread
+        db_migrate.migrate(con)
+        failed = run_checks(con)
+        con.close()
+    print(f"\n{'all checks passed' if not failed else f'{failed} check(s) failed'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
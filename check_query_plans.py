@@ -0,0 +1,265 @@
+"""
+Query-plan regression check for the hot SQL statements.
+
+Builds a seeded throwaway DB with db_migrate.migrate(), runs EXPLAIN QUERY PLAN
+on every statement below and exits non-zero if any of them falls back to a
+full table SCAN (or sorts through a temp b-tree where an index should give
+the order for free).
+
+    python check_query_plans.py        # prints each plan, exit 1 on regression
+"""
+import os, re, sqlite3, sys, tempfile
+from datetime import datetime, timedelta, timezone
+
+import db_migrate, facts, keywords, retrieval, summary_cache
+
+PEER_ID = 7740422022
+SINCE = "2025-01-01T00:00:00Z"
+SINCE_EPOCH = 1735689600   # SINCE, for the messages windows (ts_epoch)
+
+# name -> (sql, params, allow_temp_sort)
+STATEMENTS = {
+    "app.fetch_messages_since": ("""
+        SELECT ts_utc, from_me, text
+        FROM messages
+        WHERE peer_id = ? AND ts_epoch >= ?
+        ORDER BY ts_epoch ASC
+    """, (PEER_ID, SINCE_EPOCH), False),
+    "summary_cache.stamp": (
+        "SELECT MAX(id) FROM summaries",
+        (), False),
+    "summary_cache.load_latest": (summary_cache._LATEST_SQL, (), False),
+    "facts.active.stamp": (
+        "SELECT MAX(id) FROM facts WHERE peer_id=?",
+        (PEER_ID,), False),
+    "facts.active": ("""
+        SELECT id, text, fact_key, created_utc FROM facts
+        WHERE peer_id=? AND superseded_by IS NULL ORDER BY id
+    """, (PEER_ID,), False),
+    "facts.add.duplicate": ("""
+        SELECT id, text, fact_key, created_utc FROM facts
+        WHERE peer_id=? AND text_hash=? AND superseded_by IS NULL
+    """, (PEER_ID, "0123456789abcdef"), False),
+    "facts.add.same_key": ("""
+        SELECT id, text, fact_key, created_utc FROM facts
+        WHERE peer_id=? AND fact_key=? AND superseded_by IS NULL AND id != ?
+    """, (PEER_ID, "rate", 0), False),
+    "facts.relevant.fts": ("""
+        SELECT f.id FROM facts_fts JOIN facts f ON f.id = facts_fts.rowid
+        WHERE facts_fts MATCH ? AND f.peer_id = ? AND f.superseded_by IS NULL
+        ORDER BY bm25(facts_fts) LIMIT ?
+    """, ('"rate"', PEER_ID, 40), True),
+    "peers.for_channel": (
+        "SELECT peer_id FROM peers WHERE slack_channel_id=?",
+        ("C123",), False),
+    "retrieval.search_messages.fts": ("""
+        SELECT m.id, m.peer_id, m.msg_id, m.ts_utc, m.from_me, m.text
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ? AND m.peer_id = ?
+        ORDER BY bm25(messages_fts), m.ts_epoch DESC
+        LIMIT ?
+    """, ('"call"', PEER_ID, 200), True),  # BM25 ranking has to sort the matches
+    "retrieval.search_messages.like": ("""
+        SELECT id, peer_id, msg_id, ts_utc, from_me, text
+        FROM messages
+        WHERE peer_id = ? AND (text LIKE ? ESCAPE '\\')
+        ORDER BY ts_epoch DESC
+        LIMIT ?
+    """, (PEER_ID, "%ok%", 200), False),
+    "retrieval.search_messages.like.since": ("""
+        SELECT id, peer_id, msg_id, ts_utc, from_me, text
+        FROM messages
+        WHERE peer_id = ? AND ts_epoch >= ? AND (text LIKE ? ESCAPE '\\')
+        ORDER BY ts_epoch DESC
+        LIMIT ?
+    """, (PEER_ID, SINCE_EPOCH, "%ok%", 200), False),
+    "retrieval.search_messages.fts.since": ("""
+        SELECT m.id, m.peer_id, m.msg_id, m.ts_utc, m.from_me, m.text
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ? AND m.peer_id = ? AND m.ts_epoch >= ?
+        ORDER BY bm25(messages_fts), m.ts_epoch DESC
+        LIMIT ?
+    """, ('"call"', PEER_ID, SINCE_EPOCH, 200), True),
+    "calls.last_call": (
+        "SELECT occurred_utc FROM call_anchor WHERE peer_id=?",
+        (PEER_ID,), False),
+    "calls.detect_inserted": ("""
+        SELECT t.ts_utc, 'detected', '', t.peer_id, t.message_id
+        FROM message_tags t
+        WHERE t.message_id > ? AND (t.mask & ?) != 0
+    """, (10**9, 1), False),
+    "calls.anchor_recompute": ("""
+        SELECT peer_id, occurred_utc, id, source FROM calls
+        WHERE peer_id = ? ORDER BY occurred_utc DESC, id DESC LIMIT 1
+    """, (PEER_ID,), False),
+    "retrieval.get_window": ("""
+        SELECT id, peer_id, msg_id, ts_utc, from_me, text
+        FROM messages
+        WHERE peer_id = ? AND ts_epoch >= ?
+        ORDER BY ts_epoch ASC
+    """, (PEER_ID, SINCE_EPOCH), False),
+    "keywords.call_lines": ("""
+        SELECT m.ts_utc, m.from_me, m.text
+        FROM message_tags t
+        JOIN messages m ON m.id = t.message_id
+        WHERE t.peer_id = ? AND t.ts_epoch >= ? AND (t.mask & ?) != 0
+        ORDER BY t.ts_epoch DESC
+        LIMIT ?
+    """, (PEER_ID, SINCE_EPOCH, 15, 200), False),
+    "embeddings.with_neighbours.before": ("""
+        SELECT id, peer_id, ts_utc, from_me, text FROM messages
+        WHERE peer_id = ? AND ts_epoch <= ? ORDER BY ts_epoch DESC LIMIT ?
+    """, (PEER_ID, SINCE_EPOCH, 3), False),
+    "embeddings.with_neighbours.after": ("""
+        SELECT id, peer_id, ts_utc, from_me, text FROM messages
+        WHERE peer_id = ? AND ts_epoch >= ? ORDER BY ts_epoch ASC LIMIT ?
+    """, (PEER_ID, SINCE_EPOCH, 3), False),
+    "embeddings.hydrate": ("""
+        SELECT id, peer_id, msg_id, ts_utc, from_me, text FROM messages WHERE id IN (?,?,?) AND +peer_id = ?
+    """, (1, 2, 3, PEER_ID), False),
+    "embeddings.fill_epochs": (
+        "SELECT id, ts_epoch FROM messages WHERE peer_id=? AND id >= ?",
+        (PEER_ID, 0), False),
+    "embeddings.sync": ("""
+        SELECT id, text, ts_epoch FROM messages WHERE peer_id=? AND id > ? ORDER BY id LIMIT ?
+    """, (PEER_ID, 0, 10000), False),
+    "hot_window.load": ("""
+        SELECT id, msg_id, CAST(strftime('%s', ts_utc) AS INTEGER), ts_utc, from_me, text
+        FROM messages
+        WHERE peer_id = ? AND ts_epoch >= ?
+        ORDER BY ts_epoch ASC
+    """, (PEER_ID, SINCE_EPOCH), False),
+    "hot_window.tail": ("""
+        SELECT peer_id, id, msg_id, ts_epoch, ts_utc, from_me, text FROM messages WHERE id > ? ORDER BY id
+    """, (1000,), False),
+    "sessions.newest_id": (
+        "SELECT MAX(id) FROM messages",
+        (), False),
+    "sessions.catch_up": ("""
+        SELECT id, ts_utc, from_me, text FROM messages
+        WHERE id > ? AND peer_id = ? ORDER BY id
+    """, (1000, PEER_ID), False),
+    # summarize_ai.py, send_daily_summary.py, post_daily_summary_slack.py, summarize_demo.py
+    "daily.load_day": ("""
+      SELECT ts_utc, from_me, text
+      FROM messages
+      WHERE peer_id=? AND ts_epoch >= ?
+      ORDER BY ts_epoch ASC
+    """, (PEER_ID, SINCE_EPOCH), False),
+    "executor.claim": ("""
+        UPDATE jobs SET state = 'running', attempts = attempts + 1, run_after = ?
+        WHERE id = (SELECT id FROM jobs WHERE state = 'queued' AND run_after <= ?
+                    ORDER BY priority, id LIMIT 1)
+        RETURNING id, name, args, attempts, created, progress
+    """, (2e9, 1.9e9), False),
+    "executor.redelivery": (
+        "SELECT 1 FROM jobs WHERE dedup_key = ? AND created >= ?",
+        ("k1", 1.7e9), False),
+    "executor.queue_stats": (
+        "SELECT count(*), min(created) FROM jobs WHERE state = 'queued'",
+        (), False),
+    "executor.sweep": (
+        "UPDATE jobs SET state = 'queued' WHERE state = 'running' AND run_after <= ?",
+        (1.9e9,), False),
+}
+
+# Realistic questions, run through the real code path: the statement it issues
+# has to be the FTS one (MATCH on the named table), not the LIKE fallback.
+QUESTIONS = ("when is the next call", "what is her rate?", "call me at 8")
+QUESTION_PATHS = {
+    "retrieval.search_messages": (lambda con, q: retrieval.search_messages(con, PEER_ID, q), "messages_fts"),
+    "facts.relevant": (lambda con, q: facts.relevant(con, PEER_ID, q), "facts_fts"),
+}
+
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+def seed(con: sqlite3.Connection, n: int = 2000):
+    db_migrate.migrate(con)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    con.executemany(
+        "INSERT INTO messages(peer_id,msg_id,ts_utc,from_me,text) VALUES (?,?,?,?,?)",
+        [(PEER_ID if i % 3 else 1, i, (base + timedelta(minutes=7*i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+          i % 2, f"message {i} about the call tomorrow" if i % 5 == 0 else f"message {i}")
+         for i in range(1, n + 1)])
+    con.executemany(
+        "INSERT INTO summaries(posted_utc, channel_id, ts, date_label, text) VALUES (?,?,?,?,?)",
+        [((base + timedelta(days=i)).strftime("%Y-%m-%dT%H:%M:%SZ"), f"C{i % 4}", f"{i}.000", "1/1/25", "s")
+         for i in range(200)])
+    con.executemany(
+        "INSERT INTO calls(occurred_utc, source, notes, peer_id) VALUES (?,?,?,?)",
+        [((base + timedelta(days=i)).strftime("%Y-%m-%dT%H:%M:%SZ"), "manual", "", PEER_ID if i % 2 else 1)
+         for i in range(200)])
+    con.executemany(
+        "INSERT INTO facts(created_utc, author_slack_id, text, peer_id) VALUES (?,?,?,?)",
+        [((base + timedelta(days=i)).strftime("%Y-%m-%dT%H:%M:%SZ"), "U1", f"fact {i}", PEER_ID if i % 2 else 1)
+         for i in range(200)])
+    facts.backfill(con)
+    con.executemany("INSERT INTO peers(peer_id, slack_channel_id) VALUES (?,?)",
+                    [(PEER_ID, "C1"), (1, "C2")])
+    keywords.retag_all(con)
+    db_migrate.migrate_jobs(con.cursor())   # jobs.db in the app; same schema, so seeded alongside
+    con.executemany(
+        "INSERT INTO jobs(name, args, priority, state, created, run_after, finished) VALUES (?,?,?,?,?,?,?)",
+        [("/question", "[]", i % 3, "done" if i % 10 else "queued", 1.7e9 + i, 1.7e9 + i, 1.7e9 + i)
+         for i in range(500)])
+    con.commit()
+    con.execute("ANALYZE")
+
+def problems(plan, allow_temp_sort: bool):
+    out = []
+    for row in plan:
+        detail = row[3]
+        if FULL_SCAN.match(detail):
+            out.append(f"full scan: {detail}")
+        if "TEMP B-TREE" in detail and not allow_temp_sort:
+            out.append(f"temp sort: {detail}")
+    return out
+
+def check(con: sqlite3.Connection) -> int:
+    failed = 0
+    for name, (sql, params, allow_temp_sort) in STATEMENTS.items():
+        plan = con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        bad = problems(plan, allow_temp_sort)
+        print(("FAIL " if bad else "ok   ") + name)
+        for row in plan:
+            print("       " + row[3])
+        for b in bad:
+            print("     ✗ " + b)
+        failed += bool(bad)
+    return failed
+
+def check_questions(con: sqlite3.Connection) -> int:
+    failed = 0
+    con.row_factory = sqlite3.Row
+    for name, (run, table) in QUESTION_PATHS.items():
+        for q in QUESTIONS:
+            issued = []
+            con.set_trace_callback(issued.append)
+            run(con, q)
+            con.set_trace_callback(None)
+            sql = next((s for s in issued if f"{table} MATCH" in s), None)
+            plan = con.execute("EXPLAIN QUERY PLAN " + sql).fetchall() if sql else []
+            bad = problems(plan, True) if sql else [f"no {table} MATCH; fell back to LIKE"]
+            print(("FAIL " if bad else "ok   ") + f"{name}({q!r})")
+            for row in plan:
+                print("       " + row[3])
+            for b in bad:
+                print("     ✗ " + b)
+            failed += bool(bad)
+    con.row_factory = None
+    return failed
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as d:
+        con = sqlite3.connect(os.path.join(d, "plans.db"))
+        seed(con)
+        failed = check(con) + check_questions(con)
+        con.close()
+    total = len(STATEMENTS) + len(QUESTIONS) * len(QUESTION_PATHS)
+    print(f"\n{total - failed}/{total} statements use an index.")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Daily summary for every enabled peer in the registry, all at once.
+
+    python daily_runner.py                  # post each peer's summary to its Slack channel
+    python daily_runner.py --dry-run        # print them instead
+    python daily_runner.py --peer 7740422022 --peer 123456789
+
+Peers run as concurrent tasks (DB reads in threads) and the only thing they
+share is llm.limiter, the process-wide OpenAI rate limit, so the wall time
+is about the slowest peer rather than the sum. A failing peer is reported
+without stopping the others.
+"""
+import os, argparse, asyncio, logging, time
+from typing import List, Optional
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+import db, db_migrate, llm, peers, pipeline, slack_sender
+
+logger = logging.getLogger(__name__)
+
+async def run_peer(p: pipeline.Pipeline, peer: peers.Peer, since_iso: str, label: str) -> float:
+    t0 = time.monotonic()
+    res = await p.run(peer.peer_id, since_iso, label)
+    if res.delivered and res.delivered.get("ts"):
+        logger.info("posted peer=%s channel=%s ts=%s", peer.peer_id, res.delivered["channel"], res.delivered["ts"])
+    return time.monotonic() - t0
+
+async def main(peer_ids: Optional[List[int]] = None, dry_run: bool = False) -> int:
+    with db.connection() as con:
+        db_migrate.migrate(con)
+        todo = [p for p in peers.list_peers(con) if not peer_ids or p.peer_id in peer_ids]
+    if not todo:
+        print("No enabled peers. Add one with: python peers.py add <peer_id> --channel-name <channel>")
+        return 1
+    openai_key = os.getenv("OPENAI_API_KEY")
+    assert openai_key, "Missing OPENAI_API_KEY in .env"
+    ai = AsyncOpenAI(api_key=openai_key)
+    sender = None
+    if dry_run:
+        deliver = pipeline.StdoutDelivery(header=True)
+    else:
+        bot_token = os.getenv("SLACK_BOT_TOKEN")
+        assert bot_token, "Missing SLACK_BOT_TOKEN in .env"
+        # one sender for every peer: one connection, one retry/backoff policy
+        sender = slack_sender.SlackSender(bot_token, base_url=os.getenv("SLACK_API_URL", slack_sender.API_URL))
+        deliver = pipeline.SlackBotDelivery(sender)
+    p = pipeline.Pipeline(ai, deliver=deliver)
+
+    since_iso, label = pipeline.today_window()
+    t0 = time.monotonic()
+    results = await asyncio.gather(*(run_peer(p, peer, since_iso, label) for peer in todo),
+                                   return_exceptions=True)
+    wall = time.monotonic() - t0
+    if sender is not None:
+        await sender.aclose()
+    await ai.close()
+    failed = 0
+    for peer, res in zip(todo, results):
+        if isinstance(res, BaseException):
+            failed += 1
+            logger.error("peer %s failed: %r", peer.label, res)
+        else:
+            logger.info("peer %s done in %.1fs", peer.label, res)
+    took = [r for r in results if not isinstance(r, BaseException)]
+    print(f"{len(todo) - failed}/{len(todo)} peer(s) in {wall:.1f}s "
+          f"(slowest {max(took, default=0):.1f}s, sum {sum(took):.1f}s, "
+          f"rate-limit wait {llm.limiter.waited_s:.1f}s, slack retries {sender.retries if sender else 0})")
+    db.close_pool()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description="Daily summaries for all enabled peers")
+    ap.add_argument("--peer", type=int, action="append", help="only this peer (repeatable)")
+    ap.add_argument("--dry-run", action="store_true", help="print summaries instead of posting")
+    args = ap.parse_args()
+    raise SystemExit(asyncio.run(main(args.peer, args.dry_run)))
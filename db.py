@@ -0,0 +1,165 @@
+"""
+Shared SQLite connection layer for the API process.
+
+Every connection is configured once (WAL, synchronous=NORMAL, busy_timeout,
+mmap, page cache, sqlite3.Row rows) and then reused from a bounded pool.
+A thread that already holds a connection gets the same one back, so nested
+helpers (e.g. handle_question -> fetch_messages_since) share it.
+
+    with db.connection() as con:
+        con.execute(...)
+"""
+from __future__ import annotations
+import os, sqlite3, threading, queue, time, logging
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DB_PATH", "briefs.db")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 16 * 1024
+ACQUIRE_TIMEOUT_S = 10.0
+# idle connections older than this are pinged before being handed out
+PING_AFTER_S = 30.0
+
+class PoolClosed(RuntimeError):
+    pass
+
+class PoolTimeout(RuntimeError):
+    pass
+
+def configure(conn: sqlite3.Connection) -> sqlite3.Connection:
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def open_connection(path: Optional[str] = None) -> sqlite3.Connection:
+    """A configured, un-pooled connection (scripts, one-off tools)."""
+    return configure(sqlite3.connect(path or DB_PATH, check_same_thread=False))
+
+class ConnectionPool:
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE,
+                 acquire_timeout: float = ACQUIRE_TIMEOUT_S):
+        self.path = path
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._idle: "queue.LifoQueue[tuple[sqlite3.Connection, float]]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self._local = threading.local()
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise PoolClosed("connection pool is closed")
+        try:
+            conn, idle_since = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            if grow:
+                try:
+                    return open_connection(self.path)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                conn, idle_since = self._idle.get(timeout=self.acquire_timeout)
+            except queue.Empty:
+                raise PoolTimeout(f"no SQLite connection free after {self.acquire_timeout}s")
+        if time.monotonic() - idle_since > PING_AFTER_S and not self._ping(conn):
+            self._discard(conn)
+            return self._acquire()
+        return conn
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @staticmethod
+    def _ping(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            logger.warning("dropping broken pooled SQLite connection", exc_info=True)
+            return False
+
+    @contextmanager
+    def connection(self):
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._acquire()
+        local.conn = conn
+        try:
+            yield conn
+        finally:
+            local.conn = None
+            self._release(conn)
+
+    def healthcheck(self) -> Dict[str, Any]:
+        """Ping one pooled connection; report pool occupancy."""
+        try:
+            with self.connection() as conn:
+                ok = self._ping(conn)
+        except Exception:
+            logger.exception("db healthcheck failed")
+            ok = False
+        return {"ok": ok, "size": self.size, "open": self._created, "idle": self._idle.qsize()}
+
+    def close(self):
+        """Close idle connections now; in-use ones are closed when released."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def connection():
+    return get_pool().connection()
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -1,29 +1,475 @@
 import sqlite3, os, sys
 DB="briefs.db"
-con=sqlite3.connect(DB)
-cur=con.cursor()
-
-# facts: append-only notes from /update (and later: auto-extracted)
-cur.execute("""
-CREATE TABLE IF NOT EXISTS facts(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  created_utc TEXT NOT NULL,
-  author_slack_id TEXT NOT NULL,
-  text TEXT NOT NULL,
-  source TEXT NOT NULL DEFAULT 'manual',  -- manual|dm|call
-  confidence TEXT NOT NULL DEFAULT 'high' -- high|medium|low
-);
-""")
-
-# calls: to mark last call time (used by /callprep)
-cur.execute("""
-CREATE TABLE IF NOT EXISTS calls(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  occurred_utc TEXT NOT NULL,
-  source TEXT NOT NULL DEFAULT 'manual',  -- manual|transcript
-  notes TEXT
-);
-""")
-
-con.commit(); con.close()
-print("✅ DB migration complete.")
+
+def migrate(con: sqlite3.Connection):
+    """
+    Every step in one transaction, committed at the end: a step that fails
+    rolls back the whole run, meta fingerprints included, so the next run
+    starts over from the old schema rather than a half-migrated one.
+    """
+    if con.in_transaction:
+        con.commit()
+    cur = con.cursor()
+    cur.execute("BEGIN")
+    try:
+        _migrate(cur)
+    except BaseException:
+        con.rollback()
+        raise
+    con.commit()
+
+def _migrate(cur: sqlite3.Cursor):
+    # messages: normally created by save_messages.py; needed here for the FTS triggers
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+      id       INTEGER PRIMARY KEY AUTOINCREMENT,
+      peer_id  INTEGER NOT NULL,
+      msg_id   INTEGER NOT NULL,
+      ts_utc   TEXT    NOT NULL,
+      from_me  INTEGER NOT NULL,
+      text     TEXT
+    );
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_peer_msg ON messages(peer_id, msg_id);")
+
+    # facts: notes from /update (and later: auto-extracted); dedup/supersede columns in migrate_facts
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS facts(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      created_utc TEXT NOT NULL,
+      author_slack_id TEXT NOT NULL,
+      text TEXT NOT NULL,
+      source TEXT NOT NULL DEFAULT 'manual',  -- manual|dm|call
+      confidence TEXT NOT NULL DEFAULT 'high' -- high|medium|low
+    );
+    """)
+
+    # calls: marked (/markcall) and detected (ingest, see calls.py) calls, for /callprep
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS calls(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      occurred_utc TEXT NOT NULL,
+      source TEXT NOT NULL DEFAULT 'manual',  -- manual|transcript|detected
+      notes TEXT
+    );
+    """)
+
+    # summaries: Slack ts of each posted daily summary (written by post_daily_summary_slack.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS summaries(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      posted_utc TEXT NOT NULL,
+      channel_id TEXT NOT NULL,
+      ts TEXT NOT NULL,
+      date_label TEXT NOT NULL,
+      text TEXT NOT NULL
+    );
+    """)
+
+    # rollup_summaries: cached hour/day summaries for long windows (see rollups.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_summaries(
+      peer_id INTEGER NOT NULL,
+      level TEXT NOT NULL,          -- hour|span|day
+      bucket_start TEXT NOT NULL,   -- UTC, inclusive
+      bucket_end TEXT NOT NULL,     -- UTC, exclusive
+      n_msgs INTEGER NOT NULL,      -- signature: recompute if the bucket changes
+      last_id INTEGER NOT NULL,
+      text TEXT NOT NULL,
+      created_utc TEXT NOT NULL,
+      PRIMARY KEY(peer_id, level, bucket_start)
+    );
+    """)
+
+    # ingest_state: per-peer high-water msg_id so the ingest daemon only backfills the gap
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_state(
+      peer_id INTEGER PRIMARY KEY,
+      high_water_msg_id INTEGER NOT NULL,
+      updated_utc TEXT NOT NULL
+    );
+    """)
+
+    # backfill_ranges: msg_id ranges [lo, hi] already fetched completely (see backfill.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS backfill_ranges(
+      peer_id INTEGER NOT NULL,
+      lo INTEGER NOT NULL,
+      hi INTEGER NOT NULL,
+      PRIMARY KEY(peer_id, lo)
+    );
+    """)
+
+    # peers: the Telegram chats we brief on and the Slack channel each one goes to (see peers.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS peers(
+      peer_id INTEGER PRIMARY KEY,
+      name TEXT NOT NULL DEFAULT '',
+      slack_channel_id TEXT,
+      slack_channel_name TEXT,
+      enabled INTEGER NOT NULL DEFAULT 1,
+      created_utc TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ','now'))
+    );
+    """)
+    # meta: one-off migration markers and rebuild fingerprints
+    cur.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT NOT NULL);")
+    # slack_channels: channel name -> id cache with a TTL (see slack_sender.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS slack_channels(
+      name TEXT PRIMARY KEY,
+      channel_id TEXT NOT NULL,
+      resolved_utc TEXT NOT NULL
+    );
+    """)
+    migrate_peers(cur)
+    migrate_facts(cur)
+    migrate_indexes(cur)
+    migrate_fts(cur)
+    migrate_ts_epoch(cur)
+    migrate_tags(cur)
+    migrate_calls(cur)
+    migrate_hot_window(cur)
+
+def _script(cur: sqlite3.Cursor, sql: str):
+    """executescript() without its implicit COMMIT: one execute per statement, in the caller's transaction."""
+    stmt = ""
+    for line in sql.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            cur.execute(stmt)
+            stmt = ""
+
+def _add_column(cur: sqlite3.Cursor, table: str, column: str, decl: str) -> bool:
+    cols = [r[1] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column in cols:
+        return False
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+def migrate_peers(cur: sqlite3.Cursor):
+    """
+    facts, calls and summaries were written for a single hard-coded chat.
+    Give them a peer_id, register the chats listed in PEER_ID (comma
+    separated) and hand the legacy rows to the first of them. That
+    hand-over runs once, when the columns are added (or, with no peer yet,
+    on the first run that has one): a NULL peer_id written later is left
+    alone rather than pinned on whichever peer happens to be first.
+    """
+    legacy = ("facts", "calls", "summaries")
+    if [table for table in legacy if _add_column(cur, table, "peer_id", "INTEGER")]:
+        cur.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('peers_backfill', 'pending')")
+    env_ids = [int(p) for p in os.getenv("PEER_ID", "").split(",") if p.strip()]
+    for i, peer_id in enumerate(env_ids):
+        cur.execute("INSERT OR IGNORE INTO peers(peer_id, slack_channel_name) VALUES (?,?)",
+                    (peer_id, os.getenv("SLACK_CHANNEL_NAME") if i == 0 else None))
+    if not cur.execute("SELECT 1 FROM meta WHERE key='peers_backfill' AND value='pending'").fetchone():
+        return
+    row = cur.execute("SELECT peer_id FROM peers WHERE enabled=1 ORDER BY created_utc, peer_id LIMIT 1").fetchone()
+    if not row:
+        return
+    counts = {table: cur.execute(f"UPDATE {table} SET peer_id=? WHERE peer_id IS NULL", (row[0],)).rowcount
+              for table in legacy}
+    cur.execute("UPDATE meta SET value='done' WHERE key='peers_backfill'")
+    if any(counts.values()):
+        print(f"Assigned legacy rows to peer {row[0]}: " + ", ".join(f"{n} {t}" for t, n in counts.items()))
+
+def migrate_facts(cur: sqlite3.Cursor):
+    """
+    facts.text_hash (normalized text), fact_key ("Key: value" prefix) and
+    superseded_by (id of the newer fact). Legacy rows are hashed once and
+    their repeats superseded, then the active (peer_id, text_hash) pairs are
+    made unique. facts_fts indexes the text for facts.relevant().
+    """
+    import facts
+    _add_column(cur, "facts", "text_hash", "TEXT")
+    _add_column(cur, "facts", "fact_key", "TEXT")
+    _add_column(cur, "facts", "superseded_by", "INTEGER")
+    n = facts.backfill(cur.connection)
+    if n:
+        print(f"Superseded {n} duplicate/replaced facts.")
+    cur.execute("""CREATE UNIQUE INDEX IF NOT EXISTS uq_facts_active_hash
+                   ON facts(peer_id, text_hash) WHERE superseded_by IS NULL;""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS ix_facts_active_key
+                   ON facts(peer_id, fact_key) WHERE superseded_by IS NULL;""")
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='facts_fts'").fetchone()
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS facts_fts USING fts5(
+          text, content='facts', content_rowid='id', tokenize='trigram'
+        );
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"⚠️  Skipping facts_fts: {e}")
+        return
+    _script(cur, """
+    CREATE TRIGGER IF NOT EXISTS facts_fts_ai AFTER INSERT ON facts BEGIN
+      INSERT INTO facts_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS facts_fts_ad AFTER DELETE ON facts BEGIN
+      INSERT INTO facts_fts(facts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS facts_fts_au AFTER UPDATE OF text ON facts BEGIN
+      INSERT INTO facts_fts(facts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+      INSERT INTO facts_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    """)
+    if not exists:
+        cur.execute("INSERT INTO facts_fts(facts_fts) VALUES ('rebuild')")
+
+def migrate_indexes(cur: sqlite3.Cursor):
+    """
+    Indexes for the hot window queries (see check_query_plans.py).
+    """
+    # the message windows (WHERE peer_id=? AND ts_epoch>=?) are indexed in migrate_ts_epoch;
+    # retrieval is peer-scoped and uses that index too, so a bare ts_utc index only costs writes
+    cur.execute("DROP INDEX IF EXISTS ix_messages_ts;")
+    # summary_cache.load_latest (latest row per channel) and peers.for_channel
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_summaries_channel_posted ON summaries(channel_id, posted_utc);")
+    # app.handle_callprep: latest call per peer
+    cur.execute("DROP INDEX IF EXISTS ix_calls_occurred;")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_calls_peer_occurred ON calls(peer_id, occurred_utc);")
+    # facts.active: a peer's facts in insertion order, and MAX(id) as the cache stamp
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_facts_peer ON facts(peer_id, id);")
+    # peers.for_channel
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_peers_channel ON peers(slack_channel_id);")
+
+def migrate_fts(cur: sqlite3.Cursor):
+    """
+    messages_fts: external-content FTS5 index over messages.text (used by
+    retrieval.search_messages). Trigram tokenizer so MATCH behaves like the
+    old LIKE '%term%' substring search. Triggers keep it in sync.
+    """
+    exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='messages_fts'"
+    ).fetchone()
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+          text,
+          content='messages',
+          content_rowid='id',
+          tokenize='trigram'
+        );
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5 (or < 3.34 for trigram): search falls back to LIKE
+        print(f"⚠️  Skipping messages_fts: {e}")
+        return
+
+    _script(cur, """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+      INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+      INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text ON messages BEGIN
+      INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+      INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    """)
+
+    if not exists:
+        # first run on an existing DB: index the backlog
+        cur.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+def migrate_tags(cur: sqlite3.Cursor):
+    """
+    message_tags: keyword-category bit mask per message (see keywords.py),
+    only for messages that hit at least one category. Written by the ingest
+    hook; rebuilt here on first run and whenever keywords.CATEGORIES changes.
+    ts_epoch copies messages.ts_epoch (see migrate_ts_epoch).
+    """
+    import keywords, timestamps
+    _script(cur, """
+    CREATE TABLE IF NOT EXISTS message_tags(
+      message_id INTEGER PRIMARY KEY,   -- messages.id
+      peer_id INTEGER NOT NULL,
+      ts_utc TEXT NOT NULL,
+      mask INTEGER NOT NULL,
+      ts_epoch INTEGER
+    );
+    CREATE TRIGGER IF NOT EXISTS message_tags_ad AFTER DELETE ON messages BEGIN
+      DELETE FROM message_tags WHERE message_id = old.id;
+    END;
+    """)
+    added = _add_column(cur, "message_tags", "ts_epoch", "INTEGER")
+    if added:
+        cur.execute("UPDATE message_tags SET ts_epoch = (SELECT ts_epoch FROM messages WHERE id = message_id)")
+    _script(cur, f"""
+    CREATE TRIGGER IF NOT EXISTS message_tags_au AFTER UPDATE OF ts_utc ON messages BEGIN
+      UPDATE message_tags SET ts_utc = new.ts_utc, ts_epoch = {timestamps.epoch_sql("new.ts_utc")}
+      WHERE message_id = new.id;
+    END;
+    -- pipeline call lines: WHERE peer_id=? AND ts_epoch>=? AND mask & ? (covering)
+    CREATE INDEX IF NOT EXISTS ix_message_tags_peer_epoch ON message_tags(peer_id, ts_epoch, mask);
+    DROP INDEX IF EXISTS ix_message_tags_peer_ts;
+    """)
+    if added:
+        _refresh_stats(cur, "message_tags")
+    row = cur.execute("SELECT value FROM meta WHERE key='keywords'").fetchone()
+    if not row or row[0] != keywords.fingerprint():
+        n = keywords.retag_all(cur.connection)
+        cur.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('keywords', ?)", (keywords.fingerprint(),))
+        if n:
+            print(f"Tagged {n} messages (keywords {keywords.fingerprint()}).")
+
+def migrate_calls(cur: sqlite3.Cursor):
+    """
+    calls.message_id links a detected call to its message. call_anchor holds
+    each peer's latest call and is kept current by triggers on calls, so
+    finding it is one primary-key lookup. Detected calls are rebuilt from
+    message_tags whenever the keyword set changes (tags were just rebuilt).
+    occurred_utc is normalized to TS_FMT so the triggers compare it as text.
+    """
+    import calls, keywords, timestamps
+    _add_column(cur, "calls", "message_id", "INTEGER")
+    _script(cur, """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_calls_message ON calls(message_id) WHERE message_id IS NOT NULL;
+    CREATE TABLE IF NOT EXISTS call_anchor(
+      peer_id INTEGER PRIMARY KEY,
+      occurred_utc TEXT NOT NULL,
+      call_id INTEGER NOT NULL,
+      source TEXT NOT NULL
+    );
+    -- delete + insert rather than OR REPLACE: the INSERT OR IGNORE in calls.py would override it
+    CREATE TRIGGER IF NOT EXISTS calls_anchor_ai AFTER INSERT ON calls WHEN new.peer_id IS NOT NULL BEGIN
+      DELETE FROM call_anchor WHERE peer_id = new.peer_id AND occurred_utc <= new.occurred_utc;
+      INSERT INTO call_anchor(peer_id, occurred_utc, call_id, source)
+      SELECT new.peer_id, new.occurred_utc, new.id, new.source
+      WHERE NOT EXISTS (SELECT 1 FROM call_anchor WHERE peer_id = new.peer_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS calls_anchor_ad AFTER DELETE ON calls
+    WHEN old.id = (SELECT call_id FROM call_anchor WHERE peer_id = old.peer_id) BEGIN
+      DELETE FROM call_anchor WHERE peer_id = old.peer_id;
+      INSERT INTO call_anchor(peer_id, occurred_utc, call_id, source)
+      SELECT peer_id, occurred_utc, id, source FROM calls
+      WHERE peer_id = old.peer_id ORDER BY occurred_utc DESC, id DESC LIMIT 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS calls_message_ad AFTER DELETE ON messages BEGIN
+      DELETE FROM calls WHERE message_id = old.id;
+    END;
+    """)
+    # rows written before occurred_utc was normalized (detected ones copied the message's ts_utc)
+    occurred = calls.OCCURRED_SQL.format(timestamps.epoch_sql("occurred_utc"))
+    fixed = cur.execute(f"""
+        UPDATE calls SET occurred_utc = {occurred}
+        WHERE occurred_utc NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T[0-9][0-9]:[0-9][0-9]:[0-9][0-9]Z'
+          AND {occurred} IS NOT NULL
+    """).rowcount
+    row = cur.execute("SELECT value FROM meta WHERE key='calls_detect'").fetchone()
+    if not row or row[0] != keywords.fingerprint():
+        n = calls.redetect_all(cur.connection)
+        calls.rebuild_anchors(cur.connection)
+        cur.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('calls_detect', ?)", (keywords.fingerprint(),))
+        if n:
+            print(f"Detected {n} call messages.")
+    elif fixed:
+        calls.rebuild_anchors(cur.connection)
+
+def migrate_ts_epoch(cur: sqlite3.Cursor):
+    """
+    messages.ts_epoch: ts_utc as integer epoch seconds (timestamps.epoch_sql),
+    whatever format it was written in. Backfilled once when the column is
+    added; ingest writes it with each row and the triggers fill it for every
+    other writer (save_messages.py, test_seed.sql) and for ts_utc edits.
+    Window queries range-scan and sort on it instead of comparing ts_utc
+    strings.
+    """
+    import timestamps
+    added = _add_column(cur, "messages", "ts_epoch", "INTEGER")
+    if added:
+        cur.execute(f"UPDATE messages SET ts_epoch = {timestamps.epoch_sql()}")
+    new_epoch = timestamps.epoch_sql("new.ts_utc")
+    _script(cur, f"""
+    CREATE TRIGGER IF NOT EXISTS messages_epoch_ai AFTER INSERT ON messages WHEN new.ts_epoch IS NULL BEGIN
+      UPDATE messages SET ts_epoch = {new_epoch} WHERE id = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_epoch_au AFTER UPDATE OF ts_utc ON messages BEGIN
+      UPDATE messages SET ts_epoch = {new_epoch} WHERE id = new.id;
+    END;
+    DROP INDEX IF EXISTS ix_messages_peer_ts;
+    """)
+    # message windows: WHERE peer_id=? AND ts_epoch>=? ORDER BY ts_epoch. Not covering: with ts_utc,
+    # from_me and text it was most of a second copy of the table (73MB next to 84MB on a 1M-message
+    # corpus), inserts cost ~30% more, and a 90-day window read no faster than through rowid lookups
+    cols = [r[2] for r in cur.execute("PRAGMA index_info(ix_messages_peer_epoch)").fetchall()]
+    rebuilt = cols != ["peer_id", "ts_epoch"]
+    if cols and rebuilt:
+        cur.execute("DROP INDEX ix_messages_peer_epoch")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_messages_peer_epoch ON messages(peer_id, ts_epoch)")
+    if added or rebuilt:
+        _refresh_stats(cur, "messages")
+
+def _refresh_stats(cur: sqlite3.Cursor, table: str):
+    # a DB that was ANALYZEd would otherwise plan around the new index with no stats for it
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        cur.execute(f"ANALYZE {table}")
+
+def migrate_hot_window(cur: sqlite3.Cursor):
+    """
+    message_edits counts each peer's in-place changes (edits, deletes), so
+    hot_window.py can tell a window it holds went stale; inserts are
+    followed by id instead.
+    """
+    _script(cur, """
+    CREATE TABLE IF NOT EXISTS message_edits(
+      peer_id INTEGER PRIMARY KEY,
+      n INTEGER NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS message_edits_au AFTER UPDATE OF peer_id, ts_utc, from_me, text ON messages BEGIN
+      INSERT INTO message_edits(peer_id, n) VALUES (old.peer_id, 1)
+        ON CONFLICT(peer_id) DO UPDATE SET n = n + 1;
+      INSERT INTO message_edits(peer_id, n) SELECT new.peer_id, 1 WHERE new.peer_id IS NOT old.peer_id
+        ON CONFLICT(peer_id) DO UPDATE SET n = n + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS message_edits_ad AFTER DELETE ON messages BEGIN
+      INSERT INTO message_edits(peer_id, n) VALUES (old.peer_id, 1)
+        ON CONFLICT(peer_id) DO UPDATE SET n = n + 1;
+    END;
+    """)
+
+def migrate_jobs(cur: sqlite3.Cursor):
+    """
+    jobs: the slash-command queue (see executor.py), in jobs.db rather
+    than briefs.db, so migrate() leaves it out. state is queued,
+    running, done or failed; run_after is when a queued job is due (a
+    retry's backoff) or when a running job's lease ends. dedup_key names
+    the Slack command (team, channel, user, command, text, trigger_id),
+    so a redelivery finds the first delivery's job; the same command
+    typed twice shares it too, so it isn't unique. progress is what a
+    handler recorded for its retries (JSON, see executor.Job). Times are
+    epoch seconds (REAL).
+    """
+    _script(cur, """
+    CREATE TABLE IF NOT EXISTS jobs(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT NOT NULL,
+      args TEXT NOT NULL,              -- JSON list
+      priority INTEGER NOT NULL,
+      state TEXT NOT NULL DEFAULT 'queued',
+      attempts INTEGER NOT NULL DEFAULT 0,
+      dedup_key TEXT,
+      created REAL NOT NULL,
+      run_after REAL NOT NULL,
+      finished REAL,
+      error TEXT,
+      progress TEXT                    -- JSON object
+    );
+    DROP INDEX IF EXISTS uq_jobs_dedup;
+    -- redelivery check: WHERE dedup_key=? AND created>=?
+    CREATE INDEX IF NOT EXISTS ix_jobs_dedup ON jobs(dedup_key, created) WHERE dedup_key IS NOT NULL;
+    -- claim: WHERE state='queued' AND run_after<=? ORDER BY priority, id; also the depth count
+    CREATE INDEX IF NOT EXISTS ix_jobs_queued ON jobs(priority, id, run_after) WHERE state = 'queued';
+    -- sweep: running jobs past their lease
+    CREATE INDEX IF NOT EXISTS ix_jobs_running ON jobs(run_after) WHERE state = 'running';
+    """)
+    _add_column(cur, "jobs", "progress", "TEXT")
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    con=sqlite3.connect(DB)
+    migrate(con)
+    con.close()
+    print("✅ DB migration complete.")
@@ -0,0 +1,490 @@
+"""
+Semantic retrieval for /question: a local embedding index per peer.
+
+Each peer's vectors live next to the database in <db>.vectors/<peer_id>/:
+
+    vectors.f32   float32 rows, L2-normalized, appended in messages.id order
+    ids.i64       the messages.id of each row (the sidecar)
+    epochs.i64    the messages.ts_epoch of each row (0 if unknown)
+    meta.json     backend name and dimension
+
+The matrix is memory-mapped and scanned in batches with one matmul per
+batch, keeping a running top-k, so search cost is a few ms per 100k
+messages and nothing is held in RAM between queries.
+
+Vectors are added at ingest once each batch has committed (after-commit
+insert/edit hooks, local backends only) and `python embeddings.py sync`
+catches up anything missing, e.g. after a backfill or when the backend is
+remote. Rows deleted from messages simply drop out when hits are joined
+back to the table. A since_iso window masks the rows by epoch before the
+top-k is taken, so a recent window still gets its k best rows.
+
+The backend is pluggable (EMBED_BACKEND):
+  hashing   deterministic feature hashing of words and character trigrams,
+            no model, no network (default)
+  openai    text-embedding-3-small via the OpenAI API
+
+    hits = embeddings.search(con, peer_id, "when is the next private?")
+    rows = embeddings.question_context(con, peer_id, question)   # hits + neighbours
+"""
+from __future__ import annotations
+import argparse, contextlib, fcntl, json, logging, os, re, sqlite3, zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import db, retrieval, timestamps
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("EMBED_BACKEND", "hashing")
+EMBED_DIR = os.getenv("EMBED_DIR")          # default: <db path>.vectors
+HASH_DIM = int(os.getenv("EMBED_DIM", "512"))
+TOP_K = int(os.getenv("EMBED_TOP_K", "40"))
+NEIGHBOURS = int(os.getenv("EMBED_NEIGHBOURS", "2"))   # messages either side of each hit
+SCAN_BATCH = 65536                           # rows per matmul
+RRF_K = 60                                   # reciprocal rank fusion constant
+KEYWORD_WEIGHT = 0.5                         # keyword ranks count half: expanded terms match stopwords too
+
+# --- backends: embed(texts) -> float32 (n, dim), rows L2-normalized ---
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)*")
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (m / norms).astype(np.float32, copy=False)
+
+class HashingEmbedder:
+    """
+    Signed feature hashing: every word (weight 1) and every character
+    trigram of " word " (weight 0.5) lands in one of `dim` buckets picked by
+    crc32, so "rescheduled" still lands close to "reschedule". Deterministic across
+    processes and machines.
+    """
+    name = "hashing"
+    local = True
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+        self._features: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _word(self, w: str) -> Tuple[np.ndarray, np.ndarray]:
+        hit = self._features.get(w)
+        if hit is None:
+            padded = f" {w} "
+            feats = [w] + ["#" + padded[i:i + 3] for i in range(len(padded) - 2)]
+            hs = [zlib.crc32(f.encode()) for f in feats]
+            idx = np.array([h % self.dim for h in hs], dtype=np.int64)
+            val = np.array([(1.0 if i == 0 else 0.5) * (1 if (h >> 31) & 1 else -1)
+                            for i, h in enumerate(hs)], dtype=np.float32)
+            hit = (idx, val)
+            if len(self._features) < 500_000:
+                self._features[w] = hit
+        return hit
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        idx, val = [], []
+        for row, text in enumerate(texts):
+            base = row * self.dim
+            for w in _TOKEN.findall((text or "").lower()):
+                i, v = self._word(w)
+                idx.append(i + base)
+                val.append(v)
+        if not idx:
+            return np.zeros((len(texts), self.dim), dtype=np.float32)
+        flat = np.bincount(np.concatenate(idx), weights=np.concatenate(val), minlength=len(texts) * self.dim)
+        return _normalize(flat.reshape(len(texts), self.dim))
+
+class OpenAIEmbedder:
+    name = "openai"
+    local = False   # network call per batch: not run inside the ingest transaction
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 1536, batch: int = 256):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.model = model
+        self.dim = dim
+        self.batch = batch
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = []
+        for i in range(0, len(texts), self.batch):
+            chunk = [t or " " for t in texts[i:i + self.batch]]
+            resp = self.client.embeddings.create(model=self.model, input=chunk, dimensions=self.dim)
+            out.extend(d.embedding for d in resp.data)
+        return _normalize(np.asarray(out, dtype=np.float32).reshape(len(texts), self.dim))
+
+BACKENDS = {"hashing": HashingEmbedder, "openai": OpenAIEmbedder}
+_backends: Dict[str, Any] = {}
+
+def get_backend(name: Optional[str] = None):
+    name = name or BACKEND
+    b = _backends.get(name)
+    if b is None:
+        b = _backends[name] = BACKENDS[name]()
+    return b
+
+# --- on-disk store ---
+
+class VectorStore:
+    """
+    One peer's append-only matrix, ids ascending. Writers are serialized by
+    an flock on the store (locked()); readers re-map when the files grow.
+    Vectors and epochs are written before ids, so a reader never sees an id
+    without its row.
+    """
+
+    def __init__(self, path: str, backend):
+        self.path = path
+        self.backend = backend
+        self.dim = backend.dim
+        self.vec_path = os.path.join(path, "vectors.f32")
+        self.ids_path = os.path.join(path, "ids.i64")
+        self.epoch_path = os.path.join(path, "epochs.i64")
+        self.meta_path = os.path.join(path, "meta.json")
+        self._mapped: Optional[Tuple[int, np.ndarray, np.ndarray]] = None   # (n, ids, matrix)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Exclusive across processes: the ingest daemon and `embeddings.py sync` may both write."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def compatible(self) -> bool:
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return meta.get("backend") == self.backend.name and meta.get("dim") == self.dim
+
+    def reset(self):
+        os.makedirs(self.path, exist_ok=True)
+        for p in (self.vec_path, self.ids_path, self.epoch_path):
+            open(p, "wb").close()
+        with open(self.meta_path, "w") as f:
+            json.dump({"backend": self.backend.name, "dim": self.dim}, f)
+        self._mapped = None
+
+    def __len__(self) -> int:
+        try:
+            return min(os.path.getsize(self.vec_path) // (4 * self.dim), os.path.getsize(self.ids_path) // 8)
+        except OSError:
+            return 0
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, matrix) memory-mapped, refreshed when rows were appended."""
+        n = len(self)
+        if self._mapped is None or self._mapped[0] != n:
+            if n == 0:
+                self._mapped = (0, np.zeros(0, np.int64), np.zeros((0, self.dim), np.float32))
+            else:
+                ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(n,))
+                mat = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+                self._mapped = (n, ids, mat)
+        return self._mapped[1], self._mapped[2]
+
+    def epochs(self) -> np.ndarray:
+        """ts_epoch per row; shorter than ids in a store written before epochs.i64 (see _fill_epochs)."""
+        try:
+            n = min(len(self), os.path.getsize(self.epoch_path) // 8)
+        except OSError:
+            n = 0
+        if n == 0:
+            return np.zeros(0, np.int64)
+        return np.memmap(self.epoch_path, dtype=np.int64, mode="r", shape=(n,))
+
+    @property
+    def last_id(self) -> int:
+        ids, _ = self.arrays()
+        return int(ids[-1]) if len(ids) else 0
+
+    def append(self, ids: Sequence[int], vecs: np.ndarray, epochs: Sequence[int]):
+        if not len(ids):
+            return
+        n = len(self)
+        # drop a torn tail left by a crash between the writes
+        for p, size in ((self.vec_path, n * 4 * self.dim), (self.epoch_path, n * 8), (self.ids_path, n * 8)):
+            if os.path.getsize(p) != size:
+                os.truncate(p, size)
+        with open(self.vec_path, "ab") as f:
+            f.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+        with open(self.epoch_path, "ab") as f:
+            f.write(np.asarray(epochs, dtype=np.int64).tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+
+    def update(self, ids: Sequence[int], vecs: np.ndarray) -> int:
+        """Overwrite rows in place (edited messages). Unknown ids are ignored."""
+        have, _ = self.arrays()
+        if not len(have):
+            return 0
+        pos = np.searchsorted(have, ids)
+        ok = (pos < len(have)) & (have[np.minimum(pos, len(have) - 1)] == ids)
+        if not ok.any():
+            return 0
+        mat = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(len(have), self.dim))
+        mat[pos[ok]] = vecs[ok]
+        mat.flush()
+        return int(ok.sum())
+
+    def topk(self, q: np.ndarray, k: int, first: int = 0,
+             rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Message ids and cosine scores of the k rows closest to q, best first,
+        among the rows from position `first` on, or only the positions `rows`.
+        """
+        ids, mat = self.arrays()
+        n = len(ids) if rows is None else len(rows)
+        if n <= first or k <= 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        best_s = np.zeros(0, np.float32)
+        best_i = np.zeros(0, np.int64)
+        for start in range(first if rows is None else 0, n, SCAN_BATCH):
+            if rows is None:
+                at = np.arange(start, min(start + SCAN_BATCH, n))
+                s = mat[start:start + SCAN_BATCH] @ q
+            else:
+                at = rows[start:start + SCAN_BATCH]
+                s = mat[at] @ q
+            if len(s) > k:
+                part = np.argpartition(s, -k)[-k:]
+            else:
+                part = np.arange(len(s))
+            best_s = np.concatenate([best_s, s[part]])
+            best_i = np.concatenate([best_i, at[part]])
+            if len(best_s) > k:
+                keep = np.argpartition(best_s, -k)[-k:]
+                best_s, best_i = best_s[keep], best_i[keep]
+        order = np.argsort(-best_s, kind="stable")
+        return np.asarray(ids[best_i[order]]), best_s[order]
+
+def _db_path(con: sqlite3.Connection) -> str:
+    for _, name, path in con.execute("PRAGMA database_list").fetchall():
+        if name == "main":
+            return path or ""
+    return ""
+
+_stores: Dict[Tuple[str, int, str], VectorStore] = {}
+
+def store_for(con: sqlite3.Connection, peer_id: int, backend=None) -> Optional[VectorStore]:
+    """The peer's store for this database (None for in-memory databases)."""
+    backend = backend or get_backend()
+    root = EMBED_DIR
+    if not root:
+        path = _db_path(con)
+        if not path:
+            return None
+        root = os.path.splitext(path)[0] + ".vectors"
+    key = (root, peer_id, backend.name)
+    st = _stores.get(key)
+    if st is None:
+        st = _stores[key] = VectorStore(os.path.join(root, str(peer_id)), backend)
+    return st
+
+# --- indexing ---
+
+def _ensure(st: VectorStore) -> VectorStore:
+    if not st.compatible():
+        logger.info("embeddings: (re)building %s for backend %s", st.path, st.backend.name)
+        st.reset()
+    return st
+
+def _fill_epochs(con: sqlite3.Connection, st: VectorStore, peer_id: int):
+    """Stores written before epochs.i64: fill it in from messages, once (0 for deleted rows). Hold st.locked()."""
+    ids, _ = st.arrays()
+    have = len(st.epochs())
+    if have >= len(ids):
+        return
+    if os.path.exists(st.epoch_path):
+        os.truncate(st.epoch_path, have * 8)
+    known = dict(con.execute("SELECT id, ts_epoch FROM messages WHERE peer_id=? AND id >= ?",
+                             (peer_id, int(ids[have]))).fetchall())
+    with open(st.epoch_path, "ab") as f:
+        f.write(np.array([known.get(i) or 0 for i in ids[have:].tolist()], np.int64).tobytes())
+
+def sync(con: sqlite3.Connection, peer_id: int, backend=None, batch: int = 10_000) -> int:
+    """Embed every message of peer_id newer than the store's last row. Returns rows added."""
+    st = store_for(con, peer_id, backend)
+    if st is None:
+        return 0
+    with st.locked():
+        _ensure(st)
+        _fill_epochs(con, st, peer_id)
+        added = 0
+        last = st.last_id
+        while True:
+            rows = con.execute("SELECT id, text, ts_epoch FROM messages WHERE peer_id=? AND id > ? ORDER BY id LIMIT ?",
+                               (peer_id, last, batch)).fetchall()
+            if not rows:
+                return added
+            st.append([r[0] for r in rows], st.backend.embed([r[1] or "" for r in rows]),
+                      [r[2] or 0 for r in rows])
+            added += len(rows)
+            last = rows[-1][0]
+
+def index_inserted(con: sqlite3.Connection, after_id: int):
+    """ingest insert hook, after commit. Failures only log: `embeddings.py sync` catches up later."""
+    backend = get_backend()
+    if not backend.local:
+        return
+    try:
+        for (peer_id,) in con.execute("SELECT DISTINCT peer_id FROM messages WHERE id > ?", (after_id,)).fetchall():
+            sync(con, peer_id, backend)
+    except (OSError, ValueError):
+        logger.exception("embeddings: indexing new messages failed")
+
+def index_edited(con: sqlite3.Connection, keys: Sequence[Tuple[int, int]]):
+    """ingest edit hook, after commit: re-embed edited (peer_id, msg_id) rows in place."""
+    backend = get_backend()
+    if not backend.local:
+        return
+    by_peer: Dict[int, List[tuple]] = {}
+    for peer_id, msg_id in keys:
+        row = con.execute("SELECT id, text FROM messages WHERE peer_id=? AND msg_id=?", (peer_id, msg_id)).fetchone()
+        if row:
+            by_peer.setdefault(peer_id, []).append(tuple(row))
+    try:
+        for peer_id, rows in by_peer.items():
+            st = store_for(con, peer_id, backend)
+            if st is not None and st.compatible():
+                rows.sort()
+                with st.locked():
+                    st.update(np.array([r[0] for r in rows], np.int64), backend.embed([r[1] or "" for r in rows]))
+    except (OSError, ValueError):
+        logger.exception("embeddings: re-indexing edited messages failed")
+
+# --- search ---
+
+def _hydrate(con: sqlite3.Connection, peer_id: int, ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+    out: Dict[int, Dict[str, Any]] = {}
+    ids = list(ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        # +peer_id: look the ids up by rowid, never by scanning the peer's index
+        for r in con.execute(f"SELECT id, peer_id, msg_id, ts_utc, from_me, text FROM messages "
+                             f"WHERE id IN ({marks}) AND +peer_id = ?", (*chunk, peer_id)).fetchall():
+            out[r[0]] = dict(zip(("id", "peer_id", "msg_id", "ts_utc", "from_me", "text"), tuple(r)))
+    return out
+
+def indexed(con: sqlite3.Connection, peer_id: int) -> bool:
+    st = store_for(con, peer_id)
+    return st is not None and st.compatible() and len(st) > 0
+
+def embed_query(con: sqlite3.Connection, peer_id: int, query: str) -> Optional[np.ndarray]:
+    """query's unit vector in the peer's index (None when it has none); pass it on as qvec to embed once."""
+    if not indexed(con, peer_id):
+        return None
+    return store_for(con, peer_id).backend.embed([query])[0]
+
+def _window(con: sqlite3.Connection, st: VectorStore, peer_id: int, since_iso: str) -> Tuple[int, Optional[np.ndarray]]:
+    """
+    The rows of messages since since_iso, as topk's (first, rows): usually
+    the store's tail, since messages mostly arrive in time order; the
+    masked positions when backfilled rows are mixed in.
+    """
+    ids, _ = st.arrays()
+    if len(st.epochs()) < len(ids):
+        with st.locked():
+            _fill_epochs(con, st, peer_id)
+    inside = st.epochs()[:len(ids)] >= timestamps.epoch(since_iso)
+    first = int(inside.argmax()) if inside.any() else len(ids)
+    if inside[first:].all():
+        return first, None
+    return 0, np.flatnonzero(inside)
+
+def vector_search(con: sqlite3.Connection, peer_id: int, query: str, k: int = TOP_K,
+                  qvec: Optional[np.ndarray] = None, since_iso: Optional[str] = None) -> List[Tuple[int, float]]:
+    """[(message id, cosine)] best first, only messages since since_iso if given; empty when the peer has no index."""
+    if not indexed(con, peer_id):
+        return []
+    st = store_for(con, peer_id)
+    first, rows = _window(con, st, peer_id, since_iso) if since_iso else (0, None)
+    ids, scores = st.topk(qvec if qvec is not None else st.backend.embed([query])[0], k, first, rows)
+    return list(zip(ids.tolist(), scores.tolist()))
+
+def search(con: sqlite3.Connection, peer_id: int, query: str, limit: int = TOP_K,
+           fuse: bool = True, since_iso: Optional[str] = None,
+           qvec: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """
+    Messages rows (dicts, best first) for query: vector top-k, fused with
+    retrieval.search_messages (FTS5/BM25, or LIKE) by reciprocal rank. Without
+    an index this is just the keyword search. Both sides only rank messages
+    since since_iso, so a recent window still gets `limit` hits.
+    """
+    vec = vector_search(con, peer_id, query, limit, qvec=qvec, since_iso=since_iso)
+    kw = retrieval.search_messages(con, peer_id, query, limit=limit, since_iso=since_iso) if fuse or not vec else []
+    score: Dict[int, float] = {}
+    for rank, (mid, _) in enumerate(vec):
+        score[mid] = score.get(mid, 0.0) + 1.0 / (RRF_K + rank + 1)
+    for rank, row in enumerate(kw):
+        score[row["id"]] = score.get(row["id"], 0.0) + KEYWORD_WEIGHT / (RRF_K + rank + 1)
+    rows = {r["id"]: r for r in kw}
+    missing = [mid for mid in score if mid not in rows]
+    rows.update(_hydrate(con, peer_id, missing))
+    ranked = sorted((mid for mid in score if mid in rows), key=lambda m: (-score[m], -m))
+    out = [dict(rows[mid], score=score[mid]) for mid in ranked[:limit]]
+    logger.info("embeddings search peer=%s vec=%d kw=%d -> %d", peer_id, len(vec), len(kw), len(out))
+    return out
+
+def with_neighbours(con: sqlite3.Connection, peer_id: int, hits: Sequence[Dict[str, Any]],
+                    n: int = NEIGHBOURS) -> List[Dict[str, Any]]:
+    """hits plus the n messages before and after each, oldest first, without duplicates."""
+    rows: Dict[int, Dict[str, Any]] = {h["id"]: dict(h, hit=True) for h in hits}
+    cols = ("id", "peer_id", "ts_utc", "from_me", "text")
+    for h in hits:
+        if n <= 0:
+            break
+        for op, order in (("<=", "DESC"), (">=", "ASC")):
+            for r in con.execute(f"""
+                SELECT id, peer_id, ts_utc, from_me, text FROM messages
+                WHERE peer_id = ? AND ts_epoch {op} ? ORDER BY ts_epoch {order} LIMIT ?
+            """, (peer_id, timestamps.epoch(h["ts_utc"]), n + 1)).fetchall():
+                rows.setdefault(r[0], dict(zip(cols, tuple(r)), hit=False))
+    return sorted(rows.values(), key=lambda r: (timestamps.epoch(r["ts_utc"]) or 0, r["id"]))
+
+def question_context(con: sqlite3.Connection, peer_id: int, question: str, since_iso: Optional[str] = None,
+                     k: int = TOP_K, neighbours: int = NEIGHBOURS,
+                     qvec: Optional[np.ndarray] = None) -> Optional[List[tuple]]:
+    """
+    (id, ts_utc, from_me, text) of the top-k messages for question plus
+    their neighbours, oldest first. None when the peer has no index yet, so the
+    caller can fall back to the plain recent window.
+    """
+    if not indexed(con, peer_id):
+        return None
+    hits = search(con, peer_id, question, limit=k, since_iso=since_iso, qvec=qvec)
+    return [(r["id"], r["ts_utc"], r["from_me"], r["text"]) for r in with_neighbours(con, peer_id, hits, neighbours)]
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    import db_migrate, peers
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description="Message embedding index")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("sync", help="embed messages missing from the index")
+    s.add_argument("--peer", type=int, action="append")
+    s.add_argument("--rebuild", action="store_true", help="drop the index first")
+    q = sub.add_parser("search")
+    q.add_argument("query")
+    q.add_argument("--peer", type=int)
+    q.add_argument("-k", type=int, default=10)
+    args = ap.parse_args()
+    with db.connection() as con:
+        db_migrate.migrate(con)
+        if args.cmd == "sync":
+            for pid in args.peer or [p.peer_id for p in peers.list_peers(con)]:
+                st = store_for(con, pid)
+                if args.rebuild and st is not None:
+                    st.reset()
+                print(f"peer {pid}: +{sync(con, pid)} rows ({len(st) if st else 0} indexed)")
+        else:
+            pid = args.peer or peers.default_peer_id(con)
+            for r in search(con, pid, args.query, limit=args.k):
+                print(f"{r['score']:.4f}  {r['ts_utc']}  {'SHE' if r['from_me'] else 'HE'}: {r['text'][:120]}")
+    db.close_pool()
@@ -0,0 +1,351 @@
+"""
+Durable job queue for slash-command work, kept in a SQLite file of its own
+(jobs.db next to briefs.db, the jobs table, see db_migrate.migrate_jobs),
+so queued commands survive a restart.
+
+submit() is one autocommit INSERT, cheap enough for the Slack ack path
+(bench/bench_jobs.py). Only API processes write jobs.db, one short
+statement at a time, so the ack never waits behind the ingest daemon's or a
+script's write transaction on briefs.db; a write that still finds the file
+locked past BUSY_TIMEOUT_MS is refused (FULL) rather than stalling the loop.
+
+A fixed number of asyncio workers claim jobs with a single UPDATE ...
+RETURNING, so each job runs in one worker of one process; a claim is a
+lease of timeout_s, and a job whose process died is queued again once its
+lease runs out. Failed jobs are retried with exponential backoff up to
+max_attempts. A redelivery (Slack resending a command it thinks timed out)
+is dropped when a job with the same key was submitted in the last
+DEDUP_WINDOW_S; a first delivery is always queued, so the same command
+typed twice runs twice.
+
+    executor.register("/update", handle_update)
+    executor.start()                 # inside the running event loop
+    executor.submit(0, "/update", peer_id, channel_id, thread_ts, user_id, text, key=command_key)
+    executor.submit(0, "/update", ..., key=command_key, redelivery=True)   # X-Slack-Retry-Num set
+
+Job arguments are stored as JSON, so handlers take plain values. A job
+can run more than once, so a handler with side effects records them with
+current_job().put() (kept with the job, in JSON) and checks get() first;
+Job.final says whether a failure now is the last one:
+
+    job = executor.current_job()
+    if not job.get("saved"):
+        await asyncio.to_thread(save_call, peer_id, note)
+        job.put("saved", True)
+
+The queue's writes all happen on the event loop thread, on a connection
+of its own: each is a single statement of ~0.1ms, and a thread pool hop
+(or a wait on another thread's write lock, or for the GIL after each
+sqlite3 call) costs more than that under load.
+"""
+from __future__ import annotations
+import asyncio, json, logging, os, random, sqlite3, time
+from collections import deque
+from contextlib import closing
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import db, metrics
+
+logger = logging.getLogger(__name__)
+
+# submit() outcomes
+QUEUED, DUPLICATE, FULL, CLOSED = "queued", "duplicate", "full", "closed"
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(db.DB_PATH)), "jobs.db")
+BUSY_TIMEOUT_MS = 100   # the loop thread waits at most this long for another process's write
+BACKOFF_CAP_S = 60.0
+DEDUP_WINDOW_S = 900.0   # Slack gives up redelivering well within this
+SWEEP_S = 30.0
+STATS_TTL_S = 5.0   # queue_stats() is read by the /metrics gauges; one query per this, not per scrape
+
+class Job:
+    """
+    The attempt a handler is running in. put() writes through to the job's
+    row, so a retry (or another process, after a lease ran out) starts from
+    what earlier attempts recorded. Outside the executor (a bench, a script
+    calling a handler) it is a one-shot job: final, and put() keeps nothing.
+    """
+
+    def __init__(self, id: Optional[int] = None, attempt: int = 1, max_attempts: int = 1,
+                 created: Optional[float] = None, progress: Optional[dict] = None,
+                 save: Optional[Callable[[int, dict], None]] = None):
+        self.id = id
+        self.attempt = attempt
+        self.max_attempts = max_attempts
+        self.created = created if created is not None else time.time()   # when it was submitted
+        self.progress = progress or {}
+        self._save = save
+
+    @property
+    def final(self) -> bool:
+        return self.attempt >= self.max_attempts
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.progress.get(key, default)
+
+    def put(self, key: str, value: Any):
+        """Record value (JSON) for the next attempts; call from the event loop thread."""
+        self.progress[key] = value
+        if self._save is not None:
+            self._save(self.id, self.progress)
+
+_current: ContextVar[Optional[Job]] = ContextVar("job", default=None)
+
+def current_job() -> Job:
+    """The job the calling handler runs in (a one-shot Job outside the executor)."""
+    return _current.get() or Job()
+
+class JobExecutor:
+    def __init__(self, concurrency: int = 4, max_queue: int = 100, max_attempts: int = 3,
+                 backoff_s: float = 2.0, timeout_s: float = 300.0, poll_s: float = 1.0,
+                 keep_s: float = 86400.0, path: str = JOBS_DB_PATH):
+        self.path = path
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.timeout_s = timeout_s   # per attempt; also the claim's lease
+        self.poll_s = poll_s         # idle workers look for due retries and other processes' jobs this often
+        self.keep_s = keep_s         # finished jobs are kept this long
+        self._handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._workers: list = []
+        self._con: Optional[sqlite3.Connection] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._accepting = False
+        self._swept = 0.0
+        self._stats: Optional[tuple] = None   # (count, min(created)) and when it was read
+        self._stats_at = 0.0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.deduplicated = 0
+        # enqueue -> done, seconds; recent jobs only
+        self.latencies: Deque[float] = deque(maxlen=10000)
+
+    def register(self, name: str, fn: Callable[..., Awaitable[Any]]):
+        self._handlers[name] = fn
+
+    def start(self):
+        """Create the jobs table if needed and spawn the workers; call from inside the running event loop."""
+        if self._workers:
+            return
+        import db_migrate
+        self._con = db.open_connection(self.path)
+        self._con.isolation_level = None   # autocommit: one statement per write
+        self._con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        db_migrate.migrate_jobs(self._con.cursor())
+        self._adopt(db.DB_PATH)
+        self._wake = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self._accepting = True
+
+    def queue_stats(self, max_age: float = STATS_TTL_S) -> tuple:
+        """
+        (jobs waiting, age in seconds of the oldest), retries waiting out
+        their backoff included; counted at most max_age seconds ago.
+        """
+        now = time.monotonic()
+        if self._stats is None or now - self._stats_at > max_age:
+            # its own short-lived connection: /metrics reads this from a worker thread
+            with closing(sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)) as con:
+                self._stats = tuple(con.execute(
+                    "SELECT count(*), min(created) FROM jobs WHERE state = 'queued'").fetchone())
+            self._stats_at = now
+        n, oldest = self._stats
+        return n, time.time() - oldest if oldest else 0.0
+
+    @property
+    def depth(self) -> int:
+        return self.queue_stats(max_age=0)[0]
+
+    def submit(self, priority: int, name: str, *args, key: Optional[str] = None,
+               redelivery: bool = False) -> str:
+        """
+        Queue job name(*args); lower priority runs first. key identifies the
+        request across deliveries; with redelivery, a job with the same key
+        submitted in the last DEDUP_WINDOW_S makes this one a DUPLICATE.
+        Returns QUEUED, DUPLICATE, FULL or CLOSED. Call from the event loop
+        thread.
+        """
+        if not self._accepting:
+            self.rejected += 1
+            return CLOSED
+        now = time.time()
+        try:
+            if redelivery and key is not None and self._con.execute(
+                    "SELECT 1 FROM jobs WHERE dedup_key = ? AND created >= ?", (key, now - DEDUP_WINDOW_S)).fetchone():
+                self.deduplicated += 1
+                metrics.JOBS_DEDUPLICATED.inc(command=name)
+                return DUPLICATE
+            # the full-queue check rides along, so an accepted job is one statement
+            cur = self._con.execute("""
+                INSERT INTO jobs(name, args, priority, dedup_key, created, run_after)
+                SELECT ?,?,?,?,?,? WHERE (SELECT count(*) FROM jobs WHERE state = 'queued') < ?
+            """, (name, json.dumps(args), priority, key, now, now, self.max_queue))
+        except sqlite3.OperationalError as e:
+            self.rejected += 1
+            logger.warning("job queue unavailable (%s); rejected %s", e, name)
+            return FULL
+        if cur.rowcount:
+            self._wake.set()
+            return QUEUED
+        self.rejected += 1
+        logger.warning("job queue full (%d); rejected %s", self.max_queue, name)
+        return FULL
+
+    def _adopt(self, old_path: str):
+        """Move the jobs still queued or running in old_path's jobs table (the queue used to live in briefs.db) here."""
+        if os.path.abspath(old_path) == os.path.abspath(self.path) or not os.path.exists(old_path):
+            return
+        with closing(sqlite3.connect(old_path)) as old:
+            if not old.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'jobs'").fetchone():
+                return
+            rows = old.execute("SELECT name, args, priority, attempts, dedup_key, created FROM jobs "
+                               "WHERE state IN ('queued', 'running')").fetchall()
+            now = time.time()
+            self._con.executemany("INSERT INTO jobs(name, args, priority, attempts, dedup_key, created, run_after) "
+                                  "VALUES (?,?,?,?,?,?,?)", [r + (now,) for r in rows])
+            old.execute("DROP TABLE jobs")
+            old.commit()
+        logger.info("moved %d unfinished job(s) from %s to %s", len(rows), old_path, self.path)
+
+    def _claim(self) -> Optional[tuple]:
+        now = time.time()
+        rows = self._con.execute("""
+            UPDATE jobs SET state = 'running', attempts = attempts + 1, run_after = ?
+            WHERE id = (SELECT id FROM jobs WHERE state = 'queued' AND run_after <= ?
+                        ORDER BY priority, id LIMIT 1)
+            RETURNING id, name, args, attempts, created, progress
+        """, (now + self.timeout_s, now)).fetchall()
+        return tuple(rows[0]) if rows else None
+
+    def _finish(self, job_id: int, attempts: int, error: Optional[str]) -> str:
+        """Record the attempt's outcome: done, queued again (after a backoff) or failed."""
+        now = time.time()
+        if error is None:
+            state, run_after = "done", now
+        elif attempts < self.max_attempts:
+            state, run_after = "queued", now + self._delay(attempts)
+        else:
+            state, run_after = "failed", now
+        self._con.execute("UPDATE jobs SET state = ?, run_after = ?, error = ?, finished = ? WHERE id = ?",
+                          (state, run_after, error, None if state == "queued" else now, job_id))
+        return state
+
+    def _save_progress(self, job_id: int, progress: dict):
+        self._con.execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress), job_id))
+
+    def _delay(self, attempt: int) -> float:
+        d = min(BACKOFF_CAP_S, self.backoff_s * (2 ** (attempt - 1)))
+        return d * (0.5 + random.random() / 2)
+
+    def _sweep(self):
+        """Queue again the jobs whose lease ran out (their process died), fail those out of attempts; purge old jobs."""
+        now = time.time()
+        n = self._con.execute("""
+            UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                            error = 'lease expired', finished = CASE WHEN attempts < ? THEN NULL ELSE ? END
+            WHERE state = 'running' AND run_after <= ?
+        """, (self.max_attempts, self.max_attempts, now, now)).rowcount
+        self._con.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished < ?", (now - self.keep_s,))
+        if n:
+            logger.warning("%d job(s) outlived their lease; requeued or failed", n)
+
+    async def _worker(self, n: int):
+        while self._accepting:   # draining: take nothing new
+            if time.time() - self._swept >= SWEEP_S:
+                self._swept = time.time()
+                try:
+                    self._sweep()
+                except Exception:
+                    logger.exception("job sweep failed")
+            # submit() sets it; both run on the loop thread, so a job queued after this claim still wakes us
+            self._wake.clear()
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("job claim failed")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_s)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*job)
+
+    async def _run(self, job_id: int, name: str, args: str, attempts: int, created: float, progress: Optional[str]):
+        self.running += 1
+        error = None
+        # wait_for's task copies the context, so the handler sees its Job
+        token = _current.set(Job(job_id, attempts, self.max_attempts, created,
+                                 json.loads(progress) if progress else None, self._save_progress))
+        try:
+            fn = self._handlers.get(name)
+            if fn is None:
+                raise LookupError(f"no handler registered for {name}")
+            # root span of the job's trace; queue_ms is the wait (backoffs included) before this attempt
+            with metrics.span("job" + name, queue_ms=round((time.time() - created) * 1000), attempt=attempts):
+                await asyncio.wait_for(fn(*json.loads(args)), self.timeout_s)
+        except asyncio.CancelledError:
+            # shutting down: give the attempt back so the next start runs it
+            self._release(job_id)
+            self.running -= 1
+            raise
+        except Exception as e:
+            error = (f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)[:500]
+            logger.exception("job %s #%d failed (attempt %d/%d)", name, job_id, attempts, self.max_attempts)
+        finally:
+            _current.reset(token)
+        self.running -= 1
+        try:
+            state = self._finish(job_id, attempts, error)
+        except Exception:
+            # the lease runs out and the sweep requeues it
+            logger.exception("recording job %s #%d failed", name, job_id)
+            return
+        if state == "queued":
+            self.retried += 1
+            metrics.JOB_RETRIES.inc(command=name)
+            return
+        took = time.time() - created
+        self.latencies.append(took)
+        if state == "done":
+            self.completed += 1
+        else:
+            self.failed += 1
+        metrics.JOB_SECONDS.observe(took, command=name, outcome="ok" if state == "done" else "failed")
+
+    def _release(self, job_id: int):
+        try:
+            self._con.execute("UPDATE jobs SET state = 'queued', attempts = attempts - 1, run_after = ? WHERE id = ?",
+                              (time.time(), job_id))
+        except Exception:
+            logger.exception("could not requeue job #%d; its lease will", job_id)
+
+    async def drain(self, timeout: float = 30.0):
+        """Stop accepting and let running jobs finish (up to timeout); queued jobs stay for the next start."""
+        self._accepting = False
+        if not self._workers:
+            return
+        t_end = time.monotonic() + timeout
+        while self.running and time.monotonic() < t_end:
+            await asyncio.sleep(0.05)
+        if self.running:
+            logger.warning("drain timed out; requeueing %d running job(s)", self.running)
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._con.close()
+        self._con = None
+
+    def stats(self) -> dict:
+        depth, oldest = self.queue_stats()
+        return {"depth": depth, "oldest_s": round(oldest, 1), "running": self.running,
+                "completed": self.completed, "failed": self.failed, "retried": self.retried,
+                "rejected": self.rejected, "deduplicated": self.deduplicated}
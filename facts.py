@@ -0,0 +1,193 @@
+"""
+Facts added with /update, per peer.
+
+- Fact text is normalized (NFKC, case, spacing, surrounding punctuation)
+  and hashed. A fact whose hash is already active for the peer is rejected.
+- "Key: value" facts supersede the active fact with the same key
+  ("Rate: 300" replaces "rate: 250"). Superseded rows stay in the table
+  with superseded_by set and drop out of every read.
+- Active facts are cached per peer in process. add() clears the entry, and
+  a MAX(id) check picks up writes from other processes.
+- relevant() picks the facts for a question: FTS5 (facts_fts) ranked by
+  BM25, or word overlap on the cached list when FTS is unavailable, then
+  the newest facts to fill up.
+
+    res = facts.add(con, peer_id, "Rate: 300", author="U123")
+    res.status  # "added" | "duplicate" | "superseded"
+    texts = facts.relevant(con, peer_id, "what is her rate?")
+"""
+from __future__ import annotations
+import hashlib, logging, os, re, sqlite3, threading, unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import metrics, packer, retrieval
+
+logger = logging.getLogger(__name__)
+
+TOP_K = int(os.getenv("FACTS_TOP_K", "40"))
+
+_SPACE = re.compile(r"\s+")
+_EDGE = re.compile(r"^[\W_]+|[\W_]+$", re.UNICODE)
+# "Rate: 300", "rate = 300"; a colon must be followed by a space so URLs and times never make a key
+_KEY = re.compile(r"^\s*([A-Za-z][\w '&/-]{0,39}?)\s*(?::\s|=)\s*\S")
+# prefixes that label a note rather than name an attribute
+NOT_KEYS = {"note", "notes", "fyi", "reminder", "update", "todo", "info"}
+
+def normalize(text: str) -> str:
+    s = unicodedata.normalize("NFKC", text or "").lower()
+    return _EDGE.sub("", _SPACE.sub(" ", s).strip())
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()[:16]
+
+def fact_key(text: str) -> Optional[str]:
+    m = _KEY.match(text or "")
+    if not m:
+        return None
+    key = _SPACE.sub(" ", m.group(1).strip().lower())
+    return None if key in NOT_KEYS else key
+
+@dataclass
+class Fact:
+    id: int
+    text: str
+    key: Optional[str] = None
+    created_utc: str = ""
+
+@dataclass
+class AddResult:
+    status: str                       # added | duplicate | superseded
+    fact: Fact
+    replaced: List[Fact] = field(default_factory=list)
+
+# --- cache: peer_id -> (MAX(id) when loaded, active facts oldest first) ---
+
+_cache: Dict[int, Tuple[int, List[Fact]]] = {}
+_lock = threading.Lock()
+
+def invalidate(peer_id: Optional[int] = None):
+    with _lock:
+        if peer_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(peer_id, None)
+
+def active(con: sqlite3.Connection, peer_id: int) -> List[Fact]:
+    """The peer's active facts, oldest first (cached)."""
+    with metrics.sql("facts.active.stamp"):
+        stamp = con.execute("SELECT MAX(id) FROM facts WHERE peer_id=?", (peer_id,)).fetchone()[0] or 0
+    with _lock:
+        hit = _cache.get(peer_id)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    with metrics.sql("facts.active"):
+        rows = con.execute("""
+            SELECT id, text, fact_key, created_utc FROM facts
+            WHERE peer_id=? AND superseded_by IS NULL ORDER BY id
+        """, (peer_id,)).fetchall()
+    out = [Fact(*tuple(r)) for r in rows]
+    with _lock:
+        _cache[peer_id] = (stamp, out)
+    return out
+
+# --- writes ---
+
+def add(con: sqlite3.Connection, peer_id: int, text: str, author: str = "",
+        source: str = "manual", confidence: str = "high") -> AddResult:
+    text = text.strip()
+    h, key = text_hash(text), fact_key(text)
+    now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    try:
+        with con:
+            dup = con.execute("""
+                SELECT id, text, fact_key, created_utc FROM facts
+                WHERE peer_id=? AND text_hash=? AND superseded_by IS NULL
+            """, (peer_id, h)).fetchone()
+            if dup:
+                return AddResult("duplicate", Fact(*tuple(dup)))
+            new_id = con.execute("""
+                INSERT INTO facts(created_utc, author_slack_id, text, source, confidence, peer_id, text_hash, fact_key)
+                VALUES (?,?,?,?,?,?,?,?)
+            """, (now, author, text, source, confidence, peer_id, h, key)).lastrowid
+            replaced = []
+            if key:
+                replaced = [Fact(*tuple(r)) for r in con.execute("""
+                    SELECT id, text, fact_key, created_utc FROM facts
+                    WHERE peer_id=? AND fact_key=? AND superseded_by IS NULL AND id != ?
+                """, (peer_id, key, new_id)).fetchall()]
+                con.executemany("UPDATE facts SET superseded_by=? WHERE id=?", [(new_id, f.id) for f in replaced])
+    except sqlite3.IntegrityError:
+        # another writer added the same fact between our check and insert
+        return AddResult("duplicate", Fact(0, text, key, now))
+    finally:
+        invalidate(peer_id)
+    return AddResult("superseded" if replaced else "added", Fact(new_id, text, key, now), replaced)
+
+def backfill(con: sqlite3.Connection) -> int:
+    """
+    Hash and key rows written before dedup existed, oldest first, applying
+    the same rules as add(): repeats and same-key facts are superseded by
+    the newest. Returns the number of rows superseded.
+    """
+    rows = con.execute("SELECT id, peer_id, text FROM facts WHERE text_hash IS NULL ORDER BY id").fetchall()
+    if not rows:
+        return 0
+    # what is already active, so old rows fold into it
+    by_hash: Dict[Tuple[int, str], int] = {}
+    by_key: Dict[Tuple[int, str], int] = {}
+    for fid, peer_id, h, key in con.execute(
+            "SELECT id, peer_id, text_hash, fact_key FROM facts WHERE text_hash IS NOT NULL AND superseded_by IS NULL"):
+        by_hash[(peer_id, h)] = fid
+        if key:
+            by_key[(peer_id, key)] = fid
+    superseded = set()
+    for fid, peer_id, text in rows:
+        h, key = text_hash(text), fact_key(text)
+        for index, k in ((by_hash, h), (by_key, key)):
+            if k is None:
+                continue
+            old = index.get((peer_id, k))
+            if old is not None and old != fid:
+                # before this row takes the hash: uq_facts_active_hash allows one active row per hash
+                con.execute("UPDATE facts SET superseded_by=? WHERE id=?", (fid, old))
+                superseded.add(old)
+            index[(peer_id, k)] = fid
+        con.execute("UPDATE facts SET text_hash=?, fact_key=? WHERE id=?", (h, key, fid))
+    invalidate()
+    return len(superseded)
+
+# --- reads ---
+
+def relevant(con: sqlite3.Connection, peer_id: int, question: str, limit: int = TOP_K) -> List[str]:
+    """Texts of up to `limit` active facts for question, most relevant first."""
+    facts = active(con, peer_id)
+    if not facts:
+        return []
+    by_id = {f.id: f for f in facts}
+    ranked: List[int] = []
+    match = retrieval.build_fts_query(question)
+    if match:
+        try:
+            with metrics.sql("facts.relevant.fts"):
+                hits = con.execute("""
+                    SELECT f.id FROM facts_fts JOIN facts f ON f.id = facts_fts.rowid
+                    WHERE facts_fts MATCH ? AND f.peer_id = ? AND f.superseded_by IS NULL
+                    ORDER BY bm25(facts_fts) LIMIT ?
+                """, (match, peer_id, limit)).fetchall()
+            ranked = [r[0] for r in hits if r[0] in by_id]
+        except sqlite3.OperationalError:
+            match = None
+    if not match:
+        terms = retrieval.expand_query(question)
+        score = packer.term_relevance([t for t in terms if t.lower() not in retrieval.STOP_WORDS] or terms)
+        ranked = [fid for s, fid in sorted(((score(f.text), f.id) for f in facts), reverse=True) if s > 0]
+    chosen = ranked[:limit]
+    seen = set(chosen)
+    for f in reversed(facts):
+        if len(chosen) >= limit:
+            break
+        if f.id not in seen:
+            chosen.append(f.id)
+    return [by_id[i].text for i in chosen]
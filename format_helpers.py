@@ -1,27 +1,11 @@
-from datetime import datetime, timezone
+import time
 from typing import List, Dict, Any
 
-try:
-    import zoneinfo
-    LOCAL_TZ = zoneinfo.ZoneInfo("Australia/Brisbane")
-except Exception:
-    LOCAL_TZ = None
+import keywords, timestamps
 
 def _to_local_date_str(ts_utc) -> str:
-    if isinstance(ts_utc, (int, float)):
-        dt = datetime.fromtimestamp(float(ts_utc), tz=timezone.utc)
-    else:
-        s = str(ts_utc)
-        try:
-            dt = datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
-        except Exception:
-            try:
-                dt = datetime.fromtimestamp(float(s), tz=timezone.utc)
-            except Exception:
-                dt = datetime.now(timezone.utc)
-    if LOCAL_TZ:
-        dt = dt.astimezone(LOCAL_TZ)
-    return dt.strftime("%-d %b %Y")
+    # unparseable: today, as before
+    return timestamps.local_date(ts_utc) or timestamps.local_date(int(time.time()))
 
 def _who(from_me) -> str:
     return "YOU" if str(from_me).lower() in ("1","true") else "THEM"
@@ -31,16 +15,11 @@ def _snip(text: str, n=180) -> str:
     return (t[:n] + "…") if len(t) > n else t
 
 def _old_note(ts) -> str:
-    try:
-        s = str(ts)
-        dt = datetime.fromisoformat(s)
-    except Exception:
-        try:
-            dt = datetime.fromtimestamp(float(s))
-        except Exception:
-            return ""
-    if (datetime.utcnow() - dt.replace(tzinfo=None)).days > 60:
-        return f" (from {_to_local_date_str(ts)})"
+    t = timestamps.epoch(ts)
+    if t is None:
+        return ""
+    if time.time() - t >= 61 * 86400:   # more than 60 whole days
+        return f" (from {timestamps.local_date(t)})"
     return ""
 
 def synthesize_answer(query: str, hits: List[Dict[str,Any]]) -> str:
@@ -60,7 +39,7 @@ def summarize_window(rows: List[Dict[str,Any]]) -> str:
     for r in rows[-40:]:
         s=_snip(r.get("text",""))
         who=_who(r.get("from_me"))
-        if any(k in s.lower() for k in ("todo","action","next","please","due","deadline")):
+        if keywords.matcher.any(s, ("action",)):
             actions.append(f"- [{who}] {s}")
         else:
             bullets.append(f"- [{who}] {s}")
@@ -0,0 +1,328 @@
+"""
+The last HOT_WINDOW_DAYS of each peer's messages, held in process as
+columns, for the API's window reads (app.fetch_messages_since,
+retrieval.get_window, rollups.load_rows).
+
+Per peer, one PeerWindow of flat arrays: ids and msg_ids (int64), ts as
+int64 epoch seconds plus its fixed-width ts_utc text, from_me as bytes, and
+every text in one UTF-8 buffer addressed by an offsets array. That is ~53
+bytes per message plus the text itself, against ~220 for a fetchall() tuple
+with its str objects and ~530 as a dict (see bench/bench_hot_window.py).
+since() bisects the ts column and returns a WindowSlice: a view over
+[lo, hi) that decodes rows only when they are read, a chunk at a time, so a
+90-day window costs nothing until iterated and rows[-40:] decodes 40.
+
+Freshness: every read first runs refresh() on the window's own connection.
+PRAGMA data_version is unchanged unless another connection committed; then
+rows past the id watermark are appended. Edits and deletes bump
+message_edits (trigger-maintained, see db_migrate.migrate_hot_window) and
+reload that peer, as does a new row older than the window's newest (a
+backfill) or a window grown a day past HOT_WINDOW_DAYS. Windows only grow
+in place, so a slice handed out earlier stays valid; a reload builds a new
+PeerWindow (one window query, ~0.3s for 70k messages) and old slices keep
+the old one. A database without message_edits turns the windows off.
+
+Off until start() (the API does that at startup), so scripts that go to
+another database through their own connection never read it.
+
+    hot_window.windows.start()
+    rows = hot_window.windows.since(peer_id, "2025-10-01T00:00:00Z")   # WindowSlice | None
+    for ts_utc, from_me, text in rows: ...
+"""
+from __future__ import annotations
+import bisect, logging, os, sqlite3, threading, time
+from array import array
+from itertools import accumulate, islice
+from typing import Dict, Iterable, Iterator, Optional, Sequence
+
+import db, metrics, timestamps
+
+logger = logging.getLogger(__name__)
+
+HOT_DAYS = int(os.getenv("HOT_WINDOW_DAYS", "90"))
+TS_FMT = timestamps.TS_FMT
+CHUNK = 4096   # rows decoded at a time when iterating
+
+# ts (ts_epoch) is NULL if SQLite can't parse ts_utc; odd is 1 if ts_utc isn't stored in TS_FMT
+_COLS = f"""id, msg_id, ts_epoch, strftime('{TS_FMT}', ts_utc) IS NOT ts_utc, ts_utc, from_me, text"""
+
+class PeerWindow:
+    """Columns for one peer's messages with ts >= start, in the SQL readers' ts_epoch order; append-only."""
+
+    def __init__(self, peer_id: int, start: int, edits: int, watermark: int):
+        self.peer_id = peer_id
+        self.start = start              # epoch seconds; rows before it are not held
+        self.edits = edits              # message_edits.n when loaded
+        self.watermark = watermark      # every messages.id <= this has been seen
+        self.n = 0
+        self.ids = array("q")
+        self.msg_ids = array("q")
+        self.ts = array("q")
+        self.ts_text = bytearray()      # ts_utc i = ts_text[20 * i:20 * i + 20] (TS_FMT is fixed-width)
+        self.from_me = bytearray()      # one byte per row
+        self.offsets = array("q", [0])  # text i = buf[offsets[i]:offsets[i + 1]]
+        self.buf = bytearray()
+        self.nulls: set = set()         # rows whose text is NULL
+        self.odd_ts: Dict[int, str] = {}  # rows whose ts_utc isn't TS_FMT, as stored
+
+    def append(self, rows: Sequence[tuple]) -> bool:
+        """Add rows in _COLS shape; False if they can't go at the end (caller reloads)."""
+        if not rows:
+            return True
+        mids, msg_ids, ts, odd, ts_utc, me, texts = zip(*rows)
+        if None in ts:
+            return False
+        first = bisect.bisect_left(ts, self.start)
+        if first == len(ts):
+            return True
+        if (self.n and ts[first] < self.ts[-1]) or any(b < a for a, b in zip(ts[first:], ts[first + 1:])):
+            return False
+        base = self.n
+        if first:
+            mids, msg_ids, ts, odd, ts_utc, me, texts = (c[first:] for c in (mids, msg_ids, ts, odd, ts_utc, me, texts))
+        if any(odd):
+            ts_utc = list(ts_utc)
+            for k in (k for k, o in enumerate(odd) if o):
+                self.odd_ts[base + k] = ts_utc[k]
+                ts_utc[k] = " " * 20
+        self.nulls.update(base + k for k, t in enumerate(texts) if t is None)
+        texts = [t or "" for t in texts]
+        joined = "".join(texts)
+        data = joined.encode("utf-8")
+        sizes = map(len, texts) if len(data) == len(joined) else (len(t.encode("utf-8")) for t in texts)
+        self.ids.extend(mids)
+        self.msg_ids.extend(msg_ids)
+        self.ts.extend(ts)
+        self.ts_text += "".join(ts_utc).encode("ascii")
+        self.from_me += bytes(map(bool, me))
+        self.offsets.extend(islice(accumulate(sizes, initial=len(self.buf)), 1, None))
+        self.buf += data
+        self.n = base + len(ts)   # last: readers take n as their upper bound
+        return True
+
+    # --- one row; i is an index into the columns ---
+
+    def text(self, i: int) -> Optional[str]:
+        if i in self.nulls:
+            return None
+        return self.buf[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def ts_utc(self, i: int) -> str:
+        odd = self.odd_ts.get(i) if self.odd_ts else None
+        return odd if odd is not None else self.ts_text[20 * i:20 * i + 20].decode("ascii")
+
+    def msg(self, i: int) -> tuple:
+        """(ts_utc, from_me, text), like app.fetch_messages_since."""
+        return self.ts_utc(i), self.from_me[i], self.text(i)
+
+    def row(self, i: int) -> tuple:
+        """(id, ts_utc, from_me, text), like rollups.load_rows."""
+        return self.ids[i], self.ts_utc(i), self.from_me[i], self.text(i)
+
+    def dict(self, i: int) -> dict:
+        """Like retrieval.get_window's rows."""
+        return {"id": self.ids[i], "peer_id": self.peer_id, "msg_id": self.msg_ids[i],
+                "ts_utc": self.ts_utc(i), "from_me": self.from_me[i], "text": self.text(i)}
+
+    # --- many rows: decoded a chunk at a time ---
+
+    def rows(self, lo: int, hi: int, shape: str = "msg") -> Iterator:
+        for a in range(lo, hi, CHUNK):
+            b = min(hi, a + CHUNK)
+            ts, me, texts = self._chunk(a, b)
+            if shape == "msg":
+                yield from zip(ts, me, texts)
+            elif shape == "row":
+                yield from zip(self.ids[a:b], ts, me, texts)
+            else:
+                peer = self.peer_id
+                for mid, msg_id, t, m, txt in zip(self.ids[a:b], self.msg_ids[a:b], ts, me, texts):
+                    yield {"id": mid, "peer_id": peer, "msg_id": msg_id, "ts_utc": t, "from_me": m, "text": txt}
+
+    def _chunk(self, lo: int, hi: int):
+        raw = self.ts_text[20 * lo:20 * hi].decode("ascii")
+        ts = [raw[k:k + 20] for k in range(0, len(raw), 20)]
+        offs = self.offsets[lo:hi + 1]
+        data = self.buf[offs[0]:offs[-1]]
+        joined = data.decode("utf-8")
+        if len(joined) == len(data):   # ASCII: byte offsets are str offsets
+            base = offs[0]
+            texts = [joined[x - base:y - base] for x, y in zip(offs, offs[1:])]
+        else:
+            buf = self.buf
+            texts = [buf[x:y].decode("utf-8") for x, y in zip(offs, offs[1:])]
+        for i, odd in self.odd_ts.items():
+            if lo <= i < hi:
+                ts[i - lo] = odd
+        for i in self.nulls:
+            if lo <= i < hi:
+                texts[i - lo] = None
+        return ts, self.from_me[lo:hi], texts
+
+    def nbytes(self) -> int:
+        arrays = (self.ids, self.msg_ids, self.ts, self.offsets)
+        return (sum(a.itemsize * len(a) for a in arrays) + len(self.ts_text) + len(self.from_me)
+                + len(self.buf))
+
+class WindowSlice(Sequence):
+    """Rows [lo, hi) of a PeerWindow, decoded on access; slicing it makes another view."""
+    __slots__ = ("_win", "_lo", "_hi", "_shape")
+
+    def __init__(self, win: PeerWindow, lo: int, hi: int, shape: str = "msg"):
+        self._win, self._lo, self._hi, self._shape = win, lo, hi, shape
+
+    def __len__(self) -> int:
+        return self._hi - self._lo
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            lo, hi, step = i.indices(len(self))
+            if step != 1:
+                return [self[j] for j in range(lo, hi, step)]
+            return WindowSlice(self._win, self._lo + lo, self._lo + max(lo, hi), self._shape)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("window index out of range")
+        return getattr(self._win, self._shape)(self._lo + i)
+
+    def __iter__(self) -> Iterator:
+        return self._win.rows(self._lo, self._hi, self._shape)
+
+    def __repr__(self) -> str:
+        return f"<WindowSlice peer={self._win.peer_id} rows={len(self)} shape={self._shape}>"
+
+class HotWindows:
+    def __init__(self, path: Optional[str] = None, days: int = HOT_DAYS):
+        self.path = path
+        self.days = days
+        self.enabled = False
+        self.loads = 0
+        self.appended = 0
+        self._con: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._peers: Dict[int, Optional[PeerWindow]] = {}   # None: can't be held (unparseable ts)
+        self._data_version: Optional[int] = None
+
+    def start(self):
+        self.enabled = self.days > 0
+
+    def stop(self):
+        self.enabled = False
+        with self._lock:
+            self._peers.clear()
+            self._data_version = None
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+
+    def warm(self, peer_ids: Iterable[int]):
+        """Load these peers now rather than on their first read."""
+        for peer_id in peer_ids:
+            self.window(peer_id)
+
+    def since(self, peer_id: int, since_utc, shape: str = "msg") -> Optional[WindowSlice]:
+        """
+        Rows with ts_utc >= since_utc, oldest first, as a WindowSlice of
+        PeerWindow.<shape> rows ("msg", "row" or "dict"). None when off or
+        when since_utc is older than the window: the caller queries SQLite.
+        """
+        win = self.window(peer_id)
+        if win is None:
+            return None
+        since = timestamps.epoch(since_utc)
+        if since is None or since < win.start:
+            return None
+        n = win.n
+        return WindowSlice(win, bisect.bisect_left(win.ts, since, 0, n), n, shape)
+
+    def window(self, peer_id: int) -> Optional[PeerWindow]:
+        if not self.enabled:
+            return None
+        try:
+            self.refresh()
+            if peer_id not in self._peers:
+                with self._lock:
+                    if peer_id not in self._peers:
+                        self._peers[peer_id] = self._load(peer_id)
+        except sqlite3.OperationalError as e:
+            # not migrated yet (no message_edits): everything reads from SQL
+            logger.warning("hot window off: %s; run db_migrate.py", e)
+            self.enabled = False
+            return None
+        return self._peers[peer_id]
+
+    def refresh(self) -> bool:
+        """Bring loaded windows up to date; True if anything changed."""
+        with self._lock:
+            if self._con is None:
+                self._con = db.open_connection(self.path)
+            con = self._con
+            dv = con.execute("PRAGMA data_version").fetchone()[0]
+            if dv == self._data_version:
+                return False
+            self._data_version = dv
+            live = {p: w for p, w in self._peers.items() if w is not None}
+            if not live:
+                return False
+            con.execute("BEGIN")   # one snapshot for the counters and the new rows
+            try:
+                edits = dict(con.execute("SELECT peer_id, n FROM message_edits").fetchall())
+                low = min(w.watermark for w in live.values())
+                with metrics.sql("hot_window.tail"):
+                    new = con.execute(f"SELECT peer_id, {_COLS} FROM messages WHERE id > ? ORDER BY id",
+                                      (low,)).fetchall()
+                top = new[-1][1] if new else low
+                stale = time.time() - (self.days + 1) * 86400
+                changed = False
+                for peer_id, win in live.items():
+                    rows = [r[1:] for r in new if r[0] == peer_id and r[1] > win.watermark]
+                    if edits.get(peer_id, 0) != win.edits or win.start < stale or not win.append(rows):
+                        self._peers[peer_id] = self._load(peer_id, in_txn=True)
+                        changed = True
+                        continue
+                    win.watermark = max(win.watermark, top)
+                    self.appended += len(rows)
+                    changed = changed or bool(rows)
+            finally:
+                con.execute("COMMIT")
+            return changed
+
+    def _load(self, peer_id: int, in_txn: bool = False) -> Optional[PeerWindow]:
+        con = self._con
+        if con is None:
+            con = self._con = db.open_connection(self.path)
+        # from midnight UTC: a caller's "now - days" computed before a reload still fits
+        start = (int(time.time()) - self.days * 86400) // 86400 * 86400
+        if not in_txn:
+            con.execute("BEGIN")
+        try:
+            # a window of the snapshot the counters come from
+            row = con.execute("SELECT n FROM message_edits WHERE peer_id=?", (peer_id,)).fetchone()
+            watermark = con.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+            win = PeerWindow(peer_id, start, row[0] if row else 0, watermark)
+            with metrics.sql("hot_window.load"):
+                rows = con.execute(f"""
+                    SELECT {_COLS} FROM messages
+                    WHERE peer_id = ? AND ts_epoch >= ?
+                    ORDER BY ts_epoch ASC
+                """, (peer_id, start)).fetchall()
+        finally:
+            if not in_txn:
+                con.execute("COMMIT")
+        if not win.append(rows):
+            logger.warning("hot window: peer %s has ts_utc values SQLite can't parse; reading it from SQL", peer_id)
+            return None
+        self.loads += 1
+        logger.info("hot window: peer %s, %d messages, %.1f MiB", peer_id, win.n, win.nbytes() / 2**20)
+        return win
+
+    def stats(self) -> dict:
+        wins = [w for w in self._peers.values() if w is not None]
+        n = sum(w.n for w in wins)
+        size = sum(w.nbytes() for w in wins)
+        return {"enabled": self.enabled, "days": self.days, "peers": len(wins), "messages": n,
+                "bytes": size, "bytes_per_message": round(size / n, 1) if n else 0.0,
+                "loads": self.loads, "appended": self.appended}
+
+windows = HotWindows()
@@ -0,0 +1,122 @@
+"""
+Shared write path for Telegram messages (ingest daemon, save_messages.py,
+backfill). Writes are batched: one executemany per batch inside a single
+transaction, INSERT OR IGNORE on uq_peer_msg instead of catching an
+IntegrityError per duplicate row.
+
+Hooks registered with add_insert_hook(fn) run inside the same transaction as
+fn(con, after_id): every messages row with id > after_id is new. Edit hooks
+get fn(con, [(peer_id, msg_id), ...]). keywords.py tags messages this way
+and calls.py records call mentions from those tags. Hooks registered with
+after_commit=True run once the transaction has committed, so they never
+act on rows a rollback takes back (and whose ids get reused): embeddings.py
+adds messages to the vector index that way.
+"""
+from __future__ import annotations
+import sqlite3
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Sequence, Tuple
+
+import calls, embeddings, keywords, metrics, timestamps
+
+Row = Tuple[int, int, str, int, str]  # peer_id, msg_id, ts_utc, from_me, text
+
+# ts_epoch from the same bound ts_utc (?3), so the messages_epoch_ai trigger has nothing to do
+INSERT_SQL = ("INSERT OR IGNORE INTO messages(peer_id,msg_id,ts_utc,from_me,text,ts_epoch) "
+              f"VALUES (?1,?2,?3,?4,?5,{timestamps.epoch_sql('?3')})")
+
+_insert_hooks: List[Callable[[sqlite3.Connection, int], None]] = []
+_edit_hooks: List[Callable[[sqlite3.Connection, Sequence[Tuple[int, int]]], None]] = []
+_committed_insert_hooks: List[Callable[[sqlite3.Connection, int], None]] = []
+_committed_edit_hooks: List[Callable[[sqlite3.Connection, Sequence[Tuple[int, int]]], None]] = []
+
+def add_insert_hook(fn: Callable[[sqlite3.Connection, int], None], after_commit: bool = False):
+    hooks = _committed_insert_hooks if after_commit else _insert_hooks
+    if fn not in hooks:
+        hooks.append(fn)
+
+def add_edit_hook(fn: Callable[[sqlite3.Connection, Sequence[Tuple[int, int]]], None], after_commit: bool = False):
+    hooks = _committed_edit_hooks if after_commit else _edit_hooks
+    if fn not in hooks:
+        hooks.append(fn)
+
+def message_row(peer_id: int, m) -> Row:
+    """Telethon Message -> messages row (same shape save_messages.py always wrote)."""
+    text = m.message if m.message else "[media]"
+    return (peer_id, m.id, m.date.strftime("%Y-%m-%dT%H:%M:%SZ"), 1 if m.out else 0, text)
+
+def _max_id(con: sqlite3.Connection) -> int:
+    return con.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+class MessageStore:
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+
+    def apply(self, inserts: Sequence[Row] = (), edits: Sequence[Tuple[str, int, int]] = (),
+              deletes: Sequence[Tuple[int, int]] = ()) -> int:
+        """
+        One transaction: inserts (Row), edits (text, peer_id, msg_id),
+        deletes (peer_id, msg_id). Advances each peer's high-water
+        msg_id. Returns the number of rows actually inserted.
+        """
+        con = self.con
+        edited = [(p, m) for _, p, m in edits]
+        with con:
+            before = _max_id(con)
+            if inserts:
+                con.executemany(INSERT_SQL, inserts)
+            # total_changes would also count FTS trigger writes; ids are monotonic
+            inserted = con.execute("SELECT COUNT(*) FROM messages WHERE id > ?", (before,)).fetchone()[0]
+            if edits:
+                con.executemany("UPDATE messages SET text=? WHERE peer_id=? AND msg_id=?", edits)
+                for hook in _edit_hooks:
+                    hook(con, edited)
+            if deletes:
+                con.executemany("DELETE FROM messages WHERE peer_id=? AND msg_id=?", deletes)
+            if inserted:
+                for hook in _insert_hooks:
+                    hook(con, before)
+            tops = {}
+            for peer_id, msg_id, *_ in inserts:
+                tops[peer_id] = max(tops.get(peer_id, 0), msg_id)
+            if tops:
+                now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                con.executemany("""
+                    INSERT INTO ingest_state(peer_id, high_water_msg_id, updated_utc) VALUES (?,?,?)
+                    ON CONFLICT(peer_id) DO UPDATE SET
+                      high_water_msg_id = MAX(high_water_msg_id, excluded.high_water_msg_id),
+                      updated_utc = excluded.updated_utc
+                """, [(p, top, now) for p, top in tops.items()])
+        if edited:
+            for hook in _committed_edit_hooks:
+                hook(con, edited)
+        if inserted:
+            for hook in _committed_insert_hooks:
+                hook(con, before)
+        metrics.INGEST_ROWS.inc(inserted, op="insert")
+        metrics.INGEST_ROWS.inc(len(edits), op="edit")
+        metrics.INGEST_ROWS.inc(len(deletes), op="delete")
+        return inserted
+
+    def insert(self, rows: Iterable[Row]) -> int:
+        return self.apply(inserts=list(rows))
+
+    def high_water(self, peer_id: int) -> int:
+        """Last msg_id known to be stored for peer_id (0 if nothing yet)."""
+        row = self.con.execute(
+            "SELECT high_water_msg_id FROM ingest_state WHERE peer_id=?", (peer_id,)).fetchone()
+        if row and row[0]:
+            return row[0]
+        row = self.con.execute("SELECT MAX(msg_id) FROM messages WHERE peer_id=?", (peer_id,)).fetchone()
+        return row[0] or 0
+
+    def count(self, peer_id: int) -> int:
+        return self.con.execute("SELECT COUNT(*) FROM messages WHERE peer_id=?", (peer_id,)).fetchone()[0]
+
+add_insert_hook(keywords.tag_inserted)
+add_edit_hook(keywords.tag_edited)
+add_insert_hook(calls.detect_inserted)
+add_edit_hook(calls.detect_edited)
+# file writes, and a failure there only logs
+add_insert_hook(embeddings.index_inserted, after_commit=True)
+add_edit_hook(embeddings.index_edited, after_commit=True)
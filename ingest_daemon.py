@@ -0,0 +1,200 @@
+"""
+Long-running Telegram ingestion.
+
+Subscribes to Telethon NewMessage / MessageEdited / MessageDeleted for the
+watched peers and writes them to briefs.db in batches (one transaction per
+flush), so the DB is fresh within about FLUSH_INTERVAL seconds. On start it
+backfills only the gap above each peer's persisted high-water msg_id.
+
+    python ingest_daemon.py          # run forever
+    python ingest_daemon.py --once   # catch up the gap and exit (what save_messages.py did)
+
+With METRICS_PORT set, ingest_rows_total and friends are served at
+:METRICS_PORT/metrics (see metrics.py).
+
+The daemon only needs an event source with two async generators,
+catch_up(peer_id, after_msg_id) and events(), so it can be driven by a fake
+source instead of Telegram (check_ingest_daemon.py does).
+"""
+from __future__ import annotations
+import argparse, asyncio, logging, os, signal
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Sequence
+
+import db, db_migrate, metrics, peers
+from ingest import MessageStore, Row, message_row
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5
+# first run with an empty DB: only pull this many recent messages (backfill_all.py does history)
+INITIAL_LIMIT = 200
+
+def is_channel(peer_id: int) -> bool:
+    # Telethon's marked ids: users > 0, basic groups -chat_id, channels and supergroups -100<channel_id>
+    return peer_id <= -10**12
+
+@dataclass
+class Event:
+    kind: str                          # new | edit | delete
+    peer_id: Optional[int]             # None: Telegram didn't say (private-chat deletes)
+    msg_ids: Sequence[int] = ()        # delete
+    row: Optional[Row] = None          # new / edit
+
+class IngestDaemon:
+    def __init__(self, source, store: MessageStore, peer_ids: Sequence[int],
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.source = source
+        self.store = store
+        self.peer_ids = list(peer_ids)
+        # private chats and basic groups share the account's msg_id sequence; channels number their own
+        self.shared_seq_ids = [p for p in self.peer_ids if not is_channel(p)]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ingested = 0
+        self._pending: List[Event] = []
+
+    async def catch_up(self) -> int:
+        """Backfill everything above each peer's high-water mark."""
+        total = 0
+        for peer_id in self.peer_ids:
+            after = self.store.high_water(peer_id)
+            async for ev in self.source.catch_up(peer_id, after):
+                self._pending.append(ev)
+                if len(self._pending) >= self.batch_size:
+                    total += await self.flush()
+            total += await self.flush()
+            logger.info("caught up peer=%s from msg_id>%s", peer_id, after)
+        return total
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, []
+        inserts, edits, deletes = [], [], []
+        for ev in batch:
+            if ev.kind == "new":
+                inserts.append(ev.row)
+            elif ev.kind == "edit":
+                peer_id, msg_id, _, _, text = ev.row
+                edits.append((text, peer_id, msg_id))
+            elif ev.kind == "delete":
+                # no chat: a private chat or basic group, so the msg_id is unique among
+                # those peers (at most one row matches) and never names a channel's message
+                targets = [ev.peer_id] if ev.peer_id is not None else self.shared_seq_ids
+                deletes.extend((p, m) for p in targets for m in ev.msg_ids)
+        n = await asyncio.to_thread(self.store.apply, inserts, edits, deletes)
+        self.ingested += n
+        logger.info("flushed new=%d (stored %d) edits=%d deletes=%d",
+                    len(inserts), n, len(edits), len(deletes))
+        return n
+
+    async def run(self, once: bool = False):
+        await self.catch_up()
+        if once:
+            return
+        loop = asyncio.get_running_loop()
+        events = self.source.events().__aiter__()
+        nxt = None
+        oldest = None  # loop time of the oldest unflushed event
+        while True:
+            if nxt is None:
+                nxt = asyncio.ensure_future(events.__anext__())
+            timeout = self.flush_interval if oldest is None else max(0.0, oldest + self.flush_interval - loop.time())
+            done, _ = await asyncio.wait({nxt}, timeout=timeout)
+            if done:
+                fut, nxt = nxt, None
+                try:
+                    ev = fut.result()
+                except StopAsyncIteration:
+                    break
+                if ev.peer_id is None or ev.peer_id in self.peer_ids:
+                    self._pending.append(ev)
+                    if oldest is None:
+                        oldest = loop.time()
+            if self._pending and (len(self._pending) >= self.batch_size
+                                  or loop.time() - oldest >= self.flush_interval):
+                await self.flush()
+                oldest = None
+        await self.flush()
+
+class TelethonSource:
+    """Event source backed by a connected telethon TelegramClient."""
+
+    def __init__(self, client, peer_ids: Sequence[int]):
+        self.client = client
+        self.peer_ids = list(peer_ids)
+        self._queue: "asyncio.Queue[Event]" = asyncio.Queue()
+
+    async def catch_up(self, peer_id: int, after_msg_id: int) -> AsyncIterator[Event]:
+        if after_msg_id:
+            it = self.client.iter_messages(peer_id, min_id=after_msg_id, reverse=True)
+        else:
+            it = self.client.iter_messages(peer_id, limit=INITIAL_LIMIT)
+        async for m in it:
+            yield Event("new", peer_id, row=message_row(peer_id, m))
+
+    def subscribe(self):
+        from telethon import events
+
+        @self.client.on(events.NewMessage(chats=self.peer_ids))
+        async def on_new(e):
+            self._queue.put_nowait(Event("new", e.chat_id, row=message_row(e.chat_id, e.message)))
+
+        @self.client.on(events.MessageEdited(chats=self.peer_ids))
+        async def on_edit(e):
+            self._queue.put_nowait(Event("edit", e.chat_id, row=message_row(e.chat_id, e.message)))
+
+        # private-chat deletes carry no chat_id, so no chats= filter here
+        @self.client.on(events.MessageDeleted())
+        async def on_delete(e):
+            self._queue.put_nowait(Event("delete", e.chat_id, msg_ids=list(e.deleted_ids)))
+
+    async def events(self) -> AsyncIterator[Event]:
+        while True:
+            yield await self._queue.get()
+
+async def main(once: bool = False):
+    from telethon import TelegramClient
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_id   = int(os.getenv("API_ID"))
+    api_hash = os.getenv("API_HASH")
+    phone    = os.getenv("PHONE_NUMBER")
+    session  = os.getenv("SESSION_NAME","telegram_briefs")
+
+    if os.getenv("METRICS_PORT"):
+        metrics.serve(int(os.getenv("METRICS_PORT")))
+    con = db.open_connection()
+    db_migrate.migrate(con)
+    store = MessageStore(con)
+    peer_ids = [p.peer_id for p in peers.list_peers(con)]
+    assert peer_ids, "No peers: set PEER_ID in .env or add one with peers.py"
+
+    client = TelegramClient(session, api_id, api_hash)
+    await client.start(phone=phone)
+    await client.get_dialogs()  # fills the entity cache so peer ids resolve
+    source = TelethonSource(client, peer_ids)
+    source.subscribe()
+    daemon = IngestDaemon(source, store, peer_ids)
+
+    task = asyncio.ensure_future(daemon.run(once=once))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        await daemon.flush()
+    finally:
+        await client.disconnect()
+        total = {p: store.count(p) for p in peer_ids}
+        con.close()
+    print(f"Saved {daemon.ingested} new messages. Total per chat: {total}.")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    p = argparse.ArgumentParser()
+    p.add_argument("--once", action="store_true", help="catch up the gap, then exit")
+    asyncio.run(main(once=p.parse_args().once))
@@ -0,0 +1,185 @@
+"""
+Keyword tagging for call-prep and action items.
+
+All keyword lists live in CATEGORIES and are compiled once into a single
+word -> category-bits table. Keys match as whole words, with common
+inflections (call/calls/called/calling, book/booked/booking) allowed.
+Digits may touch them ("8pm"), but letters may not, so "am" no longer hits
+"game" and "cb" no longer hits "scab".
+
+    keywords.matcher.categories("call at 8pm?")    -> {"call", "time"}
+    keywords.matcher.any(text, CALL_CATEGORIES)    -> bool
+    keywords.mask(text)                            -> int bit set, see BITS
+
+At ingest, every new message is tagged into message_tags(message_id,
+peer_id, ts_utc, mask) (only rows with a non-zero mask are stored), so
+call_lines() reads a window's call-related lines from the index instead of
+rescanning every message.
+"""
+from __future__ import annotations
+import hashlib, re, sqlite3
+from typing import Dict, FrozenSet, Iterable, List, Sequence, Tuple
+
+import timestamps
+
+CATEGORIES: Dict[str, Tuple[str, ...]] = {
+    "call": ("call", "private", "video", "cb", "chaturbate", "stream", "record"),
+    "booking": ("book", "confirm", "resched", "reschedule", "cancel", "canceled", "cancelled", "cancelling"),
+    "time": ("time", "am", "pm", "o'clock", "tomorrow", "today"),
+    "look": ("makeup", "no makeup", "natural", "surprise"),
+    "action": ("todo", "action", "next", "please", "due", "deadline"),
+    # the words that mean a call took place: calls.py detects these, not cb/stream/record mentions
+    "meeting": ("call", "private", "video"),
+}
+# what the daily summary / call prep call "call-related lines" (the old CALL_KEYS)
+CALL_CATEGORIES = ("call", "booking", "time", "look")
+
+BITS: Dict[str, int] = {name: 1 << i for i, name in enumerate(CATEGORIES)}
+
+SUFFIXES = ("", "s", "es", "d", "ed", "ing")
+# a "word" is a run of letters (apostrophes inside allowed, for o'clock / I'm);
+# digits split words, so "8pm" yields "pm"
+WORD = re.compile(r"[a-z]+(?:'[a-z]+)*")
+
+def fingerprint(categories: Dict[str, Sequence[str]] = CATEGORIES) -> str:
+    """Changes whenever the keyword set does; stored tags older than this are recomputed."""
+    raw = repr(sorted((k, tuple(v)) for k, v in categories.items())) + repr(SUFFIXES)
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+class KeywordMatcher:
+    """
+    Every key and its inflections go into one dict word -> category bits,
+    so matching is a single C-level findall over the lowercased text and a
+    set intersection with the key words. Multi-word keys ("no makeup") are checked with a
+    compiled regex, and only when their first word was seen.
+    """
+
+    def __init__(self, categories: Dict[str, Sequence[str]] = CATEGORIES):
+        self.groups = {k: tuple(v) for k, v in categories.items()}
+        self.bits = {name: 1 << i for i, name in enumerate(self.groups)}
+        self.words: Dict[str, int] = {}
+        phrases: Dict[str, int] = {}
+        for name, keys in self.groups.items():
+            bit = self.bits[name]
+            for key in keys:
+                key = key.lower()
+                if " " in key:
+                    phrases[key] = phrases.get(key, 0) | bit
+                    continue
+                for suf in SUFFIXES:
+                    self.words[key + suf] = self.words.get(key + suf, 0) | bit
+        # first word -> [(compiled phrase, bits)]
+        self.phrases: Dict[str, List[Tuple["re.Pattern[str]", int]]] = {}
+        for phrase, bit in phrases.items():
+            # "no makeup" needs no regex when "makeup" already tags the same categories
+            covered = 0
+            for w in phrase.split():
+                covered |= self.words.get(w, 0)
+            if bit & ~covered == 0:
+                continue
+            pat = re.compile(r"(?<![a-z])" + r"\s+".join(map(re.escape, phrase.split())) +
+                             "(?:" + "|".join(SUFFIXES) + r")(?![a-z])")
+            self.phrases.setdefault(phrase.split()[0], []).append((pat, bit))
+        self._keyset = frozenset(self.words)
+        self._phrase_firsts = frozenset(self.phrases)
+        self._subsets: Dict[tuple, FrozenSet[str]] = {}
+
+    def mask_of(self, names: Iterable[str]) -> int:
+        return sum(self.bits[n] for n in set(names))
+
+    def _words_for(self, names: Iterable[str]) -> FrozenSet[str]:
+        key = names if isinstance(names, tuple) else tuple(names)
+        hit = self._subsets.get(key)
+        if hit is None:
+            m = self.mask_of(key)
+            hit = self._subsets[key] = frozenset(w for w, b in self.words.items() if b & m)
+        return hit
+
+    def mask(self, text: str) -> int:
+        """Bit set of the categories text hits (0 if none)."""
+        if not text:
+            return 0
+        low = text.lower()
+        found = WORD.findall(low)
+        out = 0
+        for w in self._keyset.intersection(found):
+            out |= self.words[w]
+        if self.phrases:
+            for first in self._phrase_firsts.intersection(found):
+                for pat, bit in self.phrases[first]:
+                    if pat.search(low):
+                        out |= bit
+        return out
+
+    def any(self, text: str, names: Iterable[str] = CALL_CATEGORIES) -> bool:
+        """True if text contains a keyword from any of the named categories."""
+        if not text:
+            return False
+        words = self._words_for(names)
+        low = text.lower()
+        found = WORD.findall(low)
+        if not words.isdisjoint(found):
+            return True
+        # a phrase can only add a category its words don't already cover
+        return bool(self.phrases) and bool(self.mask(text) & self.mask_of(names))
+
+    def categories(self, text: str) -> FrozenSet[str]:
+        m = self.mask(text)
+        return frozenset(n for n, b in self.bits.items() if m & b)
+
+matcher = KeywordMatcher()
+mask = matcher.mask
+CALL_MASK = sum(BITS[c] for c in CALL_CATEGORIES)
+
+# --- message_tags ---
+
+def _tag_rows(con: sqlite3.Connection, rows) -> int:
+    tagged = []
+    for mid, peer_id, ts, ts_epoch, text in rows:
+        m = mask(text)
+        if m:
+            tagged.append((mid, peer_id, ts, ts_epoch, m))
+    con.executemany("INSERT OR REPLACE INTO message_tags(message_id, peer_id, ts_utc, ts_epoch, mask) VALUES (?,?,?,?,?)",
+                    tagged)
+    return len(tagged)
+
+def tag_inserted(con: sqlite3.Connection, after_id: int):
+    """ingest insert hook: tag every messages row with id > after_id."""
+    _tag_rows(con, con.execute(
+        "SELECT id, peer_id, ts_utc, ts_epoch, text FROM messages WHERE id > ?", (after_id,)).fetchall())
+
+def tag_edited(con: sqlite3.Connection, keys: Sequence[Tuple[int, int]]):
+    """ingest edit hook: re-tag edited (peer_id, msg_id) rows."""
+    rows = []
+    for peer_id, msg_id in keys:
+        row = con.execute("SELECT id, peer_id, ts_utc, ts_epoch, text FROM messages WHERE peer_id=? AND msg_id=?",
+                          (peer_id, msg_id)).fetchone()
+        if row:
+            con.execute("DELETE FROM message_tags WHERE message_id=?", (row[0],))
+            rows.append(tuple(row))
+    _tag_rows(con, rows)
+
+def retag_all(con: sqlite3.Connection, batch: int = 50_000) -> int:
+    """Rebuild message_tags from scratch (migration, or after CATEGORIES changed)."""
+    con.execute("DELETE FROM message_tags")
+    last, total = 0, 0
+    while True:
+        rows = con.execute("SELECT id, peer_id, ts_utc, ts_epoch, text FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                           (last, batch)).fetchall()
+        if not rows:
+            return total
+        total += _tag_rows(con, rows)
+        last = rows[-1][0]
+
+def call_lines(con: sqlite3.Connection, peer_id: int, since_iso: str, limit: int,
+               tag_mask: int = CALL_MASK) -> List[tuple]:
+    """Newest `limit` (ts_utc, from_me, text) rows in the window with any of tag_mask, oldest first."""
+    rows = con.execute("""
+        SELECT m.ts_utc, m.from_me, m.text
+        FROM message_tags t
+        JOIN messages m ON m.id = t.message_id
+        WHERE t.peer_id = ? AND t.ts_epoch >= ? AND (t.mask & ?) != 0
+        ORDER BY t.ts_epoch DESC
+        LIMIT ?
+    """, (peer_id, timestamps.epoch(since_iso), tag_mask, limit)).fetchall()
+    return [tuple(r) for r in reversed(rows)]
@@ -0,0 +1,326 @@
+"""
+Chat-completion helpers shared by the API and the daily scripts.
+
+Every completion goes through complete() (sync OpenAI client) or acomplete()
+(AsyncOpenAI), which first consult a persistent, content-addressed cache in
+llm_cache.db next to briefs.db. The key is a hash of model, temperature,
+system prompt and user prompt, so re-running /callprep or a cron retry with
+nothing new returns the stored answer without spending tokens.
+
+Cache misses then pass a process-wide token bucket (LLM_RPM requests per
+minute, LLM_BURST at once) so daily_runner.py can start every peer at the
+same time without tripping the OpenAI rate limit.
+
+The cache is SQLite on disk and shared with the daily scripts, so the async
+paths read and write it in a worker thread, never on the event loop. Hits
+only note last_used in memory (flushed every CACHE_TOUCH_S, LRU order
+needs no more), and eviction keeps running totals instead of summing the
+table on every put.
+
+Every call is timed into llm_request_seconds{model, outcome=hit|ok|error}
+(rate-limit wait included) and billed tokens go to llm_tokens_total.
+
+astream() yields the completion as it arrives (a cache hit is one chunk) and
+times the first chunk into llm_first_token_seconds; acomplete(on_text=...)
+streams through it, for replies that fill in while the model writes.
+"""
+from __future__ import annotations
+import asyncio, hashlib, json, logging, os, sqlite3, threading, time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import db, metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4o-mini"
+CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+CACHE_PATH = os.getenv("LLM_CACHE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(db.DB_PATH)), "llm_cache.db")
+CACHE_TTL_S = int(os.getenv("LLM_CACHE_TTL", str(7 * 86400)))
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TOUCH_S = 60.0    # last_used bumps are written at most this often
+CACHE_PURGE_S = 300.0   # expired rows are deleted at most this often (get() skips them anyway)
+RATE_RPM = float(os.getenv("LLM_RPM", "500"))   # 0 = unlimited
+RATE_BURST = int(os.getenv("LLM_BURST", "20"))
+
+class CompletionCache:
+    """SQLite-backed completion cache with TTL and LRU-by-size eviction."""
+
+    def __init__(self, path: str = CACHE_PATH, ttl_s: int = CACHE_TTL_S,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._con: Optional[sqlite3.Connection] = None
+        # this process's view of the table; other writers (the daily scripts) are
+        # picked up when the totals are recounted before evicting
+        self._entries = 0
+        self._bytes = 0
+        self._touched: Dict[str, float] = {}   # key -> last_used not yet written
+        self._flushed = 0.0
+        self._purged = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._con is None:
+            con = sqlite3.connect(self.path, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA busy_timeout=5000")
+            con.execute("""
+            CREATE TABLE IF NOT EXISTS completions(
+              key TEXT PRIMARY KEY,
+              model TEXT NOT NULL,
+              response TEXT NOT NULL,
+              size INTEGER NOT NULL,
+              created REAL NOT NULL,
+              last_used REAL NOT NULL
+            );
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS ix_completions_last_used ON completions(last_used);")
+            con.commit()
+            self._con = con
+            self._recount(con)
+            self._flushed = self._purged = time.time()
+        return self._con
+
+    def _recount(self, con: sqlite3.Connection):
+        self._entries, self._bytes = con.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+
+    @staticmethod
+    def key(model: str, temperature: float, system: str, user: str) -> str:
+        payload = json.dumps([model, round(float(temperature), 4), system, user], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """The cached response, or None; blocking (SQLite), so async callers run it in a thread."""
+        now = time.time()
+        with self._lock:
+            try:
+                con = self._conn()
+                row = con.execute("SELECT response, created FROM completions WHERE key=?", (key,)).fetchone()
+                if row and now - row[1] <= self.ttl_s:
+                    self._touched[key] = now
+                    if now - self._flushed >= CACHE_TOUCH_S:
+                        self._flush(con, now)
+                        con.commit()
+                    self.hits += 1
+                    return row[0]
+            except sqlite3.OperationalError as e:
+                # locked by a long write elsewhere: a miss costs tokens, not the request
+                logger.warning("llm cache read failed: %s", e)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            try:
+                con = self._conn()
+                old = con.execute("SELECT size FROM completions WHERE key=?", (key,)).fetchone()
+                con.execute(
+                    "INSERT OR REPLACE INTO completions(key, model, response, size, created, last_used) VALUES (?,?,?,?,?,?)",
+                    (key, model, response, size, now, now))
+                self._touched.pop(key, None)
+                self._entries += 0 if old else 1
+                self._bytes += size - (old[0] if old else 0)
+                self._evict(con, now)
+                con.commit()
+            except sqlite3.OperationalError as e:
+                logger.warning("llm cache write failed: %s", e)
+
+    def _flush(self, con: sqlite3.Connection, now: float):
+        if self._touched:
+            con.executemany("UPDATE completions SET last_used=? WHERE key=?",
+                            [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+        self._flushed = now
+
+    def _evict(self, con: sqlite3.Connection, now: float):
+        if now - self._purged >= CACHE_PURGE_S:
+            self._purged = now
+            if con.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl_s,)).rowcount:
+                self._recount(con)
+        if self._bytes <= self.max_bytes:
+            return
+        # over by our count: write pending bumps so LRU order is right, and recount
+        # to take in what other processes wrote (or evicted) since
+        self._flush(con, now)
+        self._recount(con)
+        if self._bytes <= self.max_bytes:
+            return
+        for key, size in con.execute("SELECT key, size FROM completions ORDER BY last_used ASC").fetchall():
+            con.execute("DELETE FROM completions WHERE key=?", (key,))
+            self._entries -= 1
+            self._bytes -= size
+            if self._bytes <= self.max_bytes:
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        # in-process counters: /health reads this, so no table scan after the first
+        if self._con is None:
+            with self._lock:
+                self._conn()
+        return {"hits": self.hits, "misses": self.misses, "entries": self._entries, "bytes": self._bytes}
+
+    def close(self):
+        with self._lock:
+            if self._con is not None:
+                try:
+                    self._flush(self._con, time.time())
+                    self._con.commit()
+                except sqlite3.OperationalError as e:
+                    logger.warning("llm cache flush failed: %s", e)
+                self._con.close()
+                self._con = None
+
+cache = CompletionCache()
+
+class RateLimiter:
+    """
+    Token bucket shared by sync and async callers. reserve() takes a token
+    (going into debt if none are left) and returns how long the caller has
+    to wait, so waiters are served in arrival order.
+    """
+
+    def __init__(self, per_minute: float = RATE_RPM, burst: int = RATE_BURST):
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.waited_s = 0.0
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited_s += wait
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+limiter = RateLimiter()
+
+def _messages(system: str, user: str):
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+def _record(model: str, t0: float, outcome: str, resp=None):
+    took = time.perf_counter() - t0
+    metrics.LLM_SECONDS.observe(took, model=model, outcome=outcome)
+    usage = getattr(resp, "usage", None)
+    attrs = {"model": model, "outcome": outcome}
+    if usage is not None:
+        metrics.LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+        metrics.LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+        attrs.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    metrics.record("llm.complete", took, **attrs)
+
+def complete(client, system: str, user: str, *, model: str = DEFAULT_MODEL,
+             temperature: float = 0.2) -> str:
+    """Cached chat completion on a sync OpenAI client."""
+    t0 = time.perf_counter()
+    key = CompletionCache.key(model, temperature, system, user)
+    if CACHE_ENABLED:
+        hit = cache.get(key)
+        if hit is not None:
+            _record(model, t0, "hit")
+            return hit
+    limiter.acquire()
+    try:
+        resp = client.chat.completions.create(model=model, messages=_messages(system, user),
+                                              temperature=temperature)
+    except Exception:
+        _record(model, t0, "error")
+        raise
+    _record(model, t0, "ok", resp)
+    out = resp.choices[0].message.content.strip()
+    if CACHE_ENABLED:
+        cache.put(key, model, out)
+    return out
+
+async def acomplete(client, system: str, user: str, *, model: str = DEFAULT_MODEL,
+                    temperature: float = 0.2,
+                    on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """Cached chat completion on an AsyncOpenAI client; streamed into on_text(delta) when given."""
+    if on_text is not None:
+        parts = []
+        stream = astream(client, system, user, model=model, temperature=temperature)
+        try:
+            async for delta in stream:
+                parts.append(delta)
+                await on_text(delta)
+        finally:
+            await stream.aclose()
+        return "".join(parts).strip()
+    t0 = time.perf_counter()
+    key = CompletionCache.key(model, temperature, system, user)
+    if CACHE_ENABLED:
+        hit = await asyncio.to_thread(cache.get, key)
+        if hit is not None:
+            _record(model, t0, "hit")
+            return hit
+    await limiter.aacquire()
+    try:
+        resp = await client.chat.completions.create(model=model, messages=_messages(system, user),
+                                                    temperature=temperature)
+    except Exception:
+        _record(model, t0, "error")
+        raise
+    _record(model, t0, "ok", resp)
+    out = resp.choices[0].message.content.strip()
+    if CACHE_ENABLED:
+        await asyncio.to_thread(cache.put, key, model, out)
+    return out
+
+async def astream(client, system: str, user: str, *, model: str = DEFAULT_MODEL,
+                  temperature: float = 0.2) -> AsyncIterator[str]:
+    """acomplete() as text deltas while the model writes; cached (whole) once the stream ends."""
+    t0 = time.perf_counter()
+    key = CompletionCache.key(model, temperature, system, user)
+    if CACHE_ENABLED:
+        hit = await asyncio.to_thread(cache.get, key)
+        if hit is not None:
+            _record(model, t0, "hit")
+            yield hit
+            return
+    await limiter.aacquire()
+    parts, last = [], None
+    try:
+        stream = await client.chat.completions.create(model=model, messages=_messages(system, user),
+                                                      temperature=temperature, stream=True,
+                                                      stream_options={"include_usage": True})
+        async with stream:   # closes the response if the caller stops early
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    last = chunk   # the final chunk carries usage for the whole stream
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        metrics.LLM_FIRST_TOKEN.observe(time.perf_counter() - t0, model=model)
+                    parts.append(delta)
+                    yield delta
+    except Exception:
+        _record(model, t0, "error")
+        raise
+    _record(model, t0, "ok", last)
+    out = "".join(parts).strip()
+    if CACHE_ENABLED and out:
+        await asyncio.to_thread(cache.put, key, model, out)
@@ -0,0 +1,331 @@
+"""
+In-process metrics and spans, rendered in the Prometheus text format at
+/metrics (the API) or on METRICS_PORT (ingest_daemon.py).
+
+- Histogram / Counter / Gauge: labelled series behind one lock each.
+  Histograms use fixed cumulative buckets, so an observation is one bisect;
+  quantile() estimates from the buckets the way histogram_quantile() would,
+  for benches and /health. A Gauge can read its value from a function.
+- span(name) times a stage into stage_seconds{stage} and nests: spans
+  opened under another (also across await and asyncio.to_thread) become its
+  children, and a root span slower than SLOW_TRACE_S logs the whole tree,
+  so a slow /callprep shows which stage it was waiting on.
+- sql(name) times one named statement into sql_query_seconds{statement}
+  (the names check_query_plans.py uses) and shows up in the trace too.
+
+    with metrics.span("ai_call_prep", peer=peer_id):
+        with metrics.sql("calls.last_call"):
+            ...
+    metrics.ACK_SECONDS.quantile(0.99)
+    text = metrics.render()
+"""
+from __future__ import annotations
+import bisect, contextvars, logging, os, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_TRACE_S = float(os.getenv("SLOW_TRACE_S", "5.0"))
+
+# seconds; dense under 10ms, where the slash-command ack should stay
+ACK_BUCKETS = (.0005, .001, .002, .003, .005, .0075, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 3.0)
+# seconds; LLM calls, jobs and pipeline stages
+SLOW_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# seconds; single SQL statements
+SQL_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+
+_registry: List["_Metric"] = []
+
+def _escape(value) -> str:
+    # text format: label values escape backslash, double quote and newline
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + n
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return sum(v for k, v in self._series.items()
+                       if all(k[self.labelnames.index(n)] == str(v2) for n, v2 in labels.items()))
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return self._header() + [f"{self.name}{_fmt_labels(self.labelnames, k)} {v:g}" for k, v in series]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float]):
+        """Read the (unlabelled) value from fn at render time."""
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        if self.fn is not None:
+            try:
+                series = [((), self.fn())]
+            except Exception:
+                logger.exception("gauge %s", self.name)
+        return self._header() + [f"{self.name}{_fmt_labels(self.labelnames, k)} {v:g}" for k, v in series]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = ACK_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                # per-bucket counts (+Inf last), sum, count
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def count(self, **labels) -> int:
+        return sum(self._counts(labels))
+
+    def label_values(self, name: str) -> List[str]:
+        i = self.labelnames.index(name)
+        with self._lock:
+            return sorted({k[i] for k in self._series})
+
+    def _counts(self, labels: dict) -> List[int]:
+        want = {n: str(v) for n, v in labels.items()}
+        counts = [0] * (len(self.buckets) + 1)
+        with self._lock:
+            for key, s in self._series.items():
+                if all(key[self.labelnames.index(n)] == v for n, v in want.items()):
+                    counts = [a + b for a, b in zip(counts, s[0])]
+        return counts
+
+    def quantile(self, q: float, **labels) -> float:
+        """Bucket-interpolated q-quantile over the series matching labels (0.0 if empty)."""
+        counts = self._counts(labels)
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank, seen = q * total, 0
+        for i, c in enumerate(counts):
+            if c and seen + c >= rank:
+                if i == len(self.buckets):      # +Inf bucket: the highest finite bound is all we know
+                    return self.buckets[-1]
+                lo = self.buckets[i - 1] if i else 0.0
+                return lo + (self.buckets[i] - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        out = self._header()
+        with self._lock:
+            series = sorted((k, [list(s[0]), s[1], s[2]]) for k, s in self._series.items())
+        for key, (counts, total, n) in series:
+            cum = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cum}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total:.6f}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return out
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+# --- the metrics ---
+
+ACK_SECONDS = Histogram("slack_command_ack_seconds",
+                        "Time from request to HTTP response for /slack/command (Slack allows 3s).",
+                        labelnames=("command",))
+REQUEST_SECONDS = Histogram("http_request_seconds", "HTTP request latency by route.",
+                            labelnames=("route", "method", "status"))
+JOB_SECONDS = Histogram("job_seconds", "Slash-command job latency, enqueue to done.", SLOW_BUCKETS,
+                        labelnames=("command", "outcome"))
+JOB_QUEUE_DEPTH = Gauge("job_queue_depth", "Jobs waiting in the jobs table, retries in backoff included.")
+JOB_OLDEST_SECONDS = Gauge("job_queue_oldest_seconds", "Age of the oldest waiting job (0 when none).")
+JOBS_RUNNING = Gauge("jobs_running", "Jobs being run by executor workers.")
+JOB_RETRIES = Counter("job_retries_total", "Failed job attempts queued again.", labelnames=("command",))
+JOBS_DEDUPLICATED = Counter("jobs_deduplicated_total", "Submissions dropped as repeats (Slack retries).",
+                            labelnames=("command",))
+STAGE_SECONDS = Histogram("stage_seconds", "Time spent in each span.", SLOW_BUCKETS, labelnames=("stage",))
+SQL_SECONDS = Histogram("sql_query_seconds", "SQL time per named statement.", SQL_BUCKETS,
+                        labelnames=("statement",))
+LLM_SECONDS = Histogram("llm_request_seconds", "Chat completion latency (cache hits included).",
+                        SLOW_BUCKETS, labelnames=("model", "outcome"))
+LLM_FIRST_TOKEN = Histogram("llm_first_token_seconds", "Streamed completions: request to the first text.",
+                            SLOW_BUCKETS, labelnames=("model",))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens billed by OpenAI.", labelnames=("model", "kind"))
+SLACK_SECONDS = Histogram("slack_api_seconds", "Slack Web API call latency, per attempt.", SLOW_BUCKETS,
+                          labelnames=("method",))
+SLACK_ERRORS = Counter("slack_api_errors_total", "Failed Slack Web API attempts.",
+                       labelnames=("method", "error"))
+FIRST_TEXT_SECONDS = Histogram("slack_first_text_seconds",
+                               "Streamed replies: job start to the first answer text shown in Slack.",
+                               SLOW_BUCKETS, labelnames=("command",))
+INGEST_ROWS = Counter("ingest_rows_total", "Message rows written by ingest.", labelnames=("op",))
+
+# --- spans ---
+
+class Span:
+    __slots__ = ("name", "attrs", "children", "start", "duration")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.start = time.perf_counter()
+        self.duration = 0.0
+
+    def format(self, depth: int = 0) -> str:
+        attrs = "".join(f" {k}={v}" for k, v in self.attrs.items())
+        lines = [f"{'  ' * depth}{self.name} {self.duration * 1000:.0f}ms{attrs}"]
+        lines += [c.format(depth + 1) for c in self.children]
+        return "\n".join(lines)
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+def _finish(s: Span, parent: Optional[Span]):
+    if parent is not None:
+        parent.children.append(s)
+    elif s.duration >= SLOW_TRACE_S:
+        logger.warning("slow trace:\n%s", s.format())
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a stage; nests under the enclosing span. Usable around awaits."""
+    parent = _current.get()
+    s = Span(name, attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        s.duration = time.perf_counter() - s.start
+        _current.reset(token)
+        STAGE_SECONDS.observe(s.duration, stage=name)
+        _finish(s, parent)
+
+@contextmanager
+def sql(statement: str):
+    """Time one named SQL statement (no span object, just a leaf in the trace)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        took = time.perf_counter() - t0
+        SQL_SECONDS.observe(took, statement=statement)
+        parent = _current.get()
+        if parent is not None:
+            leaf = Span("sql " + statement, {})
+            leaf.duration = took
+            parent.children.append(leaf)
+
+def record(stage: str, seconds: float, **attrs):
+    """A stage timed by the caller (e.g. Pipeline's laps): metric plus a leaf in the trace."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    parent = _current.get()
+    if parent is not None:
+        leaf = Span(stage, attrs)
+        leaf.duration = seconds
+        parent.children.append(leaf)
+
+# --- exposition ---
+
+class RequestTimer:
+    """ASGI middleware: http_request_seconds by matched route template, method and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - t0, route=getattr(route, "path", "unmatched"),
+                                    method=scope["method"], status=status[0])
+
+def serve(port: int, host: str = "0.0.0.0"):
+    """/metrics on a daemon thread, for processes without a web app (ingest_daemon.py)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode("utf-8")
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("metrics on :%d/metrics", port)
+    return server
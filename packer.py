@@ -0,0 +1,167 @@
+"""
+Token-budgeted prompt context.
+
+Prompts used to be cut by line count (msgs[-250:], facts[-100:], a 400-line
+raw tail, call_lines[-200:]), so one pasted essay could blow the context
+while 250 "ok"s wasted it. pack() instead:
+
+  1. drops filler ("ok", "lol", 👍, anything under 3 chars),
+  2. drops near-duplicates (same text once case, punctuation and spacing
+     are ignored), keeping the newest,
+  3. fills a token budget by relevance, then recency,
+  4. returns the kept lines in their original order, with token counts.
+
+Tokens are counted with tiktoken when its encoding is available locally,
+else estimated at ~4 characters per token. Budgets are per model (BUDGETS)
+and split between prompt parts (SHARES).
+"""
+from __future__ import annotations
+import logging, math, os, re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4o-mini"
+# prompt-context tokens we are willing to spend per request (the models take far
+# more; this keeps cost and latency flat). PROMPT_TOKEN_BUDGET overrides.
+BUDGETS: Dict[str, int] = {
+    "gpt-4o-mini": 12000,
+    "gpt-4o": 12000,
+    "gpt-4.1-mini": 12000,
+}
+FALLBACK_BUDGET = 8000
+# share of the budget for each prompt part
+SHARES: Dict[str, float] = {
+    "tail": 0.65,         # verbatim newest messages (daily summary / call prep)
+    "call_lines": 0.20,   # call-related lines, filtered
+    "messages": 0.75,     # /question: recent messages
+    "facts": 0.20,        # /question: stored facts
+    "followup": 0.30,     # /question follow-up: cached messages, re-ranked
+    "turns": 0.10,        # /question follow-up: earlier Q&A in the thread
+}
+
+FILLER = {"ok","okay","k","kk","thanks","thx","thank you","👍","👌","yo","hey","hi","hello","lol","haha","hahaha"}
+
+def is_signal(t: str) -> bool:
+    s = (t or "").strip().lower()
+    if not s: return False
+    if s in FILLER: return False
+    if len(s) < 3: return False
+    return True
+
+def budget(part: str, model: str = DEFAULT_MODEL) -> int:
+    total = int(os.getenv("PROMPT_TOKEN_BUDGET", "0")) or BUDGETS.get(model, FALLBACK_BUDGET)
+    return int(total * SHARES[part])
+
+class TokenCounter:
+    def __init__(self, model: str = DEFAULT_MODEL):
+        self.model = model
+        self.exact = False
+        self._encode = None
+        try:
+            import tiktoken
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")
+            self._encode = enc.encode_ordinary
+            self.exact = True
+        except Exception as e:  # not installed, or the BPE file can't be fetched
+            logger.info("tiktoken unavailable (%s); estimating tokens from length", type(e).__name__)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encode is not None:
+            return len(self._encode(text))
+        return math.ceil(len(text) / 4)
+
+_counters: Dict[str, TokenCounter] = {}
+
+def counter(model: str = DEFAULT_MODEL) -> TokenCounter:
+    c = _counters.get(model)
+    if c is None:
+        c = _counters[model] = TokenCounter(model)
+    return c
+
+def count(text: str, model: str = DEFAULT_MODEL) -> int:
+    return counter(model).count(text)
+
+_NOISE = re.compile(r"[\W_]+", re.UNICODE)
+
+def norm(text: str) -> str:
+    """Dedupe key: lowercase, punctuation and whitespace collapsed."""
+    return _NOISE.sub(" ", (text or "").lower()).strip()
+
+@dataclass
+class Packed:
+    lines: List[str] = field(default_factory=list)
+    tokens: int = 0
+    budget: int = 0
+    dropped: int = 0          # lines not sent, any reason
+    dropped_tokens: int = 0
+    filler: int = 0
+    duplicates: int = 0
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def stats(self) -> Dict[str, int]:
+        return {"kept": len(self.lines), "tokens": self.tokens, "budget": self.budget,
+                "dropped": self.dropped, "dropped_tokens": self.dropped_tokens,
+                "filler": self.filler, "duplicates": self.duplicates}
+
+def pack(lines: Sequence[str], token_budget: int, *, bodies: Optional[Sequence[str]] = None,
+         relevance: Optional[Callable[[str], float]] = None, model: str = DEFAULT_MODEL,
+         drop_filler: bool = True) -> Packed:
+    """
+    lines are oldest first; bodies (default: lines) are the raw message texts
+    used for the filler/duplicate checks and relevance(body) -> score.
+    Without relevance the newest lines win.
+    """
+    bodies = bodies if bodies is not None else lines
+    c = counter(model)
+    out = Packed(budget=token_budget)
+    seen = set()
+    candidates = []  # (score, index, tokens), newest first
+    n = len(lines)
+    for i in range(n - 1, -1, -1):
+        body = bodies[i]
+        if drop_filler and not is_signal(body):
+            out.filler += 1
+            out.dropped += 1
+            out.dropped_tokens += c.count(lines[i])
+            continue
+        key = norm(body)
+        if key in seen:
+            out.duplicates += 1
+            out.dropped += 1
+            out.dropped_tokens += c.count(lines[i])
+            continue
+        seen.add(key)
+        score = relevance(body) if relevance else 0.0
+        candidates.append((score, i, c.count(lines[i]) + 1))  # +1 for the newline
+    # relevance first, then recency (higher index = newer)
+    candidates.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    keep = []
+    for score, i, toks in candidates:
+        if out.tokens + toks <= token_budget:
+            keep.append(i)
+            out.tokens += toks
+        else:
+            out.dropped += 1
+            out.dropped_tokens += toks
+    keep.sort()
+    out.lines = [lines[i] for i in keep]
+    return out
+
+def term_relevance(terms: Sequence[str]) -> Callable[[str], float]:
+    """Score = how many of the (lowercased) terms a text contains."""
+    terms = [t.lower() for t in terms if len(t) >= 3]
+
+    def score(body: str) -> float:
+        low = (body or "").lower()
+        return float(sum(1 for t in terms if t in low))
+    return score
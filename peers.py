@@ -0,0 +1,120 @@
+"""
+Peers registry: the Telegram chats we brief on and the Slack channel each
+one's daily summary goes to. db_migrate.py seeds it from PEER_ID (comma
+separated) on first run; after that manage it here:
+
+    python peers.py list
+    python peers.py add 7740422022 --name William --channel-name briefs-william
+    python peers.py add 123456789 --name Alex --channel C0123ABCD
+    python peers.py disable 123456789
+
+Everything that reads messages, facts, calls or summaries takes a peer_id.
+Slack commands find theirs from the channel they were typed in.
+"""
+from __future__ import annotations
+import argparse, os, sqlite3
+from dataclasses import dataclass
+from typing import List, Optional
+
+import db
+
+@dataclass
+class Peer:
+    peer_id: int
+    name: str = ""
+    slack_channel_id: Optional[str] = None
+    slack_channel_name: Optional[str] = None
+    enabled: bool = True
+
+    @property
+    def label(self) -> str:
+        return self.name or str(self.peer_id)
+
+_COLS = "peer_id, name, slack_channel_id, slack_channel_name, enabled"
+
+def _peer(row) -> Peer:
+    return Peer(row[0], row[1] or "", row[2], row[3], bool(row[4]))
+
+def env_peer_ids() -> List[int]:
+    return [int(p) for p in os.getenv("PEER_ID", "").split(",") if p.strip()]
+
+def list_peers(con: sqlite3.Connection, enabled_only: bool = True) -> List[Peer]:
+    sql = f"SELECT {_COLS} FROM peers" + (" WHERE enabled=1" if enabled_only else "") + " ORDER BY created_utc, peer_id"
+    return [_peer(r) for r in con.execute(sql).fetchall()]
+
+def get(con: sqlite3.Connection, peer_id: int) -> Optional[Peer]:
+    row = con.execute(f"SELECT {_COLS} FROM peers WHERE peer_id=?", (peer_id,)).fetchone()
+    return _peer(row) if row else None
+
+def default_peer_id(con: Optional[sqlite3.Connection] = None) -> int:
+    """First enabled peer (the one single-chat scripts brief on), else the first PEER_ID."""
+    if con is None:
+        with db.connection() as c:
+            return default_peer_id(c)
+    try:
+        row = con.execute("SELECT peer_id FROM peers WHERE enabled=1 ORDER BY created_utc, peer_id LIMIT 1").fetchone()
+    except sqlite3.OperationalError:
+        row = None  # not migrated yet
+    if row:
+        return row[0]
+    ids = env_peer_ids()
+    assert ids, "No peers registered and no PEER_ID in .env"
+    return ids[0]
+
+def for_channel(con: sqlite3.Connection, channel_id: str) -> Optional[int]:
+    """
+    Peer briefed in a Slack channel: the peer of the latest summary posted
+    there, else the peer registered for the channel.
+    """
+    row = con.execute(
+        "SELECT peer_id FROM summaries WHERE channel_id=? ORDER BY posted_utc DESC LIMIT 1",
+        (channel_id,)).fetchone()
+    if row and row[0] is not None:
+        return row[0]
+    row = con.execute("SELECT peer_id FROM peers WHERE slack_channel_id=?", (channel_id,)).fetchone()
+    return row[0] if row else None
+
+def resolve(con: sqlite3.Connection, channel_id: str) -> int:
+    return for_channel(con, channel_id) or default_peer_id(con)
+
+def upsert(con: sqlite3.Connection, peer_id: int, name: Optional[str] = None,
+           slack_channel_id: Optional[str] = None, slack_channel_name: Optional[str] = None,
+           enabled: Optional[bool] = None):
+    """Insert or update a peer; None leaves a field unchanged."""
+    con.execute("INSERT OR IGNORE INTO peers(peer_id) VALUES (?)", (peer_id,))
+    for col, val in (("name", name), ("slack_channel_id", slack_channel_id),
+                     ("slack_channel_name", slack_channel_name),
+                     ("enabled", None if enabled is None else int(enabled))):
+        if val is not None:
+            con.execute(f"UPDATE peers SET {col}=? WHERE peer_id=?", (val, peer_id))
+    con.commit()
+
+def main():
+    p = argparse.ArgumentParser(description="Manage the peers registry")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    add = sub.add_parser("add")
+    add.add_argument("peer_id", type=int)
+    add.add_argument("--name")
+    add.add_argument("--channel", help="Slack channel id")
+    add.add_argument("--channel-name", help="Slack channel name (resolved to an id on first post)")
+    for cmd in ("enable", "disable"):
+        sub.add_parser(cmd).add_argument("peer_id", type=int)
+    args = p.parse_args()
+
+    import db_migrate
+    con = db.open_connection()
+    db_migrate.migrate(con)
+    if args.cmd == "add":
+        upsert(con, args.peer_id, args.name, args.channel, args.channel_name, True)
+    elif args.cmd in ("enable", "disable"):
+        upsert(con, args.peer_id, enabled=args.cmd == "enable")
+    for peer in list_peers(con, enabled_only=False):
+        chan = peer.slack_channel_id or (f"#{peer.slack_channel_name}" if peer.slack_channel_name else "-")
+        print(f"{peer.peer_id:>14}  {'on ' if peer.enabled else 'off'}  {chan:<20}  {peer.name}")
+    con.close()
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    main()
@@ -0,0 +1,269 @@
+"""
+The one summary pipeline behind the daily scripts, daily_runner.py and the
+API's call prep:
+
+    load_window -> filter -> build_prompt -> generate -> shrink -> deliver
+
+    p = pipeline.Pipeline(ai, deliver=pipeline.SlackBotDelivery(slack_sender.SlackSender(token)))
+    result = await p.run_today(peer_id)             # daily summary
+    result = await p.run(peer_id, since_iso, label)  # any window
+
+Stages are methods, so a variant overrides just the one it changes. With
+on_text, generate streams the draft into it as it is written (shrink, when
+the draft is over MAX_WORDS, still runs before run() returns). Deliveries
+are pluggable (StdoutDelivery, WebhookDelivery, SlackBotDelivery). Every
+stage is timed into Result.timings and stage_seconds; a run is one span
+(see metrics.py). Nothing runs at import time, and a process that builds
+a Pipeline keeps its OpenAI/Slack clients and the LLM cache warm between
+runs.
+"""
+from __future__ import annotations
+import abc, asyncio, logging, os, sqlite3, time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import db, keywords, llm, metrics, packer, peers, rollups, slack_sender
+
+logger = logging.getLogger(__name__)
+tz = ZoneInfo("Australia/Brisbane")
+
+STYLE_PATH = "summary_style.txt"
+MAX_WORDS = 250
+MAX_CALL_LINES = 200
+SHRINK_PROMPT = f"Shorten to ≤{MAX_WORDS} words. Keep EXACT same format and meaning."
+
+# kind -> (what the window is, what to say when it's empty)
+KINDS = {
+    "daily": ("Here are today's messages (UTC):", "No significant messages today."),
+    "callprep": ("Here are messages since the last call (UTC):", "No new messages since last call."),
+}
+
+def date_label(now_local: Optional[datetime] = None) -> str:
+    """Date like 2/10/25 (no leading zeros on D/M)."""
+    now_local = now_local or datetime.now(tz)
+    return f"{now_local.day}/{now_local.month}/{now_local.strftime('%y')}"
+
+def today_window(now_local: Optional[datetime] = None):
+    """Brisbane local day (midnight -> now) as (start UTC iso, date label)."""
+    now_local = now_local or datetime.now(tz)
+    start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start_local.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), date_label(now_local)
+
+_styles: Dict[str, tuple] = {}
+
+def load_style(path: str = STYLE_PATH) -> str:
+    """summary_style.txt, re-read only when the file changes."""
+    mtime = os.path.getmtime(path)
+    hit = _styles.get(path)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    _styles[path] = (mtime, text)
+    return text
+
+@dataclass
+class Result:
+    peer_id: int
+    date_label: str
+    text: str = ""
+    n_msgs: int = 0
+    n_call_lines: int = 0
+    shrunk: bool = False
+    tokens: Dict[str, dict] = field(default_factory=dict)   # prompt part -> packer.Packed.stats()
+    delivered: Optional[dict] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+class Pipeline:
+    def __init__(self, ai, deliver: Optional["Delivery"] = None, kind: str = "daily",
+                 style_path: str = STYLE_PATH, on_text: Optional[Callable[[str], Awaitable[None]]] = None):
+        self.ai = ai
+        self.deliver = deliver
+        self.on_text = on_text
+        self.kind = kind
+        self.style_path = style_path
+
+    # --- stages ---
+
+    async def load_window(self, peer_id: int, since_iso: str) -> rollups.WindowContext:
+        return await rollups.abuild_context(peer_id, since_iso, self._summarize_chunk)
+
+    async def filter(self, peer_id: int, since_iso: str, ctx: rollups.WindowContext) -> packer.Packed:
+        """Call-related lines of the whole window, read from message_tags and packed to the call_lines budget."""
+        try:
+            rows = await asyncio.to_thread(_call_rows, peer_id, since_iso)
+        except sqlite3.OperationalError:
+            # not migrated yet: match the verbatim tail instead
+            rows = [r for r in ctx.tail if keywords.matcher.any(r[2])][-MAX_CALL_LINES:]
+        return packer.pack([rollups.format_line(ts, me, txt) for ts, me, txt in rows],
+                           packer.budget("call_lines"), bodies=[txt or "" for _, _, txt in rows])
+
+    def build_prompt(self, ctx: rollups.WindowContext, call_lines: List[str], label: str):
+        intro, _ = KINDS[self.kind]
+        system = load_style(self.style_path).replace("{date_au}", label)
+        call_snippet = "\n".join(call_lines) if call_lines else "(none)"
+        user = (f"{intro}\n\n{ctx.text}\n\nCall-related lines only (filtered):\n{call_snippet}\n\n"
+                "Write the report now, following the layout and rules exactly.")
+        return system, user
+
+    async def generate(self, system: str, user: str) -> str:
+        return await llm.acomplete(self.ai, system, user, temperature=0.2, on_text=self.on_text)
+
+    async def shrink(self, text: str) -> Tuple[str, bool]:
+        """(text, whether it was shortened)."""
+        if len(text.split()) <= MAX_WORDS:
+            return text, False
+        return await llm.acomplete(self.ai, SHRINK_PROMPT, text, temperature=0.0), True
+
+    async def _summarize_chunk(self, system: str, user: str) -> str:
+        return await llm.acomplete(self.ai, system, user, temperature=0.0)
+
+    # --- driver ---
+
+    async def run(self, peer_id: int, since_iso: str, label: Optional[str] = None) -> Result:
+        with metrics.span("pipeline." + self.kind, peer=peer_id):
+            return await self._run(peer_id, since_iso, label)
+
+    async def _run(self, peer_id: int, since_iso: str, label: Optional[str]) -> Result:
+        res = Result(peer_id, label or date_label())
+        t = time.perf_counter()
+
+        def lap(stage: str):
+            nonlocal t
+            now = time.perf_counter()
+            res.timings[stage] = now - t
+            metrics.record("pipeline." + stage, now - t)
+            t = now
+
+        ctx = await self.load_window(peer_id, since_iso)
+        res.n_msgs = ctx.n_msgs
+        lap("load_window")
+        if not ctx.n_msgs:
+            _, empty = KINDS[self.kind]
+            res.text = f"Date: {res.date_label}\n\n- {empty}\n\nAny privates/ calls?\n- None mentioned."
+        else:
+            calls = await self.filter(peer_id, since_iso, ctx)
+            res.n_call_lines = len(calls.lines)
+            if ctx.packed is not None:
+                res.tokens["tail"] = ctx.packed.stats()
+            res.tokens["call_lines"] = calls.stats()
+            lap("filter")
+            system, user = self.build_prompt(ctx, calls.lines, res.date_label)
+            lap("build_prompt")
+            draft = await self.generate(system, user)
+            lap("generate")
+            res.text, res.shrunk = await self.shrink(draft)
+            lap("shrink")
+        if self.deliver is not None:
+            res.delivered = await self.deliver(res)
+            lap("deliver")
+        logger.info("pipeline %s peer=%s msgs=%d %s %s", self.kind, peer_id, res.n_msgs,
+                    " ".join(f"{k}={v * 1000:.0f}ms" for k, v in res.timings.items()),
+                    " ".join(f"{k}={v['tokens']}/{v['budget']}tok(-{v['dropped_tokens']})"
+                             for k, v in res.tokens.items()))
+        return res
+
+    async def run_today(self, peer_id: int) -> Result:
+        since_iso, label = today_window()
+        return await self.run(peer_id, since_iso, label)
+
+# --- deliveries: async callables Result -> dict ---
+
+class Delivery(abc.ABC):
+    @abc.abstractmethod
+    async def __call__(self, res: Result) -> dict:
+        """Send res somewhere; returns what was done, stored as Result.delivered."""
+
+class StdoutDelivery(Delivery):
+    def __init__(self, header: bool = False):
+        self.header = header
+
+    async def __call__(self, res: Result) -> dict:
+        if self.header:
+            print(f"===== {res.peer_id} =====")
+        print(res.text)
+        return {"to": "stdout"}
+
+class WebhookDelivery(Delivery):
+    """Slack incoming webhook (no thread ts comes back, so nothing is recorded)."""
+
+    def __init__(self, url: str, session=None):
+        import requests
+        self.url = url
+        self.session = session or requests.Session()
+
+    async def __call__(self, res: Result) -> dict:
+        r = await asyncio.to_thread(self.session.post, self.url, json={"text": res.text}, timeout=30)
+        if r.status_code != 200:
+            raise RuntimeError(f"Slack webhook error: {r.status_code} {r.text}")
+        return {"to": "webhook"}
+
+class SlackBotDelivery(Delivery):
+    """
+    Post with the bot token to the peer's channel (or into thread_ts) and,
+    for top-level posts, store the message ts in summaries so slash
+    commands can reply in its thread. With a known channel id that is one
+    API call; a channel known by name only is resolved once and remembered.
+    """
+
+    def __init__(self, slack, channel_id: Optional[str] = None, thread_ts: Optional[str] = None,
+                 channel_name: Optional[str] = None, prefix: str = ""):
+        self.slack = slack                  # slack_sender.SlackSender
+        self.channel_id = channel_id
+        self.thread_ts = thread_ts
+        self.channel_name = channel_name    # fallback when the peer has no channel registered
+        self.prefix = prefix
+
+    async def channel_for(self, peer_id: int, refresh: bool = False) -> str:
+        if self.channel_id:
+            return self.channel_id
+        peer = await asyncio.to_thread(_get_peer, peer_id)
+        if peer.slack_channel_id and not refresh:
+            return peer.slack_channel_id
+        name = peer.slack_channel_name or self.channel_name
+        if not name:
+            raise RuntimeError(f"No Slack channel for peer {peer_id}; set one with peers.py")
+        chan_id = await self.slack.channel_id(name, refresh=refresh)
+        await asyncio.to_thread(_remember_channel, peer_id, chan_id)
+        return chan_id
+
+    async def __call__(self, res: Result) -> dict:
+        from slack_sdk.errors import SlackApiError
+        chan_id = await self.channel_for(res.peer_id)
+        text = self.prefix + res.text
+        try:
+            posted = await self.slack.post(chan_id, text, self.thread_ts)
+        except SlackApiError as e:
+            # a remembered id went stale (channel deleted/archived/renamed): re-resolve by name once
+            peer = await asyncio.to_thread(_get_peer, res.peer_id)
+            if (self.channel_id or e.response.get("error") not in slack_sender.STALE_CHANNEL_ERRORS
+                    or not (peer.slack_channel_name or self.channel_name)):
+                raise
+            logger.warning("peer %s: channel %s is %s; resolving by name", res.peer_id, chan_id, e.response["error"])
+            await self.slack.forget(peer.slack_channel_name or self.channel_name)
+            chan_id = await self.channel_for(res.peer_id, refresh=True)
+            posted = await self.slack.post(chan_id, text, self.thread_ts)
+        if not self.thread_ts:
+            await asyncio.to_thread(_save_summary, res.peer_id, chan_id, posted["ts"], res.date_label, res.text)
+        return {"to": "slack", "channel": chan_id, "ts": posted["ts"]}
+
+def _call_rows(peer_id: int, since_iso: str) -> List[tuple]:
+    with db.connection() as con, metrics.sql("keywords.call_lines"):
+        return keywords.call_lines(con, peer_id, since_iso, MAX_CALL_LINES)
+
+def _get_peer(peer_id: int) -> peers.Peer:
+    with db.connection() as con:
+        return peers.get(con, peer_id) or peers.Peer(peer_id)
+
+def _remember_channel(peer_id: int, channel_id: str):
+    with db.connection() as con:
+        peers.upsert(con, peer_id, slack_channel_id=channel_id)
+
+def _save_summary(peer_id: int, channel_id: str, ts: str, label: str, text: str):
+    with db.connection() as con:
+        con.execute(
+            "INSERT INTO summaries(posted_utc, channel_id, ts, date_label, text, peer_id) VALUES (?,?,?,?,?,?)",
+            (datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"), channel_id, ts, label, text, peer_id))
+        con.commit()
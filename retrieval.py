@@ -1,12 +1,25 @@
 from __future__ import annotations
 import sqlite3
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Sequence
 import logging, shlex
 
+import calls, db, hot_window, metrics, timestamps
+
 logger = logging.getLogger(__name__)
 
-# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated ecop# Small, opinionated"i# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, opinionated exp# Small, om # Small, opinionatemakeup": ["makeup", "mascara", "eyeliner", "no makeup"],
+# Small, opinionated expansion map: each key pulls in its synonym group.
+EXPANSIONS: Dict[str, List[str]] = {
+    "call": ["call", "video call", "video", "private"],
+    "video": ["video", "video call", "facetime"],
+    "private": ["private", "privates", "pvt"],
+    "budget": ["budget", "cost", "price", "money"],
+    "money": ["money", "paid", "payment", "budget"],
+    "deadline": ["deadline", "due", "eta"],
+    "eta": ["eta", "deadline", "due"],
+    "cancel": ["cancel", "canceled", "cancelled"],
+    "reschedule": ["reschedule", "resched", "move"],
+    "makeup": ["makeup", "mascara", "eyeliner", "no makeup"],
 }
 
 def _escape_like(t: str) -> str:
@@ -17,7 +30,8 @@ def _escape_like(t: str) -> str:
 
 def _tokenize(raw: str) -> List[str]:
     """
-    Phrase-aware tokenization: respects quotes, e.g. "video call".
+    Phrase-aware tokenization: respects quotes, e.g. "video call", and drops
+    surrounding punctuation ("rate?" -> "rate").
     """
     if not raw:
         return []
@@ -25,7 +39,8 @@ def _tokenize(raw: str) -> List[str]:
         toks = shlex.split(raw)
     except Exception:
         toks = raw.split()
-    return [t.strip() for t in toks if t.strip()]
+    toks = [t.strip().strip(".,;:!?()'\"") for t in toks]
+    return [t for t in toks if t]
 
 def expand_query(raw: str) -> List[str]:
     """
@@ -48,66 +63,144 @@ def expand_query(raw: str) -> List[str]:
     return out
 
 def connect(db_path: str = "briefs.db") -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Standalone connection for scripts; the API goes through db.connection()."""
+    return db.open_connection(db_path)
 
 def rows_to_dicts(rows) -> List[Dict[str, Any]]:
     return [dict(r) for r in rows]
 
-def search_messages(conn: sqlite3.Connection, query: str, limit: int = 200) -> List[Dict[str, Any]]:
+# The trigram tokenizer matches substrings the same way LIKE '%term%' does,
+# but it cannot index terms shorter than three characters.
+FTS_MIN_TERM = 3
+
+# Question words that would OR-match nearly every message; left out of MATCH.
+STOP_WORDS = frozenset("""
+    a about after again all also and any are at be been before but by can could
+    did do does for from get got had has have he her him his how i if in is it
+    its just me my next not of on or our said say she so than that the their
+    them then there they this to told was we were what what's when where which
+    who why will with would you your
+""".split())
+
+def _fts_term(term: str) -> bool:
+    return len(term) >= FTS_MIN_TERM and term.lower() not in STOP_WORDS
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def build_fts_query(raw: str) -> str | None:
+    """
+    Map the tokenized/expanded query onto an FTS5 MATCH expression:
+    quoted phrases become FTS phrases, synonym groups become OR groups.
+    Stop words and terms too short for the trigram index are dropped;
+    returns None when no usable term is left.
+    """
+    groups: List[str] = []
+    seen = set()
+    for tok in _tokenize(raw):
+        terms = []
+        for t in EXPANSIONS.get(tok.lower(), [tok]):
+            if t.lower() in seen or not _fts_term(t):
+                continue
+            seen.add(t.lower())
+            terms.append(t)
+        if not terms:
+            continue
+        phrases = [_fts_phrase(t) for t in terms]
+        groups.append(phrases[0] if len(phrases) == 1 else "(" + " OR ".join(phrases) + ")")
+    if not groups:
+        return None
+    return " OR ".join(groups)
+
+def _search_like(conn: sqlite3.Connection, peer_id: int, terms: List[str], limit: int, since: int | None):
+    where = " OR ".join(["text LIKE ? ESCAPE '\\'" for _ in terms])
+    like_params = [f"%{_escape_like(t)}%" for t in terms]
+    window = "" if since is None else "AND ts_epoch >= ?"
+    sql = f"""
+        SELECT id, peer_id, msg_id, ts_utc, from_me, text
+        FROM messages
+        WHERE peer_id = ? {window} AND ({where})
+        ORDER BY ts_epoch DESC
+        LIMIT ?
     """
-    Lightweight retrieval over SQLite: LIKE on expanded terms/phrases, ordered by recency.
+    params = (peer_id,) + (() if since is None else (since,))
+    with metrics.sql("retrieval.search_messages.like"):
+        return conn.execute(sql, (*params, *like_params, limit)).fetchall()
+
+def _search_fts(conn: sqlite3.Connection, peer_id: int, match: str, limit: int, since: int | None):
+    window = "" if since is None else "AND m.ts_epoch >= ?"
+    params = (match, peer_id) + (() if since is None else (since,))
+    with metrics.sql("retrieval.search_messages.fts"):
+        return conn.execute(f"""
+            SELECT m.id, m.peer_id, m.msg_id, m.ts_utc, m.from_me, m.text
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? AND m.peer_id = ? {window}
+            ORDER BY bm25(messages_fts), m.ts_epoch DESC
+            LIMIT ?
+        """, (*params, limit)).fetchall()
+
+def search_messages(conn: sqlite3.Connection, peer_id: int, query: str,
+                    limit: int = 200, since_iso: str | None = None) -> List[Dict[str, Any]]:
     """
+    Retrieval over one peer's messages (since since_iso, if given): FTS5 MATCH
+    on expanded terms/phrases, ranked by BM25 with recency as tiebreak. Falls
+    back to a LIKE scan (ordered by recency) when the FTS table is missing or
+    no term is long enough to index.
+    """
+    with metrics.span("search_messages", peer=peer_id):
+        return _search_messages(conn, peer_id, query, limit, since_iso)
+
+def _search_messages(conn: sqlite3.Connection, peer_id: int, query: str, limit: int,
+                     since_iso: str | None = None) -> List[Dict[str, Any]]:
+    since = timestamps.epoch(since_iso) if since_iso else None
     try:
         terms = expand_query(query)
         if not terms:
             return []
-        where = " OR ".join(["text LIKE ? ESCAPE '\'" for _ in terms])
-        like_params = [f"%{_escape_like(t)}%" for t in terms]
-        sql = f"""
-            SELECT id, peer_id, msg_id, ts_utc, from_me, text, message_id
-            FROM messages
-            WHERE {where}
-            ORDER BY ts_utc DESC
-            LIMIT ?
-        """
-        cur = conn.execute(sql, (*like_params, limit))
-        rows = rows_to_dicts(cur.fetchall())
-        logger.info("search rows=%d limit=%d", len(rows), limit)
+        match = build_fts_query(query)
+        rows = None
+        if match:
+            try:
+                rows = _search_fts(conn, peer_id, match, limit, since)
+            except sqlite3.OperationalError:
+                logger.warning("messages_fts unavailable; run db_migrate.py. Falling back to LIKE.")
+        if rows is None:
+            rows = _search_like(conn, peer_id, terms, limit, since)
+        rows = rows_to_dicts(rows)
+        logger.info("search peer=%s rows=%d limit=%d fts=%s", peer_id, len(rows), limit, bool(match))
         return rows
     except Exception:
         logger.exception("search_messages failed")
         return []
 
-def find_last_call_anchor(conn: sqlite3.Connection, fallback_hours: int = 48) -> datetime:
+def find_last_call_anchor(conn: sqlite3.Connection, peer_id: int, fallback_hours: int = 48) -> datetime:
+    """
+    Latest marked or detected call (call_anchor, see calls.py), the same
+    anchor app.handle_callprep uses; now - fallback_hours if there is none.
+    """
     now = datetime.now(timezone.utc)
     try:
-        cur = conn.execute("""
-            SELECT ts_utc FROM messages
-            WHERE text LIKE '%call%' OR text LIKE '%video%' OR text LIKE '%private%'
-            ORDER BY ts_utc DESC LIMIT 1
-        """)
-        row = cur.fetchone()
-        if row and row["ts_utc"]:
-            s = str(row["ts_utc"])
-            try:
-                return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
-            except Exception:
-                return datetime.fromtimestamp(float(s), tz=timezone.utc)
+        ts = timestamps.epoch(calls.last_call(conn, peer_id))
+        if ts is not None:
+            return datetime.fromtimestamp(ts, tz=timezone.utc)
     except Exception:
         logger.exception("find_last_call_anchor failed")
     return now - timedelta(hours=fallback_hours)
 
-def get_window(conn: sqlite3.Connection, start_utc: datetime) -> List[Dict[str, Any]]:
+def get_window(conn: sqlite3.Connection, peer_id: int, start_utc: datetime) -> Sequence[Dict[str, Any]]:
     try:
-        cur = conn.execute("""
-            SELECT id, peer_id, msg_id, ts_utc, from_me, text, message_id
-            FROM messages
-            WHERE ts_utc >= ?
-            ORDER BY ts_utc ASC
-        """, (start_utc.isoformat().replace("+00:00",""),))
-        return rows_to_dicts(cur.fetchall())
+        rows = hot_window.windows.since(peer_id, start_utc, shape="dict")
+        if rows is not None:
+            return rows
+        with metrics.sql("retrieval.get_window"):
+            rows = conn.execute("""
+                SELECT id, peer_id, msg_id, ts_utc, from_me, text
+                FROM messages
+                WHERE peer_id = ? AND ts_epoch >= ?
+                ORDER BY ts_epoch ASC
+            """, (peer_id, timestamps.epoch(start_utc))).fetchall()
+        return rows_to_dicts(rows)
     except Exception:
         logger.exception("get_window failed")
         return []
@@ -0,0 +1,277 @@
+"""
+Hierarchical rolling summaries for long chat windows.
+
+The newest messages of a window are sent verbatim, as many as fit the
+"tail" token budget (packer.budget, filler and duplicates dropped). Anything
+older is covered by cached summaries: one per closed Brisbane day (straight
+from the day's lines, or merged from per-hour summaries when the day is too
+busy for one prompt) and one "span" for the closed hours of a partial day at
+the start of the window. Each summary is computed once, stored in
+rollup_summaries with the bucket's (n_msgs, last_id) signature, and only
+recomputed if that bucket later gains messages (e.g. from a backfill). So a
+two-week /callprep sends ~14 short day notes + the raw tail instead of
+thousands of lines, and costs about the same as a one-day window.
+
+    ctx = rollups.build_context(peer_id, since_iso, summarize)        # scripts
+    ctx = await rollups.abuild_context(peer_id, since_iso, asummarize)  # API
+    # summarize(system, user) -> str
+"""
+from __future__ import annotations
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import db, hot_window, packer, timestamps
+
+tz = ZoneInfo("Australia/Brisbane")
+
+# buckets with fewer lines than this are inlined rather than summarized
+MIN_CHUNK_LINES = 8
+# days with more lines than this are summarized per hour first, then merged
+DAY_DIRECT_LINES = 600
+LEVELS = ("hour", "span", "day")
+
+HOUR_PROMPT = ("Condense these chat lines (one hour, UTC timestamps) into at most 5 terse bullets. "
+               "Keep every call/private detail (times, booked/confirmed/canceled, preferences), decisions, "
+               "money, health and follow-ups. Keep SHE/HE as written. Drop greetings and filler.")
+DAY_PROMPT = ("Condense this day of chat lines (UTC timestamps) into at most 8 terse bullets. Keep every "
+              "call/private detail (times, booked/confirmed/canceled, preferences), decisions, money, health "
+              "and follow-ups. Keep SHE/HE as written. Drop greetings and filler.")
+MERGE_PROMPT = ("Merge these hourly notes from one day into at most 8 terse bullets. Keep every call/private "
+                "detail, decision, commitment and follow-up; merge duplicates. Keep SHE/HE as written.")
+
+def clean(t: str) -> str:
+    return " ".join(((t or "").replace("\n"," ").replace("\r"," ")).split())
+
+def format_line(ts, me, txt) -> str:
+    who = "SHE" if me==1 else "HE"
+    return f"{ts} — {who}: {clean(txt)}"
+
+def _parse(ts: str) -> datetime:
+    return datetime.fromtimestamp(timestamps.epoch(ts), timezone.utc)
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+@dataclass
+class Bucket:
+    level: str
+    start: datetime
+    end: datetime
+    n_msgs: int = 0
+    last_id: int = 0
+    lines: List[str] = field(default_factory=list)
+    children: List["Bucket"] = field(default_factory=list)
+    text: Optional[str] = None
+    cached: bool = False
+
+    @property
+    def signature(self) -> Tuple[int, int]:
+        return (self.n_msgs, self.last_id)
+
+    def label(self) -> str:
+        if self.level == "day":
+            return self.start.astimezone(tz).strftime("%a %-d %b (day notes)")
+        return f"{_iso(self.start)[:13]}:00Z to {_iso(self.end)[:13]}:00Z (notes)"
+
+    def prompt(self) -> Tuple[str, str]:
+        if self.children:
+            return MERGE_PROMPT, "\n\n".join(c.text or "" for c in self.children)
+        if self.level == "day":
+            return DAY_PROMPT, "\n".join(self.lines)
+        return HOUR_PROMPT, "\n".join(self.lines)
+
+@dataclass
+class WindowContext:
+    text: str
+    tail: List[tuple]
+    n_msgs: int
+    n_summarized: int
+    packed: Optional[packer.Packed] = None   # the verbatim tail: tokens kept/dropped
+
+class WindowPlan:
+    def __init__(self, peer_id: int, parts: list, tail: list, n_msgs: int, tail_tokens: int = 0):
+        self.peer_id = peer_id
+        self.parts = parts    # [("bucket", Bucket) | ("raw", [line, ...])]
+        self.tail = tail      # [(id, ts, me, txt), ...]
+        self.n_msgs = n_msgs
+        self.tail_tokens = tail_tokens
+
+    def missing(self, level: str) -> List[Bucket]:
+        out = []
+        for kind, item in self.parts:
+            if kind != "bucket" or item.text is not None:
+                continue
+            if item.level == level:
+                out.append(item)
+            elif level == "hour":
+                out.extend(c for c in item.children if c.text is None)
+        return out
+
+    def render(self) -> WindowContext:
+        out, summarized = [], 0
+        for kind, item in self.parts:
+            if kind == "raw":
+                out.extend(item)
+            else:
+                out.append(f"[{item.label()}]\n{item.text}")
+                summarized += item.n_msgs
+        packed = packer.pack([format_line(ts, me, txt) for _, ts, me, txt in self.tail],
+                             self.tail_tokens, bodies=[r[3] or "" for r in self.tail])
+        if out:
+            text = ("Earlier in this window (condensed notes, oldest first):\n" + "\n".join(out) +
+                    "\n\nLatest messages (verbatim):\n" + packed.text)
+        else:
+            text = packed.text
+        return WindowContext(text=text, tail=[r[1:] for r in self.tail],
+                             n_msgs=self.n_msgs, n_summarized=summarized, packed=packed)
+
+def load_rows(con, peer_id: int, since_iso: str) -> Sequence[tuple]:
+    """(id, ts_utc, from_me, text) oldest first, from the hot window when it covers since_iso."""
+    rows = hot_window.windows.since(peer_id, since_iso, shape="row")
+    if rows is not None:
+        return rows
+    return [tuple(r) for r in con.execute("""
+        SELECT id, ts_utc, from_me, text
+        FROM messages
+        WHERE peer_id=? AND ts_epoch >= ?
+        ORDER BY ts_epoch ASC
+    """, (peer_id, timestamps.epoch(since_iso))).fetchall()]
+
+def _load_cached(con, peer_id: int, since_iso: str) -> Dict[Tuple[str, str], tuple]:
+    rows = con.execute("""
+        SELECT level, bucket_start, n_msgs, last_id, text
+        FROM rollup_summaries
+        WHERE peer_id=? AND level IN ('hour','span','day') AND bucket_start >= ?
+    """, (peer_id, since_iso)).fetchall()
+    return {(r[0], r[1]): (r[2], r[3], r[4]) for r in rows}
+
+def tail_split(rows: list, tail_tokens: int) -> int:
+    """Index of the oldest row in the verbatim tail: newest signal lines within tail_tokens."""
+    c = packer.counter()
+    used = 0
+    for i in range(len(rows) - 1, -1, -1):
+        _, ts, me, txt = rows[i]
+        if not packer.is_signal(txt):
+            continue
+        used += c.count(format_line(ts, me, txt)) + 1
+        if used > tail_tokens:
+            return i + 1
+    return 0
+
+def plan_window(con, peer_id: int, since_iso: str, tail_tokens: Optional[int] = None) -> WindowPlan:
+    tail_tokens = tail_tokens or packer.budget("tail")
+    rows = load_rows(con, peer_id, since_iso)
+    split = tail_split(rows, tail_tokens)
+    if split == 0:
+        return WindowPlan(peer_id, [], rows, len(rows), tail_tokens)
+    head, tail = rows[:split], rows[split:]
+    since = _parse(since_iso)
+    tail_start = _parse(tail[0][1])
+    cached = _load_cached(con, peer_id, since_iso)
+
+    # hour buckets over the head; only hours fully inside [since, tail_start) are cacheable
+    hours: List[Bucket] = []
+    hour = None
+    for mid, ts, me, txt in head:
+        h = timestamps.epoch(ts) // 3600
+        if h != hour:
+            hour = h
+            start = datetime.fromtimestamp(h * 3600, timezone.utc)
+            hours.append(Bucket("hour", start, start + timedelta(hours=1)))
+        b = hours[-1]
+        b.n_msgs += 1
+        b.last_id = max(b.last_id, mid)
+        b.lines.append(format_line(ts, me, txt))
+
+    def closed(b: Bucket) -> bool:
+        return b.start >= since and b.end <= tail_start
+
+    def fill(b: Bucket):
+        hit = cached.get((b.level, _iso(b.start)))
+        if hit and (hit[0], hit[1]) == b.signature:
+            b.text, b.cached = hit[2], True
+        elif b.n_msgs < MIN_CHUNK_LINES:
+            b.text = "\n".join(b.lines)
+
+    def merge(level: str, start: datetime, end: datetime, members: List[Bucket]) -> Bucket:
+        b = Bucket(level, start, end)
+        for m in members:
+            b.n_msgs += m.n_msgs
+            b.last_id = max(b.last_id, m.last_id)
+            b.lines.extend(m.lines)
+        return b
+
+    parts: list = []
+    i = 0
+    while i < len(hours):
+        h = hours[i]
+        if not closed(h):
+            parts.append(("raw", h.lines))
+            i += 1
+            continue
+        day_start_local = h.start.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        day_start = day_start_local.astimezone(timezone.utc)
+        day_end = (day_start_local + timedelta(days=1)).astimezone(timezone.utc)
+        j = i
+        while j < len(hours) and hours[j].start < day_end and closed(hours[j]):
+            j += 1
+        members = hours[i:j]
+        if day_start >= since and day_end <= tail_start:
+            b = merge("day", day_start, day_end, members)
+            fill(b)
+            if b.text is None and b.n_msgs > DAY_DIRECT_LINES:
+                b.children = members
+                for c in members:
+                    fill(c)
+        else:
+            # closed hours of a partial day (start of the window): one span
+            b = merge("span", members[0].start, members[-1].end, members)
+            fill(b)
+        parts.append(("bucket", b))
+        i = j
+    return WindowPlan(peer_id, parts, tail, len(rows), tail_tokens)
+
+def save(con, peer_id: int, buckets: List[Bucket]):
+    now = _iso(datetime.now(timezone.utc))
+    con.executemany("""
+        INSERT OR REPLACE INTO rollup_summaries(peer_id, level, bucket_start, bucket_end, n_msgs, last_id, text, created_utc)
+        VALUES (?,?,?,?,?,?,?,?)
+    """, [(peer_id, b.level, _iso(b.start), _iso(b.end), b.n_msgs, b.last_id, b.text, now)
+          for b in buckets if b.text is not None])
+    con.commit()
+
+def build_context(peer_id: int, since_iso: str,
+                  summarize: Callable[[str, str], str]) -> WindowContext:
+    with db.connection() as con:
+        plan = plan_window(con, peer_id, since_iso)
+        for level in LEVELS:
+            todo = plan.missing(level)
+            for b in todo:
+                b.text = summarize(*b.prompt())
+            if todo:
+                save(con, peer_id, todo)
+    return plan.render()
+
+def _plan(peer_id: int, since_iso: str) -> WindowPlan:
+    with db.connection() as con:
+        return plan_window(con, peer_id, since_iso)
+
+def _save(peer_id: int, buckets: List[Bucket]):
+    with db.connection() as con:
+        save(con, peer_id, buckets)
+
+async def abuild_context(peer_id: int, since_iso: str,
+                         summarize: Callable[[str, str], Awaitable[str]]) -> WindowContext:
+    plan = await asyncio.to_thread(_plan, peer_id, since_iso)
+    for level in LEVELS:
+        todo = plan.missing(level)
+        if not todo:
+            continue
+        texts = await asyncio.gather(*(summarize(*b.prompt()) for b in todo))
+        for b, text in zip(todo, texts):
+            b.text = text
+        await asyncio.to_thread(_save, peer_id, todo)
+    return plan.render()
@@ -0,0 +1,191 @@
+"""
+Per-thread conversation memory for /question follow-ups.
+
+Every /question replies in the channel's daily summary thread, so the thread
+(channel_id, thread_ts) is the conversation. Its Session keeps the earlier
+Q&A turns, the rows retrieved so far (with their messages.id), the
+embeddings of the questions they were retrieved for (anchors) and the
+newest messages.id it has looked at. A follow-up catches up on messages
+written since (one primary-key range read). Every /question of the day
+lands in the same thread, so the cached rows only stand in for retrieval
+when the follow-up is close to an anchor (cosine >= SESSION_RELATED);
+otherwise it retrieves its own top-k and adds it, and its anchor, to the
+session. The earlier turns carry what was already answered, so a
+follow-up's prompt holds only a delta of the rows: those its own terms or
+hits pick out, and those no earlier turn has seen (followup_rows), packed
+into a smaller message budget (packer.budget("followup")).
+
+    s = sessions.threads.get(channel_id, thread_ts, peer_id)   # None: first question (or evicted)
+    qvec = embeddings.embed_query(con, peer_id, question)       # None: not indexed, rows are the window
+    if s is None:
+        last_id = sessions.newest_id(con)      # before retrieval, so nothing written during it is missed
+        rows = ...                             # retrieval: (id, ts_utc, from_me, text), oldest first
+        s = sessions.threads.start(channel_id, thread_ts, peer_id, rows, last_id, anchor=qvec)
+    else:
+        s.catch_up(con)
+        if qvec is not None and s.similarity(qvec) < sessions.SESSION_RELATED:
+            hits = embeddings.question_context(con, peer_id, question, since_iso, qvec=qvec)
+            s.add(hits, anchor=qvec)
+        rows = s.followup_rows(lambda r: r[0] in hit_ids or relevance(r[3]) > 0)
+    ...
+    s.add_turn(question, answer)
+
+Sessions live in this process only. One idle for SESSION_TTL_S is dropped,
+the least recently used go once there are more than SESSION_MAX, a session
+keeps its last SESSION_TURNS turns and at most SESSION_ROWS rows (newest),
+so the cache stays under SESSION_MAX * SESSION_ROWS decoded messages.
+Edits to cached messages are not followed; the TTL bounds how stale they get.
+"""
+from __future__ import annotations
+import logging, os, sqlite3, threading, time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import metrics, timestamps
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", str(2 * 3600)))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "64"))
+SESSION_TURNS = int(os.getenv("SESSION_TURNS", "6"))
+SESSION_ROWS = int(os.getenv("SESSION_ROWS", "5000"))
+# a follow-up at least this close to one of the session's questions reuses its rows
+SESSION_RELATED = float(os.getenv("SESSION_RELATED", "0.5"))
+
+Key = Tuple[str, str]
+
+@dataclass
+class Session:
+    peer_id: int
+    rows: List[tuple]     # (id, ts_utc, from_me, text), oldest first
+    last_id: int          # newest messages.id seen when the rows were last brought up to date
+    answered_id: int = 0  # last_id as of the latest turn: rows after it are new to the thread
+    turns: List[Tuple[str, str]] = field(default_factory=list)   # (question, answer), oldest first
+    ids: Set[int] = field(default_factory=set)
+    anchors: List[Any] = field(default_factory=list)   # unit vectors of the questions rows were retrieved for
+    used: float = field(default_factory=time.monotonic)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self):
+        self.ids = {r[0] for r in self.rows}
+
+    def catch_up(self, con: sqlite3.Connection) -> int:
+        """Add the peer's messages written since last_id; returns how many."""
+        with self._lock, metrics.sql("sessions.catch_up"):
+            new = con.execute("""
+                SELECT id, ts_utc, from_me, text FROM messages
+                WHERE id > ? AND peer_id = ? ORDER BY id
+            """, (self.last_id, self.peer_id)).fetchall()
+            if new:
+                self.last_id = new[-1][0]
+                self._extend([tuple(r) for r in new if r[0] not in self.ids])
+        return len(new)
+
+    def similarity(self, qvec) -> float:
+        """Cosine of qvec to the closest anchor (0.0 with none)."""
+        return max((float(a @ qvec) for a in self.anchors), default=0.0)
+
+    def add(self, rows: Sequence[tuple], anchor=None) -> int:
+        """Merge rows (id, ts_utc, from_me, text) retrieved for anchor in; returns how many were new."""
+        with self._lock:
+            new = [tuple(r) for r in rows if r[0] not in self.ids]
+            self._extend(new)
+            if anchor is not None:
+                self.anchors.append(anchor)
+                del self.anchors[:-SESSION_TURNS]
+        return len(new)
+
+    def _extend(self, rows: Sequence[tuple]):
+        if not rows:
+            return
+        self.ids.update(r[0] for r in rows)
+        # ingest can write an old message late (backfill), so order by time, not id
+        key = lambda r: (timestamps.epoch(r[1]) or 0, r[0])
+        rows = sorted(rows, key=key)
+        merged = self.rows + rows
+        if self.rows and key(rows[0]) < key(self.rows[-1]):
+            merged.sort(key=key)
+        if len(merged) > SESSION_ROWS:
+            for r in merged[:-SESSION_ROWS]:
+                self.ids.discard(r[0])
+            merged = merged[-SESSION_ROWS:]
+        self.rows = merged
+
+    def followup_rows(self, relevant: Callable[[tuple], bool]) -> List[tuple]:
+        """The rows a follow-up sends, oldest first: those relevant(row) picks and those no turn has seen."""
+        with self._lock:
+            return [r for r in self.rows if r[0] > self.answered_id or relevant(r)]
+
+    def add_turn(self, question: str, answer: str):
+        with self._lock:
+            self.answered_id = self.last_id
+            self.turns.append((question, answer))
+            del self.turns[:-SESSION_TURNS]
+
+def newest_id(con: sqlite3.Connection) -> int:
+    return con.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+
+class Sessions:
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_sessions: int = SESSION_MAX):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._by_thread: "OrderedDict[Key, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, channel_id: str, thread_ts: str, peer_id: int) -> Optional[Session]:
+        """The thread's session if it is live and still about peer_id, most recently used last."""
+        key = (channel_id, thread_ts)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            s = self._by_thread.get(key)
+            if s is None or s.peer_id != peer_id:
+                self.misses += 1
+                return None
+            s.used = now
+            self._by_thread.move_to_end(key)
+            self.hits += 1
+            return s
+
+    def start(self, channel_id: str, thread_ts: str, peer_id: int, rows: Sequence[tuple],
+              last_id: int, anchor=None) -> Session:
+        """
+        A new session for the thread over rows ((id, ts_utc, from_me, text),
+        oldest first; a hot_window slice is fine), replacing any it had.
+        last_id is newest_id() from before the rows were read; anchor is the
+        question's embedding when the rows are its top-k.
+        """
+        s = Session(peer_id, [tuple(r) for r in rows[-SESSION_ROWS:]], last_id,
+                    anchors=[anchor] if anchor is not None else [])
+        with self._lock:
+            self._by_thread[(channel_id, thread_ts)] = s
+            self._by_thread.move_to_end((channel_id, thread_ts))
+            while len(self._by_thread) > self.max_sessions:
+                self._by_thread.popitem(last=False)
+                self.evicted += 1
+        return s
+
+    def _expire(self, now: float):
+        # oldest-used first, so stop at the first live one
+        while self._by_thread:
+            key, s = next(iter(self._by_thread.items()))
+            if now - s.used < self.ttl_s:
+                break
+            del self._by_thread[key]
+            self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._by_thread.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {"sessions": len(self._by_thread), "rows": sum(len(s.rows) for s in self._by_thread.values()),
+                    "hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+threads = Sessions()
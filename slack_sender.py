@@ -0,0 +1,265 @@
+"""
+The Slack Web API client shared by the daily job and the API.
+
+- One AsyncWebClient on one aiohttp session per process, so calls reuse a
+  keep-alive connection instead of paying a TLS handshake each.
+- call() retries 429s after Retry-After, and 5xx, connection errors and
+  timeouts with exponential backoff (SLACK_BACKOFF * 2^attempt, capped,
+  jittered), up to SLACK_MAX_RETRIES times.
+- channel_id(name) resolves a channel name through slack_channels
+  (name -> id, persisted, SLACK_CHANNEL_TTL seconds), so conversations.list
+  is paged only on a miss. forget(name) drops a stale entry.
+- post() is one chat.postMessage; it joins the channel and retries only
+  when Slack answers not_in_channel.
+- Every attempt is timed into slack_api_seconds{method}; failed attempts
+  count in slack_api_errors_total{method, error}.
+- LiveMessage is a thread reply that fills in while an answer streams: a
+  placeholder at once, chat.update every SLACK_UPDATE_INTERVAL seconds at
+  most, then the final text.
+
+    sender = SlackSender(token)
+    chan = await sender.channel_id("briefs")
+    await sender.post(chan, "hello")
+    await sender.aclose()
+"""
+from __future__ import annotations
+import asyncio, logging, os, random, sqlite3, time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import db, metrics
+
+logger = logging.getLogger(__name__)
+
+API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api/")
+MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", "4"))
+BACKOFF_S = float(os.getenv("SLACK_BACKOFF", "1.0"))
+BACKOFF_CAP_S = 30.0
+TIMEOUT_S = int(os.getenv("SLACK_TIMEOUT", "30"))
+CHANNEL_TTL_S = int(os.getenv("SLACK_CHANNEL_TTL", str(7 * 86400)))
+# chat.update is Tier 3 (~50/min per workspace); one edit a second leaves room for concurrent replies
+UPDATE_INTERVAL_S = float(os.getenv("SLACK_UPDATE_INTERVAL", "1.0"))
+
+# errors meaning a cached channel id no longer works
+STALE_CHANNEL_ERRORS = {"channel_not_found", "is_archived"}
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+# --- slack_channels: persisted name -> id ---
+
+def cached_channel(con: sqlite3.Connection, name: str, ttl_s: int = CHANNEL_TTL_S) -> Optional[str]:
+    row = con.execute("SELECT channel_id, resolved_utc FROM slack_channels WHERE name=?", (name,)).fetchone()
+    if not row:
+        return None
+    resolved = datetime.strptime(row[1], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return row[0] if _now() - resolved < timedelta(seconds=ttl_s) else None
+
+def remember_channels(con: sqlite3.Connection, pairs):
+    """Store (name, channel_id) pairs seen in a conversations.list page."""
+    now = _now().strftime("%Y-%m-%dT%H:%M:%SZ")
+    con.executemany("INSERT OR REPLACE INTO slack_channels(name, channel_id, resolved_utc) VALUES (?,?,?)",
+                    [(n, c, now) for n, c in pairs])
+    con.commit()
+
+def forget_channel(con: sqlite3.Connection, name: str):
+    con.execute("DELETE FROM slack_channels WHERE name=?", (name,))
+    con.commit()
+
+def _db(fn, *args):
+    with db.connection() as con:
+        return fn(con, *args)
+
+class SlackSender:
+    def __init__(self, token: Optional[str], base_url: str = API_URL, max_retries: int = MAX_RETRIES,
+                 backoff_s: float = BACKOFF_S, timeout_s: int = TIMEOUT_S):
+        self.token = token
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.timeout_s = timeout_s
+        self.retries = 0            # retried calls, for logs/metrics
+        self._session = None
+        self._client = None
+
+    def client(self):
+        """The AsyncWebClient, on a session created in the running loop."""
+        if self._client is None or self._session.closed:
+            import aiohttp
+            from slack_sdk.web.async_client import AsyncWebClient
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout_s))
+            # retries are ours (Retry-After aware), not slack_sdk's default connection-error handler
+            self._client = AsyncWebClient(token=self.token, base_url=self.base_url, timeout=self.timeout_s,
+                                          session=self._session, retry_handlers=[])
+        return self._client
+
+    async def aclose(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._client = None
+
+    def _delay(self, attempt: int) -> float:
+        d = min(BACKOFF_CAP_S, self.backoff_s * (2 ** attempt))
+        return d * (0.5 + random.random() / 2)
+
+    async def call(self, method: str, max_retries: Optional[int] = None, **kwargs):
+        """client.<method>(**kwargs) with retries; raises SlackApiError for non-retryable errors."""
+        import aiohttp
+        from slack_sdk.errors import SlackApiError
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                return await getattr(self.client(), method)(**kwargs)
+            except SlackApiError as e:
+                metrics.SLACK_ERRORS.inc(method=method, error=e.response.get("error") or e.response.status_code)
+                status = e.response.status_code
+                if attempt >= max_retries or not (status == 429 or status >= 500):
+                    raise
+                if status == 429:
+                    retry_after = e.response.headers.get("Retry-After") or e.response.headers.get("retry-after")
+                    delay = float(retry_after) if retry_after else self._delay(attempt)
+                else:
+                    delay = self._delay(attempt)
+                reason = f"HTTP {status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                metrics.SLACK_ERRORS.inc(method=method, error=type(e).__name__)
+                if attempt >= max_retries:
+                    raise
+                delay, reason = self._delay(attempt), type(e).__name__
+            finally:
+                took = time.perf_counter() - t0
+                metrics.SLACK_SECONDS.observe(took, method=method)
+                metrics.record("slack." + method, took)
+            attempt += 1
+            self.retries += 1
+            logger.warning("slack %s: %s, retry %d/%d in %.1fs", method, reason, attempt, max_retries, delay)
+            await asyncio.sleep(delay)
+
+    async def post(self, channel: str, text: str, thread_ts: Optional[str] = None):
+        from slack_sdk.errors import SlackApiError
+        try:
+            return await self.call("chat_postMessage", channel=channel, text=text, thread_ts=thread_ts)
+        except SlackApiError as e:
+            if e.response.get("error") != "not_in_channel":
+                raise
+        await self.call("conversations_join", channel=channel)
+        return await self.call("chat_postMessage", channel=channel, text=text, thread_ts=thread_ts)
+
+    async def channel_id(self, name: str, refresh: bool = False) -> str:
+        """Channel id for a name (without '#'), from slack_channels unless expired or refresh."""
+        name = name.lstrip("#")
+        if not refresh:
+            hit = await asyncio.to_thread(_db, cached_channel, name)
+            if hit:
+                return hit
+        cursor, found = None, None
+        while True:
+            page = await self.call("conversations_list", limit=1000, cursor=cursor,
+                                   exclude_archived=True, types="public_channel,private_channel")
+            chans = page.get("channels") or []
+            # every page fetched warms the cache for other names too
+            await asyncio.to_thread(_db, remember_channels, [(c["name"], c["id"]) for c in chans if c.get("name")])
+            found = found or next((c["id"] for c in chans if c.get("name") == name), None)
+            cursor = (page.get("response_metadata") or {}).get("next_cursor")
+            if found or not cursor:
+                break
+        if not found:
+            raise RuntimeError(f"Could not find channel named #{name}. Invite the bot to the channel and retry.")
+        return found
+
+    async def forget(self, name: str):
+        await asyncio.to_thread(_db, forget_channel, name.lstrip("#"))
+
+class LiveMessage:
+    """
+    A thread reply that fills in while the answer streams. Entering posts
+    the placeholder; append() shows the text so far, the first text at once
+    and then at most every interval_s; finish() edits in the final text.
+    Progress edits are best effort (no retries, failures skipped), the
+    placeholder and the final edit are not. An exception inside the block
+    turns the reply into an apology, or, when the job will be retried
+    (final=False), back into the placeholder. Given the ts of a reply an
+    earlier attempt posted, it edits that one instead of posting another.
+
+        async with LiveMessage(sender, chan, ts, prefix="*A:* ", command="/question",
+                               ts=job.get("reply_ts"), final=job.final) as live:
+            job.put("reply_ts", live.ts)
+            answer = await llm.acomplete(ai, system, user, on_text=live.append)
+            await live.finish(answer)
+
+    The first answer text is timed from construction (the job's start) into
+    slack_first_text_seconds{command}.
+    """
+
+    def __init__(self, sender: SlackSender, channel: str, thread_ts: Optional[str], prefix: str = "",
+                 placeholder: str = "Working…", command: str = "", interval_s: float = UPDATE_INTERVAL_S,
+                 ts: Optional[str] = None, final: bool = True):
+        self.sender = sender
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.prefix = prefix
+        self.placeholder = placeholder
+        self.command = command
+        self.interval_s = interval_s
+        self.ts = ts            # the reply, once posted (or as an earlier attempt left it)
+        self.final = final      # no retry after this: a failure gets the apology
+        self.updates = 0
+        self.done = False
+        self.first_text_s: Optional[float] = None
+        self._parts: list = []
+        self._shown = ""
+        self._last = 0.0
+        self._t0 = time.perf_counter()
+
+    async def __aenter__(self):
+        if self.ts is None:
+            posted = await self.sender.post(self.channel, self.prefix + self.placeholder, self.thread_ts)
+            self.ts = posted["ts"]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.done or self.ts is None:
+            return False
+        if exc_type is None:
+            await self.finish("".join(self._parts).strip() or self.placeholder)
+        elif issubclass(exc_type, Exception):
+            try:
+                # a retry picks this message up again; partial text from this attempt shouldn't stay up meanwhile
+                await self._chat_update("Sorry, something went wrong." if self.final else self.placeholder,
+                                        max_retries=0)
+            except Exception:
+                logger.exception("slack edit after a failed job failed")
+        return False
+
+    async def append(self, delta: str):
+        self._parts.append(delta)
+        if self.first_text_s is not None and time.perf_counter() - self._last < self.interval_s:
+            return
+        text = "".join(self._parts).strip()
+        if text and text != self._shown:
+            await self._edit(text + " …", final=False)
+            self._shown = text
+
+    async def finish(self, text: str):
+        await self._edit(text, final=True)
+        self.done = True
+
+    async def _chat_update(self, text: str, max_retries: Optional[int] = None):
+        return await self.sender.call("chat_update", channel=self.channel, ts=self.ts,
+                                      text=self.prefix + text, max_retries=max_retries)
+
+    async def _edit(self, text: str, final: bool):
+        try:
+            await self._chat_update(text, max_retries=None if final else 0)
+        except Exception as e:
+            if final:
+                raise
+            logger.warning("slack progress edit skipped: %s", e)
+            return
+        self._last = time.perf_counter()
+        self.updates += 1
+        if self.first_text_s is None:
+            self.first_text_s = self._last - self._t0
+            metrics.FIRST_TEXT_SECONDS.observe(self.first_text_s, command=self.command or "other")
@@ -1,27 +1,23 @@
-import sqlite3, textwrap
+import sqlite3, sys, textwrap
 from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import peers
+from packer import is_signal
 
+load_dotenv()
 DB="briefs.db"
 NOW_UTC=datetime.now(timezone.utc)
 SINCE=NOW_UTC - timedelta(days=1)  # last 24h for this demo
 
-FILLER = {"ok","okay","k","kk","thanks","thx","thank you","👍","👌","yo","hey","hi","hello","lol","haha","hahaha"}
-
-def is_signal(t: str)->bool:
-    s=t.strip().lower()
-    if not s: return False
-    if s in FILLER: return False
-    if len(s)<3: return False
-    return True
-
 con=sqlite3.connect(DB)
+PEER_ID=int(sys.argv[1]) if len(sys.argv) > 1 else peers.default_peer_id(con)
 cur=con.cursor()
 rows=cur.execute("""
   SELECT ts_utc, from_me, text
   FROM messages
-  WHERE peer_id=? AND ts_utc >= ?
-  ORDER BY ts_utc ASC
-""",(7740422022, SINCE.strftime("%Y-%m-%dT%H:%M:%SZ"))).fetchall()
+  WHERE peer_id=? AND ts_epoch >= ?
+  ORDER BY ts_epoch ASC
+""",(PEER_ID, int(SINCE.timestamp()))).fetchall()
 con.close()
 
 signals=[]
@@ -0,0 +1,105 @@
+"""
+The latest daily summary per Slack channel, held in process for the
+slash-command ack path.
+
+Every slash command needs the thread of the channel's latest summary, which
+changes once a day (post_daily_summary_slack.py / daily_runner insert it).
+get() is a dict lookup. A background task polls its own connection:
+PRAGMA data_version only changes when another connection committed, and
+MAX(summaries.id) then says whether summaries was among the writes, so
+ingest traffic costs one pragma per poll and a new summary is picked up
+within SUMMARY_POLL_S.
+
+    latest = summary_cache.LatestSummaries()
+    latest.start()                  # in the running loop
+    row = latest.get("C123")        # {"ts", "text", "date_label", "peer_id"} | None
+"""
+from __future__ import annotations
+import asyncio, logging, os, sqlite3, threading
+from typing import Dict, Optional
+
+import db, metrics, peers
+
+logger = logging.getLogger(__name__)
+
+POLL_S = float(os.getenv("SUMMARY_POLL_S", "1.0"))
+
+# one row per channel: the bare columns come from the MAX(posted_utc) row (SQLite guarantees this)
+_LATEST_SQL = """
+    SELECT channel_id, ts, text, date_label, peer_id, MAX(posted_utc)
+    FROM summaries GROUP BY channel_id
+"""
+
+def load_latest(con: sqlite3.Connection) -> Dict[str, dict]:
+    out = {}
+    for channel_id, ts, text, date_label, peer_id, _ in con.execute(_LATEST_SQL).fetchall():
+        if peer_id is None:
+            peer_id = peers.resolve(con, channel_id)
+        out[channel_id] = {"ts": ts, "text": text, "date_label": date_label, "peer_id": peer_id}
+    return out
+
+class LatestSummaries:
+    def __init__(self, path: Optional[str] = None, poll_s: float = POLL_S):
+        self.path = path
+        self.poll_s = poll_s
+        self.loads = 0
+        self._con: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._by_channel: Optional[Dict[str, dict]] = None
+        self._data_version: Optional[int] = None
+        self._stamp: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, channel_id: str) -> Optional[dict]:
+        """The channel's latest summary; no database access once loaded."""
+        if self._by_channel is None:
+            self.refresh()
+        return self._by_channel.get(channel_id)
+
+    def refresh(self) -> bool:
+        """Reload if summaries changed since the last check; True if it reloaded."""
+        with self._lock:
+            if self._con is None:
+                self._con = db.open_connection(self.path)
+            dv = self._con.execute("PRAGMA data_version").fetchone()[0]
+            if dv == self._data_version and self._by_channel is not None:
+                return False
+            self._data_version = dv
+            stamp = self._con.execute("SELECT MAX(id) FROM summaries").fetchone()[0] or 0
+            if stamp == self._stamp and self._by_channel is not None:
+                return False
+            with metrics.sql("summary_cache.load_latest"):
+                by_channel = load_latest(self._con)
+            self._by_channel = by_channel   # swapped whole; readers never see a partial dict
+            self._stamp = stamp
+            self.loads += 1
+            return True
+
+    async def _poll(self):
+        while True:
+            try:
+                if await asyncio.to_thread(self.refresh):
+                    logger.info("summary cache reloaded: %d channels", len(self._by_channel))
+            except Exception:
+                logger.exception("summary cache refresh failed")
+            await asyncio.sleep(self.poll_s)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+
+    def stats(self) -> dict:
+        return {"channels": len(self._by_channel or {}), "stamp": self._stamp, "loads": self.loads}
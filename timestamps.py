@@ -0,0 +1,72 @@
+"""
+Message timestamps. messages.ts_utc is text in whatever format its writer
+used (Telethon's 2025-10-01T09:15:00Z, SQLite's datetime('now') with a
+space and no Z, isoformat() with offsets or microseconds, bare epoch
+numbers); messages.ts_epoch is the same instant as integer epoch seconds,
+computed by SQLite (epoch_sql, see db_migrate.migrate_ts_epoch). Queries
+compare and sort on ts_epoch, and take their bounds through epoch().
+
+    timestamps.epoch("2025-10-01T09:15:00Z")    # 1759310100 (also datetimes, numbers, other ISO forms)
+    timestamps.iso(1759310100)                  # "2025-10-01T09:15:00Z"
+    timestamps.local_date("2025-10-01T09:15:00Z")   # "1 Oct 2025" (Brisbane)
+
+Strings parse with datetime.fromisoformat (C, every format above), and
+local dates are cached per quarter hour, since no zone's offset changes
+between quarter hours.
+"""
+from __future__ import annotations
+import math, time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+TZ = ZoneInfo("Australia/Brisbane")
+TS_FMT = "%Y-%m-%dT%H:%M:%SZ"
+
+def epoch_sql(ts: str = "ts_utc") -> str:
+    """SQL for the epoch seconds of the ts_utc-style expression ts, matching epoch(): numbers as-is, dates through strftime."""
+    return (f"CASE WHEN {ts} GLOB '[0-9]*' AND {ts} NOT GLOB '*[^0-9.]*' "
+            f"THEN CAST({ts} AS INTEGER) ELSE CAST(strftime('%s', {ts}) AS INTEGER) END")
+
+def epoch(value) -> Optional[int]:
+    """Epoch seconds (rounded down) of a ts_utc value or a datetime (naive = UTC); None if unparseable."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return math.floor(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return math.floor(value.timestamp())
+    s = str(value)
+    if s[4:5] != "-":   # not a date: a bare epoch number, as epoch_sql reads it
+        try:
+            return math.floor(float(s))
+        except (ValueError, OverflowError):
+            return None
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))   # Python < 3.11
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return math.floor(dt.timestamp())
+
+def iso(ts: int) -> str:
+    """Epoch seconds -> ts_utc in TS_FMT."""
+    return time.strftime(TS_FMT, time.gmtime(ts))
+
+@lru_cache(maxsize=8192)
+def _local(quarter: int, fmt: str, tz) -> str:
+    return datetime.fromtimestamp(quarter * 900, tz).strftime(fmt)
+
+def local_date(value, fmt: str = "%-d %b %Y", tz=TZ) -> Optional[str]:
+    """The local date of a ts_utc value (or epoch/datetime) in fmt, which shows no time of day; None if unparseable."""
+    ts = value if isinstance(value, int) else epoch(value)
+    if ts is None:
+        return None
+    return _local(ts // 900, fmt, tz)